@@ -0,0 +1,306 @@
+"""Measure the performance of payday on synthetic donation graphs.
+
+Usage: python -m liberapay.billing.benchmark [--scales 1,10] [--seed 0] [--wipe]
+       python -m liberapay.billing.benchmark --transfers-scale 20
+
+Warning: this script empties the database before each run, so it must only be
+used with a dedicated database.
+
+The second form times the aggregations of the `transfers` table instead, and
+fills the database with `fake_data.populate_db_bulk` if it doesn't contain any
+transfers yet. Scale 20 results in roughly a million transfers.
+"""
+
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from inspect import getattr_static
+import json
+import random
+import sys
+from time import perf_counter
+
+from pando.utils import utcnow
+from postgres.cursors import SimpleCursorBase
+from psycopg2.extras import execute_values
+
+from liberapay.billing.payday import Payday
+from liberapay.constants import DONATION_LIMITS
+from liberapay.i18n.currencies import Money
+
+
+#: The size of the graph at scale 1.
+BASE_SCALE = dict(participants=1000, tips=3000, teams=20, members=(2, 6))
+
+#: The payday methods that are timed. Nested calls are recorded separately.
+STAGES = (
+    'prepare', 'transfer_virtually', 'settle_in_memory', 'transfer_takes',
+    'transfer_for_real', 'recompute_stats', 'update_stats', 'update_cached_amounts',
+    'notify_participants',
+)
+
+
+class StageRecorder:
+    """Record the duration and number of queries of payday stages.
+    """
+
+    def __init__(self):
+        self.n_queries = 0
+        self.stack = []
+        self.stages = {}
+
+    def record(self, name, func):
+        def f(*args, **kw):
+            self.stack.append(name)
+            key = '/'.join(self.stack)
+            n_queries, start = self.n_queries, perf_counter()
+            try:
+                return func(*args, **kw)
+            finally:
+                stage = self.stages.setdefault(key, dict(calls=0, seconds=0, queries=0))
+                stage['calls'] += 1
+                stage['seconds'] += perf_counter() - start
+                stage['queries'] += self.n_queries - n_queries
+                self.stack.pop()
+        f.__name__ = func.__name__
+        return f
+
+    @contextmanager
+    def patch(self):
+        originals = {name: getattr_static(Payday, name) for name in STAGES}
+        execute = SimpleCursorBase.execute
+
+        def counting_execute(cursor, *args, **kw):
+            self.n_queries += 1
+            return execute(cursor, *args, **kw)
+
+        try:
+            for name, attr in originals.items():
+                if isinstance(attr, (staticmethod, classmethod)):
+                    setattr(Payday, name, type(attr)(self.record(name, attr.__func__)))
+                else:
+                    setattr(Payday, name, self.record(name, attr))
+            SimpleCursorBase.execute = counting_execute
+            yield self
+        finally:
+            SimpleCursorBase.execute = execute
+            for name, attr in originals.items():
+                setattr(Payday, name, attr)
+
+
+def random_amount(rng, currency):
+    minimum, maximum = DONATION_LIMITS[currency]['weekly']
+    maximum = min(maximum, minimum * 1000)
+    amount = minimum.amount + Decimal(rng.random()) * (maximum.amount - minimum.amount)
+    return Money(amount, currency).round()
+
+
+def populate_graph(db, rng, participants=1000, tips=3000, teams=20, members=(2, 6),
+                   currencies=('EUR', 'USD', 'JPY')):
+    """Insert a synthetic donation graph into the database.
+
+    The graph is entirely determined by the state of `rng`.
+    """
+    now = utcnow()
+    join_time = now - timedelta(days=365)
+    with db.get_cursor() as cursor:
+        individuals = execute_values(cursor, """
+            INSERT INTO participants
+                        (username, kind, status, join_time, main_currency)
+                 VALUES %s
+              RETURNING id, main_currency
+        """, [
+            (f'bench{i}', 'individual', 'active', join_time, rng.choice(currencies))
+            for i in range(participants)
+        ], fetch=True)
+        groups = execute_values(cursor, """
+            INSERT INTO participants
+                        (username, kind, status, join_time, main_currency)
+                 VALUES %s
+              RETURNING id, main_currency
+        """, [
+            (f'benchteam{i}', 'group', 'active', join_time, rng.choice(currencies))
+            for i in range(teams)
+        ], fetch=True)
+        takes = []
+        for team in groups:
+            for member in rng.sample(individuals, min(rng.randint(*members), len(individuals))):
+                currency = member.main_currency
+                if rng.random() < 0.5:
+                    amount = Money(-1, currency)
+                else:
+                    amount = random_amount(rng, currency)
+                advance = random_amount(rng, currency) * rng.randint(0, 20)
+                takes.append((
+                    join_time, member.id, team.id, amount, member.id,
+                    advance or None,
+                ))
+        execute_values(cursor, """
+            INSERT INTO takes
+                        (ctime, member, team, amount, recorder, paid_in_advance,
+                         actual_amount)
+                 SELECT x.ctime, x.member, x.team, x.amount, x.recorder,
+                        x.paid_in_advance, empty_currency_basket()
+                   FROM (VALUES %s) AS x (ctime, member, team, amount, recorder, paid_in_advance)
+        """, takes)
+        tippees = individuals + groups
+        pairs = set()
+        max_tips = min(tips, len(individuals) * (len(tippees) - 1))
+        while len(pairs) < max_tips:
+            tipper, tippee = rng.choice(individuals), rng.choice(tippees)
+            if tipper.id != tippee.id:
+                pairs.add((tipper.id, tippee.id))
+        rows = []
+        for tipper, tippee in sorted(pairs):
+            currency = rng.choice(currencies)
+            amount = random_amount(rng, currency)
+            r = rng.random()
+            if r < 0.7:
+                advance = amount * rng.randint(1, 52)
+            elif r < 0.85:
+                advance = (amount * Decimal(rng.random())).round()
+            else:
+                advance = None
+            ctime = join_time + timedelta(seconds=rng.randrange(86400 * 300))
+            rows.append((ctime, tipper, tippee, amount, 'weekly', amount, advance or None))
+        execute_values(cursor, """
+            INSERT INTO tips
+                        (ctime, mtime, tipper, tippee, amount, period,
+                         periodic_amount, paid_in_advance, visibility)
+                 SELECT x.ctime, x.ctime, x.tipper, x.tippee, x.amount, x.period::donation_period,
+                        x.periodic_amount, x.paid_in_advance, 1
+                   FROM (VALUES %s) AS x (ctime, tipper, tippee, amount, period,
+                                          periodic_amount, paid_in_advance)
+        """, rows)
+    return dict(
+        participants=len(individuals), teams=len(groups), takes=len(takes),
+        tips=len(rows),
+    )
+
+
+def wipe_db(db):
+    """Empty all the tables filled by `populate_graph` and by payday.
+    """
+    db.run("TRUNCATE participants, paydays RESTART IDENTITY CASCADE")
+
+
+def run_benchmark(db, seed=0, scale=1, currencies=('EUR', 'USD', 'JPY')):
+    """Populate the database and time a payday, then an update of cached amounts.
+
+    Returns a dict that can be serialized to JSON.
+    """
+    rng = random.Random(seed)
+    sizes = dict(BASE_SCALE)
+    for k in ('participants', 'tips', 'teams'):
+        sizes[k] = int(sizes[k] * scale)
+    result = dict(seed=seed, scale=scale, currencies=list(currencies))
+    start = perf_counter()
+    result['graph'] = populate_graph(db, rng, currencies=currencies, **sizes)
+    result['populate_seconds'] = perf_counter() - start
+    with StageRecorder().patch() as recorder:
+        start = perf_counter()
+        Payday.start().run(keep_log=False)
+        result['payday_seconds'] = perf_counter() - start
+        result['payday_stages'] = recorder.stages
+        recorder.stages = {}
+        recorder.n_queries = 0
+        start = perf_counter()
+        Payday.update_cached_amounts()
+        result['update_cached_amounts_seconds'] = perf_counter() - start
+        result['update_cached_amounts_stages'] = recorder.stages
+    return result
+
+
+def run_transfers_benchmark(website, scale=20, seed=0, repeat=3, recipients=10):
+    """Time `Payday.recompute_stats` and the charts of the biggest recipients.
+
+    Returns a dict that can be serialized to JSON. The timings are the best of
+    `repeat` runs.
+    """
+    from pando.testing.client import Client
+    from liberapay.utils.fake_data import populate_db_bulk
+
+    db = website.db
+    if not db.one("SELECT 1 FROM transfers LIMIT 1"):
+        random.seed(seed)
+        populate_db_bulk(website, scale)
+    result = dict(
+        seed=seed, scale=scale,
+        transfers=db.one("SELECT count(*) FROM transfers"),
+        paydays=db.one("SELECT count(*) FROM paydays"),
+    )
+    usernames = db.all("""
+        SELECT p.username
+          FROM transfers t
+          JOIN participants p ON p.id = t.tippee
+         WHERE NOT p.hide_receiving
+      GROUP BY p.username
+      ORDER BY count(*) DESC
+         LIMIT %s
+    """, (recipients,))
+    client = Client()
+    client._website = website
+
+    def get_charts():
+        for username in usernames:
+            client.GET(f'/{username}/charts.json')
+
+    for name, func in (('update_stats', Payday.recompute_stats), ('charts', get_charts)):
+        timings = []
+        for i in range(repeat):
+            start = perf_counter()
+            func()
+            timings.append(perf_counter() - start)
+        result[name + '_seconds'] = min(timings)
+    return result
+
+
+def main(argv=None):
+    parser = ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scales', default='1', help="comma-separated scale factors")
+    parser.add_argument('--seed', default=0, type=int)
+    parser.add_argument('--currencies', default='EUR,USD,JPY')
+    parser.add_argument('--wipe', action='store_true', help="empty a non-empty database")
+    parser.add_argument('--output', help="path of the JSON file to write the results to")
+    parser.add_argument(
+        '--transfers-scale', type=Decimal,
+        help="time the aggregations of transfers at this scale instead of running paydays",
+    )
+    args = parser.parse_args(argv)
+
+    from liberapay.main import website
+    if website.env.instance_type == 'production':
+        raise SystemExit("Refusing to run in production.")
+    db = website.db
+    if args.transfers_scale:
+        write_output(args.output, run_transfers_benchmark(
+            website, scale=args.transfers_scale, seed=args.seed,
+        ))
+        return
+    if db.one("SELECT count(*) FROM participants") and not args.wipe:
+        raise SystemExit("The database isn't empty. Use --wipe to empty it.")
+
+    results = []
+    for scale in args.scales.split(','):
+        wipe_db(db)
+        print(f"Running the benchmark at scale {scale}", file=sys.stderr)
+        results.append(run_benchmark(
+            db, seed=args.seed, scale=Decimal(scale),
+            currencies=args.currencies.split(','),
+        ))
+    wipe_db(db)
+    write_output(args.output, results)
+
+
+def write_output(path, results):
+    output = json.dumps(results, indent=4, default=str)
+    if path:
+        with open(path, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
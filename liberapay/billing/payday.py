@@ -1,6 +1,9 @@
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date, timedelta
 from decimal import Decimal, ROUND_UP
+from io import StringIO
 from itertools import chain
+import multiprocessing
 from operator import attrgetter
 import os
 import os.path
@@ -9,12 +12,16 @@ import sys
 
 from babel.dates import format_timedelta
 import pando.utils
+from psycopg2.extras import execute_values
 import requests
 
 from liberapay import constants
-from liberapay.i18n.currencies import D_CENT, Money, MoneyBasket
+from liberapay.i18n.currencies import (
+    D_CENT, Money, MoneyBasket, set_currency_exchange_rates,
+)
 from liberapay.payin.common import resolve_amounts
 from liberapay.utils import group_by
+from liberapay.utils.http_caching import invalidate_cached_responses
 from liberapay.website import website
 
 
@@ -155,8 +162,11 @@ class Payday:
         self.db.run("DROP TABLE payday_transfers")
 
     @staticmethod
-    def prepare(cursor, ts_start):
+    def prepare(cursor, ts_start, participant_ids=None):
         """Prepare the DB: we need temporary tables with indexes and triggers.
+
+        If `participant_ids` is specified, then only those participants and the
+        tips and takes between them are loaded.
         """
         cursor.run("""
 
@@ -176,6 +186,7 @@ class Payday:
              WHERE join_time < %(ts_start)s
                AND is_suspended IS NOT true
                AND status <> 'stub'
+               AND (%(participant_ids)s::bigint[] IS NULL OR id = ANY(%(participant_ids)s))
           ORDER BY join_time;
 
         CREATE UNIQUE INDEX ON payday_participants (id);
@@ -312,11 +323,13 @@ class Payday:
             END;
         $$ LANGUAGE plpgsql;
 
-        """, dict(ts_start=ts_start))
+        """, dict(ts_start=ts_start, participant_ids=participant_ids))
         log("Prepared the DB.")
 
     @staticmethod
     def transfer_virtually(cursor, ts_start, payday_id):
+        if website.env.payday_in_memory:
+            return Payday.settle_in_memory(cursor, payday_id)
         cursor.run("SELECT settle_tip_graph();")
         teams = cursor.all("""
             SELECT id, main_currency FROM payday_participants WHERE kind = 'group';
@@ -376,6 +389,141 @@ class Payday:
         cursor.run("UPDATE payday_participants SET leftover = %s WHERE id = %s",
                    (leftover, team_id))
 
+    @staticmethod
+    def settle_in_memory(cursor, payday_id):
+        """Settle the tip graph in Python.
+
+        The results are the same as those of `settle_tip_graph()` and
+        `transfer_takes`, but the `payday_*` tables are loaded in bulk and the
+        transfers are written back with a single `COPY`, instead of making
+        round trips for every team and every take transfer.
+        """
+        tips = cursor.all("""
+            SELECT t.id, t.tipper, t.tippee, t.amount AS full_amount, t.to_team
+                 , t.paid_in_advance, t.past_transfers_sum
+              FROM payday_tips t
+        """)
+        teams = cursor.all("""
+            SELECT id, main_currency FROM payday_participants WHERE kind = 'group';
+        """)
+        takes_by_team = group_by(cursor.all("""
+            SELECT t.team, t.member, t.amount, t.paid_in_advance
+                 , p.main_currency, p.accepted_currencies
+              FROM payday_takes t
+              JOIN payday_participants p ON p.id = t.member
+        """), 'team', attr=True)
+        advances = {}
+        transfers = []
+
+        def transfer(tipper, tippee, amount, context, team):
+            # Same logic as the `transfer()` SQL function created by `prepare`.
+            if amount == 0:
+                return
+            advance = advances[(tipper, team or tippee)]
+            transfers.append((tipper, tippee, min(amount, advance), context, team))
+
+        # Settle the one-to-one donations
+        funded_tips = set()
+        partial_tips = []
+        tips_by_team = {}
+        for tip in tips:
+            advances[(tip.tipper, tip.tippee)] = tip.paid_in_advance
+            funding = max(tip.paid_in_advance, tip.paid_in_advance.zero())
+            if tip.to_team:
+                if funding > 0:
+                    tip.is_funded = funding >= tip.full_amount
+                    tips_by_team.setdefault(tip.tippee, []).append(tip)
+            elif funding >= tip.full_amount:
+                funded_tips.add(tip.id)
+                transfer(tip.tipper, tip.tippee, tip.full_amount, 'tip', None)
+            else:
+                partial_tips.append((tip, funding))
+        for tip, funding in partial_tips:
+            transfer(tip.tipper, tip.tippee, funding, 'partial-tip', None)
+        del partial_tips
+
+        # Compute the missing `past_transfers_sum` values in a single query
+        tip_ids = [
+            tip.id for team_tips in tips_by_team.values() for tip in team_tips
+            if tip.past_transfers_sum is None
+        ]
+        if tip_ids:
+            past_transfers_sums = dict(cursor.all("""
+                UPDATE tips t
+                   SET past_transfers_sum = coalesce_currency_amount((
+                           SELECT sum(tr.amount, t.amount::currency)
+                             FROM transfers tr
+                            WHERE tr.tipper = t.tipper
+                              AND tr.team = t.tippee
+                              AND tr.context IN ('take', 'partial-take', 'leftover-take')
+                              AND tr.status = 'succeeded'
+                       ), t.amount::currency)
+                 WHERE t.id = ANY(%s)
+             RETURNING t.id, t.past_transfers_sum
+            """, (tip_ids,)))
+            for team_tips in tips_by_team.values():
+                for tip in team_tips:
+                    if tip.past_transfers_sum is None:
+                        tip.past_transfers_sum = past_transfers_sums[tip.id]
+        del tip_ids
+
+        # Resolve the takes of each team, possibly in parallel
+        for team_tips in tips_by_team.values():
+            for tip in team_tips:
+                if tip.is_funded:
+                    funded_tips.add(tip.id)
+        teams_args = [
+            (tips_by_team.get(team_id, []), takes_by_team.get(team_id, []), currency, payday_id)
+            for team_id, currency in teams
+        ]
+        processes = website.env.payday_processes
+        if processes > 1 and len(teams) > 1:
+            # Payday can run in a cron thread of a multi-threaded web worker,
+            # so the pool's processes mustn't be forked from it: they would
+            # inherit its database connections and possibly held locks.
+            with ProcessPoolExecutor(
+                processes,
+                mp_context=multiprocessing.get_context('forkserver'),
+                initializer=set_currency_exchange_rates,
+                initargs=(website.currency_exchange_rates,),
+            ) as pool:
+                results = list(pool.map(
+                    resolve_team_takes, teams_args,
+                    chunksize=max(len(teams) // (processes * 4), 1),
+                ))
+        else:
+            results = map(resolve_team_takes, teams_args)
+        del teams_args
+        leftovers = []
+        for (team_id, currency), (take_transfers, leftover) in zip(teams, results):
+            for t in take_transfers:
+                context = 'leftover-take' if t.is_leftover else 'partial-take' if t.is_partial else 'take'
+                transfer(t.tipper, t.member, t.amount, context, team_id)
+            leftovers.append((team_id, leftover))
+
+        # Write the results back into the DB
+        cursor.run("""
+            UPDATE payday_tips SET is_funded = (id = ANY(%s));
+        """, (list(funded_tips),))
+        execute_values(cursor, """
+            UPDATE payday_participants p
+               SET leftover = x.leftover
+              FROM (VALUES %s) x (id, leftover)
+             WHERE p.id = x.id
+        """, leftovers)
+        null = r'\N'
+        buffer = StringIO()
+        for tipper, tippee, amount, context, team in transfers:
+            buffer.write(
+                f"{tipper}\t{tippee}\t({amount.amount},{amount.currency})\t"
+                f"{context}\t{null if team is None else team}\n"
+            )
+        buffer.seek(0)
+        cursor.copy_expert("""
+            COPY payday_transfers (tipper, tippee, amount, context, team) FROM STDIN
+        """, buffer)
+        log(f"Settled the tip graph in memory (n_transfers={len(transfers)}).")
+
     @staticmethod
     def resolve_takes(tips, takes, ref_currency, payday_id):
         """Resolve many-to-many donations (team takes)
@@ -596,8 +744,104 @@ class Payday:
 
     def transfer_for_real(self, transfers):
         print("Starting transfers (n=%i)" % len(transfers))
-        for t in transfers:
-            self.record_transfer(t)
+        batch_size = website.env.payday_transfers_batch_size
+        if batch_size > 1:
+            for i in range(0, len(transfers), batch_size):
+                self.record_transfers(transfers[i:i+batch_size])
+        else:
+            for t in transfers:
+                self.record_transfer(t)
+
+    def record_transfers(self, transfers):
+        """Record a batch of transfers in a single transaction.
+
+        This has the same effects as calling `record_transfer` for each
+        transfer, but uses set-based queries instead of three per transfer.
+        """
+        log(f"Recording transfers #{transfers[0].id} to #{transfers[-1].id}")
+        args = dict(
+            tippers=[t.tipper for t in transfers],
+            tippees=[t.tippee for t in transfers],
+            amounts=[t.amount for t in transfers],
+            contexts=[t.context for t in transfers],
+            teams=[t.team for t in transfers],
+            invoices=[t.invoice for t in transfers],
+        )
+        with self.db.get_cursor() as cursor:
+            cursor.run("""
+                INSERT INTO transfers
+                            (tipper, tippee, amount, context,
+                             team, invoice, status,
+                             wallet_from, wallet_to, virtual)
+                     SELECT x.tipper, x.tippee, x.amount, x.context,
+                            x.team, x.invoice, 'succeeded',
+                            'x', 'y', true
+                       FROM unnest(
+                                %(tippers)s::bigint[], %(tippees)s::bigint[],
+                                %(amounts)s::currency_amount[],
+                                %(contexts)s::transfer_context[],
+                                %(teams)s::bigint[], %(invoices)s::int[]
+                            ) WITH ORDINALITY
+                            AS x (tipper, tippee, amount, context, team, invoice, n)
+                   ORDER BY x.n;
+
+                WITH transfer_sums AS (
+                         SELECT x.tipper, coalesce(x.team, x.tippee) AS tippee
+                              , sum(x.amount) AS amount
+                           FROM unnest(
+                                    %(tippers)s::bigint[], %(tippees)s::bigint[],
+                                    %(amounts)s::currency_amount[], %(teams)s::bigint[]
+                                ) AS x (tipper, tippee, amount, team)
+                       GROUP BY x.tipper, coalesce(x.team, x.tippee)
+                     )
+                   , latest_tips AS (
+                         SELECT DISTINCT ON (t.tipper, t.tippee)
+                                t.tipper, t.tippee, t.mtime, ts.amount
+                           FROM transfer_sums ts
+                           JOIN tips t ON t.tipper = ts.tipper AND t.tippee = ts.tippee
+                       ORDER BY t.tipper, t.tippee, t.mtime DESC
+                     )
+                UPDATE tips t
+                   SET paid_in_advance = (t.paid_in_advance - lt.amount)
+                     , past_transfers_sum = t.past_transfers_sum + lt.amount
+                  FROM latest_tips lt
+                 WHERE t.tipper = lt.tipper
+                   AND t.tippee = lt.tippee
+                   AND t.mtime >= lt.mtime;
+
+                WITH take_transfers AS (
+                         SELECT x.team, x.tippee AS member, x.amount
+                           FROM unnest(
+                                    %(tippees)s::bigint[], %(amounts)s::currency_amount[],
+                                    %(teams)s::bigint[]
+                                ) AS x (tippee, amount, team)
+                          WHERE x.team IS NOT NULL
+                     )
+                   , latest_takes AS (
+                         SELECT DISTINCT ON (t.team, t.member) t.*
+                           FROM takes t
+                          WHERE (t.team, t.member) IN (SELECT tt.team, tt.member FROM take_transfers tt)
+                            AND t.amount IS NOT NULL
+                       ORDER BY t.team, t.member, t.mtime DESC
+                     )
+                   , take_sums AS (
+                         SELECT tt.team, tt.member
+                              , sum(convert(tt.amount, lt.amount::currency)) AS amount
+                           FROM take_transfers tt
+                           JOIN latest_takes lt ON lt.team = tt.team AND lt.member = tt.member
+                       GROUP BY tt.team, tt.member
+                     )
+                UPDATE takes t
+                   SET paid_in_advance = (
+                           coalesce_currency_amount(lt.paid_in_advance, lt.amount::currency) -
+                           ts.amount
+                       )
+                  FROM latest_takes lt
+                  JOIN take_sums ts ON ts.team = lt.team AND ts.member = lt.member
+                 WHERE t.team = lt.team
+                   AND t.member = lt.member
+                   AND t.mtime >= lt.mtime;
+            """, args)
 
     def record_transfer(self, t):
         log(f"Recording transfer #{t.id} (amount={t.amount} context={t.context} team={t.team})")
@@ -777,6 +1021,49 @@ class Payday:
 
         """, locals())
         log("Updated stats of payday #%i." % payday_id)
+        cls.update_recipient_stats(payday_id)
+
+    @classmethod
+    def update_recipient_stats(cls, payday_id):
+        """Recompute the per-recipient stats used by the `charts.json` endpoint.
+
+        A transfer is attributed to the first payday that ended after it.
+        """
+        ts_end = cls.db.one("SELECT ts_end FROM paydays WHERE id = %s", (payday_id,))
+        previous_ts_end = cls.db.one("""
+            SELECT ts_end
+              FROM paydays
+             WHERE ts_end < %s
+               AND ts_end > ts_start
+          ORDER BY ts_end DESC
+             LIMIT 1
+        """, (ts_end,), default=constants.EPOCH)
+        with cls.db.get_cursor() as cursor:
+            cursor.run("DELETE FROM payday_recipient_stats WHERE payday = %s", (payday_id,))
+            cursor.run("""
+                WITH our_transfers AS (
+                         SELECT *
+                           FROM transfers t
+                          WHERE t.timestamp >= %(previous_ts_end)s
+                            AND t.timestamp < %(ts_end)s
+                            AND t.status = 'succeeded'
+                            AND t.context IN ('tip', 'take', 'partial-take')
+                     )
+                INSERT INTO payday_recipient_stats
+                            (payday, recipient, npatrons, receipts)
+                     SELECT %(payday_id)s, t.recipient
+                          , count(DISTINCT t.tipper), basket_sum(t.amount)
+                       FROM ( SELECT t.tippee AS recipient, t.tipper, t.amount
+                                FROM our_transfers t
+                                JOIN participants tippee ON tippee.id = t.tippee
+                               WHERE tippee.kind <> 'group'
+                               UNION ALL
+                              SELECT t.team AS recipient, t.tipper, t.amount
+                                FROM our_transfers t
+                               WHERE t.team IS NOT NULL
+                            ) t
+                   GROUP BY t.recipient
+            """, locals())
 
     @classmethod
     def recompute_stats(cls, limit=None):
@@ -791,10 +1078,30 @@ class Payday:
             cls.update_stats(payday_id)
 
     @classmethod
-    def update_cached_amounts(cls):
+    def update_cached_amounts(cls, incremental=False):
+        """Recompute the `giving`, `taking`, `receiving`, `npatrons`,
+        `nteampatrons` and `leftover` columns of participants.
+
+        In incremental mode, only the participants which are affected by the
+        changes recorded in the `dirty_participants` table are updated.
+        """
         now = pando.utils.utcnow()
         with cls.db.get_cursor() as cursor:
             cursor.run("LOCK TABLE takes IN EXCLUSIVE MODE")
+            if incremental:
+                # Don't run while a payday is in progress, since `prepare`
+                # would drop the `payday_transfers` table it's working on.
+                cursor.run("LOCK TABLE paydays IN SHARE MODE")
+                if cursor.one("SELECT 1 FROM paydays WHERE stage IS NOT NULL LIMIT 1"):
+                    log("Not updating the cached amounts: a payday is in progress.")
+                    return
+                targets, loaded = cls.get_dirty_scope(cursor)
+                if not targets:
+                    return
+            else:
+                cursor.run("DELETE FROM dirty_participants")
+                targets = loaded = None
+            args = dict(targets=targets)
             payday_id = cursor.one("""
                 SELECT id
                   FROM paydays
@@ -802,7 +1109,7 @@ class Payday:
               ORDER BY id DESC
                  LIMIT 1
             """, default=0) + 1
-            cls.prepare(cursor, now)
+            cls.prepare(cursor, now, participant_ids=loaded)
             cls.transfer_virtually(cursor, now, payday_id)
             cursor.run("""
             CREATE INDEX ON payday_transfers (tippee);
@@ -834,10 +1141,11 @@ class Payday:
                        FROM current_tips t2
                        JOIN participants tippee_p ON tippee_p.id = t2.tippee
                       WHERE tippee_p.status = 'stub'
+                        AND (%(targets)s::bigint[] IS NULL OR t2.tippee = ANY(%(targets)s))
                    ) t2
              WHERE t2.id = t.id
                AND t.is_funded <> t2.is_funded;
-            """)
+            """, args)
             cursor.run("""
             UPDATE participants p
                SET receiving = p2.receiving
@@ -852,13 +1160,14 @@ class Payday:
                        JOIN participants p2 ON p2.id = t.tippee
                       WHERE p2.status = 'stub'
                         AND t.is_funded
+                        AND (%(targets)s::bigint[] IS NULL OR p2.id = ANY(%(targets)s))
                    GROUP BY p2.id
                    ) p2
              WHERE p.id = p2.id
                AND p.receiving <> p2.receiving
                AND p.npatrons <> p2.npatrons
                AND p.status = 'stub';
-            """)
+            """, args)
             cursor.run("""
             UPDATE takes t
                SET actual_amount = t2.actual_amount
@@ -871,10 +1180,11 @@ class Payday:
                                    AND tr.context IN ('take', 'partial-take')
                             ) AS actual_amount
                        FROM current_takes t2
+                      WHERE (%(targets)s::bigint[] IS NULL OR t2.team = ANY(%(targets)s))
                    ) t2
              WHERE t.id = t2.id
                AND coalesce_currency_basket(t.actual_amount) <> t2.actual_amount;
-            """)
+            """, args)
             cursor.run("""
             UPDATE participants p
                SET giving = p2.giving
@@ -886,10 +1196,11 @@ class Payday:
                                    AND t.is_funded
                             ), p2.main_currency) AS giving
                        FROM participants p2
+                      WHERE (%(targets)s::bigint[] IS NULL OR p2.id = ANY(%(targets)s))
                    ) p2
              WHERE p.id = p2.id
                AND p.giving <> p2.giving;
-            """)
+            """, args)
             cursor.run("""
             UPDATE participants p
                SET taking = p2.taking
@@ -901,10 +1212,11 @@ class Payday:
                                    AND context IN ('take', 'partial-take')
                             ), p2.main_currency) AS taking
                        FROM participants p2
+                      WHERE (%(targets)s::bigint[] IS NULL OR p2.id = ANY(%(targets)s))
                    ) p2
              WHERE p.id = p2.id
                AND p.taking <> p2.taking;
-            """)
+            """, args)
             cursor.run("""
             UPDATE participants p
                SET receiving = p2.receiving
@@ -916,21 +1228,23 @@ class Payday:
                                    AND t.is_funded
                             ), p2.main_currency) AS receiving
                        FROM participants p2
+                      WHERE (%(targets)s::bigint[] IS NULL OR p2.id = ANY(%(targets)s))
                    ) p2
              WHERE p.id = p2.id
                AND p.receiving <> p2.receiving
                AND p.status <> 'stub';
-            """)
+            """, args)
             cursor.run("""
             UPDATE participants p
                SET leftover = p2.leftover
               FROM ( SELECT p2.id, p2.leftover
                        FROM payday_participants p2
                       WHERE p2.kind = 'group'
+                        AND (%(targets)s::bigint[] IS NULL OR p2.id = ANY(%(targets)s))
                    ) p2
              WHERE p.id = p2.id
                AND coalesce_currency_basket(p.leftover) <> p2.leftover;
-            """)
+            """, args)
             cursor.run("""
             UPDATE participants p
                SET nteampatrons = p2.nteampatrons
@@ -943,10 +1257,11 @@ class Payday:
                        FROM participants p2
                       WHERE p2.status <> 'stub'
                         AND p2.kind IN ('individual', 'organization')
+                        AND (%(targets)s::bigint[] IS NULL OR p2.id = ANY(%(targets)s))
                    ) p2
              WHERE p.id = p2.id
                AND p.nteampatrons <> p2.nteampatrons;
-            """)
+            """, args)
             cursor.run("""
             UPDATE participants p
                SET npatrons = p2.npatrons
@@ -958,12 +1273,101 @@ class Payday:
                             ) AS npatrons
                        FROM participants p2
                       WHERE p2.status <> 'stub'
+                        AND (%(targets)s::bigint[] IS NULL OR p2.id = ANY(%(targets)s))
                    ) p2
              WHERE p.id = p2.id
                AND p.npatrons <> p2.npatrons;
-            """)
+            """, args)
+            invalidate_cached_responses(cursor, targets)
         cls.clean_up()
-        log("Updated receiving amounts.")
+        if incremental:
+            log(f"Updated the receiving amounts of {len(targets)} participants.")
+        else:
+            log("Updated receiving amounts.")
+
+    @classmethod
+    def update_cached_amounts_incrementally(cls):
+        cls.update_cached_amounts(incremental=True)
+
+    @staticmethod
+    def get_dirty_scope(cursor):
+        """Determine which cached amounts need to be updated.
+
+        Returns a tuple `(targets, loaded)`, where `targets` is the list of
+        participants whose cached amounts have to be recomputed, and `loaded`
+        is the list of participants that `prepare` has to load to do so.
+
+        The `giving` amounts of the donors of a dirty participant depend on its
+        status and goal, so they're dirty too, and so are the members of a
+        dirty team.
+
+        Since the takes of a team depend on all its income and on all the
+        takes of its members in other teams, the teams are expanded to all the
+        teams that are connected to them through shared members.
+        """
+        dirty = cursor.all("DELETE FROM dirty_participants RETURNING participant")
+        if not dirty:
+            return None, None
+        return cursor.one("""
+            WITH RECURSIVE marked AS (
+                     SELECT unnest(%(dirty)s::bigint[]) AS id
+                 )
+               , dirty AS (
+                     SELECT m.id FROM marked m
+                      UNION
+                     SELECT tip.tipper
+                       FROM current_tips tip
+                      WHERE tip.tippee IN (SELECT m.id FROM marked m)
+                      UNION
+                     SELECT take.member
+                       FROM current_takes take
+                      WHERE take.team IN (SELECT m.id FROM marked m)
+                 )
+               , teams (id) AS (
+                     ( SELECT p.id
+                         FROM participants p
+                        WHERE p.id IN (SELECT d.id FROM dirty d)
+                          AND p.kind = 'group'
+                        UNION
+                       SELECT take.team
+                         FROM current_takes take
+                        WHERE take.member IN (SELECT d.id FROM dirty d)
+                        UNION
+                       SELECT tip.tippee
+                         FROM current_tips tip
+                         JOIN participants tippee ON tippee.id = tip.tippee
+                        WHERE tip.tipper IN (SELECT d.id FROM dirty d)
+                          AND tippee.kind = 'group'
+                     )
+                     UNION
+                     SELECT take2.team
+                       FROM teams t
+                       JOIN current_takes take ON take.team = t.id
+                       JOIN current_takes take2 ON take2.member = take.member
+                 )
+               , targets AS (
+                     SELECT d.id FROM dirty d
+                      UNION
+                     SELECT t.id FROM teams t
+                      UNION
+                     SELECT take.member
+                       FROM current_takes take
+                      WHERE take.team IN (SELECT t.id FROM teams t)
+                 )
+               , loaded AS (
+                     SELECT t.id FROM targets t
+                      UNION
+                     SELECT tip.tippee
+                       FROM current_tips tip
+                      WHERE tip.tipper IN (SELECT t.id FROM targets t)
+                      UNION
+                     SELECT tip.tipper
+                       FROM current_tips tip
+                      WHERE tip.tippee IN (SELECT t.id FROM targets t)
+                 )
+            SELECT (SELECT array_agg(t.id) FROM targets t) AS targets
+                 , (SELECT array_agg(l.id) FROM loaded l) AS loaded
+        """, dict(dirty=dirty))
 
     def mark_stage_done(self, cursor=None):
         self.stage = (cursor or self.db).one("""
@@ -1001,26 +1405,47 @@ class Payday:
           ORDER BY ts_end DESC
              LIMIT 1
         """, (self.ts_start,), default=constants.BIRTHDAY)
-        n = 0
         r = self.db.all("""
-            SELECT tippee, json_agg(t) AS transfers
-              FROM transfers t
-             WHERE "timestamp" > %(previous_ts_end)s
-               AND "timestamp" <= %(ts_end)s
-               AND context IN ('tip', 'take', 'partial-take', 'final-gift')
-               AND status = 'succeeded'
-               AND NOT EXISTS (
-                       SELECT 1
-                         FROM notifications n
-                        WHERE n.participant = tippee
-                          AND n.event LIKE 'income~%%'
-                          AND n.ts > %(ts_end)s
-                   )
-          GROUP BY tippee
-          ORDER BY tippee
+            SELECT p, x.transfers
+              FROM ( SELECT tippee, json_agg(t) AS transfers
+                       FROM transfers t
+                      WHERE "timestamp" > %(previous_ts_end)s
+                        AND "timestamp" <= %(ts_end)s
+                        AND context IN ('tip', 'take', 'partial-take', 'final-gift')
+                        AND status = 'succeeded'
+                        AND NOT EXISTS (
+                                SELECT 1
+                                  FROM notifications n
+                                 WHERE n.participant = tippee
+                                   AND n.event LIKE 'income~%%'
+                                   AND n.ts > %(ts_end)s
+                            )
+                   GROUP BY tippee
+                   ) x
+              JOIN participants p ON p.id = x.tippee
+          ORDER BY p.id
         """, dict(previous_ts_end=previous_ts_end, ts_end=self.ts_end))
-        for tippee_id, transfers in r:
-            p = self.db.Participant.from_id(tippee_id)
+        if not r:
+            log("Sent 0 income notifications (out of 0 tippees).")
+            return
+        # Fetch the teams of the tippees, and the names of all the teams
+        memberships = dict(self.db.all("""
+            SELECT take.member, array_agg(take.team)
+              FROM current_takes take
+             WHERE take.member IN %s
+          GROUP BY take.member
+        """, (tuple(p.id for p, _ in r),)))
+        all_team_ids = set(chain.from_iterable(memberships.values()))
+        all_team_ids.update(
+            tr['team'] for _, transfers in r for tr in transfers if tr['team']
+        )
+        team_names = dict(self.db.all("""
+            SELECT id, username
+              FROM participants
+             WHERE id IN %s
+        """, (tuple(all_team_ids),))) if all_team_ids else {}
+        notifications = []
+        for p, transfers in r:
             if p.status != 'active' or not p.accepts_tips:
                 continue
             for t in transfers:
@@ -1031,30 +1456,21 @@ class Payday:
                     len(set(t['tipper'] for t in v))
                 ) for k, v in group_by(transfers, 'team').items()
             }
-            total = sum((t[0] for t in by_team.values()), MoneyBasket())
+            total = MoneyBasket(t[0] for t in by_team.values())
             nothing = (MoneyBasket(), 0)
             personal, personal_npatrons = by_team.pop(None, nothing)
-            teams = p.get_teams()
-            team_ids = set(t.id for t in teams) | set(by_team.keys())
-            team_names = {t.id: t.username for t in teams}
-            get_username = lambda i: team_names.get(i) or self.db.one(
-                "SELECT username FROM participants WHERE id = %s", (i,)
-            )
-            by_team = {get_username(t_id): by_team.get(t_id, nothing) for t_id in team_ids}
-            notif_id = p.notify(
-                'income~v2',
+            team_ids = set(memberships.get(p.id, ())) | set(by_team.keys())
+            by_team = {team_names[t_id]: by_team.get(t_id, nothing) for t_id in team_ids}
+            notifications.append((p, 'income~v2', dict(
                 total=total.fuzzy_sum(p.main_currency),
                 personal=personal,
                 personal_npatrons=personal_npatrons,
                 by_team=by_team,
-                web=False,
-            )
-            if notif_id:
-                n += 1
+            )))
+        n = len(self.db.Participant.notify_many(notifications, web=False))
         log(f"Sent {n} income notifications (out of {len(r)} tippees).")
 
     def generate_payment_account_required_notifications(self):
-        n = 0
         participants = self.db.all("""
             SELECT p
               FROM participants p
@@ -1091,12 +1507,19 @@ class Payday:
                           AND n.ts > (current_timestamp - interval '6 months')
                    )
         """)
-        for p in participants:
-            p.notify('payment_account_required', force_email=True)
-            n += 1
+        n = len(self.db.Participant.notify_many(
+            [(p, 'payment_account_required', {}) for p in participants],
+            force_email=True,
+        ))
         log("Sent %i payment_account_required notifications." % n)
 
 
+def resolve_team_takes(args):
+    """Call `Payday.resolve_takes`, in a worker process or not.
+    """
+    return Payday.resolve_takes(*args)
+
+
 def compute_next_payday_date():
     today = pando.utils.utcnow().date()
     days_till_wednesday = (3 - today.isoweekday()) % 7
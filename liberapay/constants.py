@@ -373,6 +373,13 @@ RATE_LIMITS = {
     'sign-up.ip-version': (20, 10*60),  # 20 per 10 minutes per IP version
 }
 
+# These rate limits are enforced by each process in memory, and the counters are
+# only periodically synced with the database. The limits that protect sensitive
+# actions (e.g. `log-in.*`) must not be added to this set.
+LOCAL_RATE_LIMITS = {
+    'http-query.ip-addr', 'http-query.user', 'http-unsafe.ip-addr', 'http-unsafe.user',
+}
+
 SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS'}
 
 SESSION = 'session'
@@ -4,6 +4,7 @@ import logging
 import threading
 from time import sleep
 import traceback
+from zlib import crc32
 
 from pando.utils import utcnow
 import psycopg2
@@ -27,11 +28,14 @@ class Cron:
         self.has_lock = False
         self.jobs = []
 
-    def __call__(self, period, func, exclusive=False):
-        job = Job(self, period, func, exclusive)
+    def __call__(self, period, func, exclusive=False, max_concurrency=1):
+        job = Job(self, period, func, exclusive, max_concurrency)
         self.jobs.append(job)
         if not self.website.env.run_cron_jobs or not period:
             return
+        if exclusive and self.website.env.cron_worker:
+            # This job is run by the `python -m liberapay.cron` process.
+            return
         if exclusive and not self.has_lock:
             self._wait_for_lock()
             return
@@ -75,15 +79,16 @@ class Cron:
 class Job:
 
     __slots__ = (
-        'cron', 'period', 'func', 'exclusive', 'running', 'thread',
-        '_last_start_time',
+        'cron', 'period', 'func', 'exclusive', 'max_concurrency', 'running',
+        'thread', '_last_start_time',
     )
 
-    def __init__(self, cron, period, func, exclusive=False):
+    def __init__(self, cron, period, func, exclusive=False, max_concurrency=1):
         self.cron = cron
         self.period = period
         self.func = func
         self.exclusive = exclusive
+        self.max_concurrency = max_concurrency
         self.running = False
         self.thread = None
         self._last_start_time = None
@@ -115,14 +120,26 @@ class Job:
         else:
             self._last_start_time = time
 
-    def seconds_before_next_run(self):
+    @property
+    def lock_key(self):
+        """The first key of the advisory locks held while this job is running.
+
+        The second key is the number of the concurrency slot.
+        """
+        key = crc32(self.func.__name__.encode('ascii'))
+        # Convert to a signed 32-bit integer, as expected by PostgreSQL
+        return key - 2**32 if key >= 2**31 else key
+
+    def seconds_before_next_run(self, last_start_time=None):
         """Returns the time to wait before running this job.
 
         The returned value can be negative, indicating that the run should have
         already been started. If a run is very late, the returned negative value
         may not accurately represent how long ago the run should have started.
         """
-        period, last_start_time = self.period, self.last_start_time
+        period = self.period
+        if last_start_time is None:
+            last_start_time = self.last_start_time
         now = utcnow()
         if isinstance(period, Weekly):
             then = now.replace(hour=period.hour, minute=10, second=0, microsecond=0)
@@ -175,43 +192,14 @@ class Job:
                     self.running = False
                     self.cron.website.tell_sentry(e)
                     if self.exclusive:
-                        while True:
-                            try:
-                                self.cron.website.db.run("""
-                                    INSERT INTO cron_jobs
-                                                (name, last_error_time, last_error)
-                                         VALUES (%s, current_timestamp, %s)
-                                    ON CONFLICT (name) DO UPDATE
-                                            SET last_error_time = excluded.last_error_time
-                                              , last_error = excluded.last_error
-                                """, (func_name, traceback.format_exc()))
-                            except psycopg2.OperationalError as e:
-                                self.cron.website.tell_sentry(e)
-                                # retry in a minute
-                                sleep(60)
-                            else:
-                                break
+                        self.record_error(traceback.format_exc())
                     # retry in a minute
                     sleep(60)
                     continue
                 else:
                     self.running = False
                     if self.exclusive:
-                        while True:
-                            try:
-                                self.cron.website.db.run("""
-                                    INSERT INTO cron_jobs
-                                                (name, last_success_time)
-                                         VALUES (%s, current_timestamp)
-                                    ON CONFLICT (name) DO UPDATE
-                                            SET last_success_time = excluded.last_success_time
-                                """, (func_name,))
-                            except psycopg2.OperationalError as e:
-                                self.cron.website.tell_sentry(e)
-                                # retry in a minute
-                                sleep(60)
-                            else:
-                                break
+                        self.record_success()
                     if period == 'irregular':
                         if r is None:
                             return
@@ -223,6 +211,228 @@ class Job:
         t.start()
         return t
 
+    def record_error(self, error):
+        while True:
+            try:
+                self.cron.website.db.run("""
+                    INSERT INTO cron_jobs
+                                (name, last_error_time, last_error)
+                         VALUES (%s, current_timestamp, %s)
+                    ON CONFLICT (name) DO UPDATE
+                            SET last_error_time = excluded.last_error_time
+                              , last_error = excluded.last_error
+                """, (self.func.__name__, error))
+            except psycopg2.OperationalError as e:
+                self.cron.website.tell_sentry(e)
+                # retry in a minute
+                sleep(60)
+            else:
+                break
+
+    def record_success(self):
+        while True:
+            try:
+                self.cron.website.db.run("""
+                    INSERT INTO cron_jobs
+                                (name, last_success_time)
+                         VALUES (%s, current_timestamp)
+                    ON CONFLICT (name) DO UPDATE
+                            SET last_success_time = excluded.last_success_time
+                """, (self.func.__name__,))
+            except psycopg2.OperationalError as e:
+                self.cron.website.tell_sentry(e)
+                # retry in a minute
+                sleep(60)
+            else:
+                break
+
+
+class CronWorker:
+    """Runs the exclusive jobs in a dedicated process.
+
+    The scheduler (the main thread) marks the jobs that are due by setting the
+    `next_run_time` column of the `cron_jobs` table. The executor threads claim
+    the queued jobs with `FOR UPDATE SKIP LOCKED`, so several workers can
+    share the same queue. A job is only started if one of its concurrency
+    slots, which are session-level advisory locks, is free.
+
+    Several workers can run at the same time, each one with its own pool of
+    database connections.
+    """
+
+    poll_interval = 1
+
+    def __init__(self, website, jobs, threads=4):
+        self.website = website
+        self.db = website.db
+        self.jobs = {job.func.__name__: job for job in jobs}
+        self.threads = threads
+        self.stopping = threading.Event()
+
+    def enqueue_due_jobs(self):
+        """Queue the jobs that should be started now.
+
+        Returns the names of the jobs that have been added to the queue.
+        """
+        rows = {row.name: row for row in self.db.all("""
+            SELECT name, last_start_time, next_run_time
+              FROM cron_jobs
+             WHERE name IN %s
+        """, (tuple(self.jobs),))}
+        due = []
+        for name, job in self.jobs.items():
+            if job.period == 'irregular':
+                continue
+            row = rows.get(name)
+            if row and row.next_run_time:
+                continue
+            if job.seconds_before_next_run(row and row.last_start_time) <= 0:
+                due.append(name)
+        if due:
+            self.enqueue(due)
+        return due
+
+    def enqueue(self, names, delay=0):
+        self.db.run("""
+            INSERT INTO cron_jobs
+                        (name, next_run_time)
+                 SELECT name, current_timestamp + make_interval(secs => %s)
+                   FROM unnest(%s::text[]) name
+            ON CONFLICT (name) DO UPDATE
+                    SET next_run_time = coalesce(
+                            cron_jobs.next_run_time, excluded.next_run_time
+                        )
+        """, (delay, list(names)))
+
+    def run_next_job(self):
+        """Claim a queued job and run it.
+
+        Returns the job that has been run, or `None` if there wasn't any job
+        waiting in the queue, or if the concurrency limits of all the waiting
+        jobs have been reached.
+        """
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            queued = cursor.all("""
+                SELECT name
+                  FROM cron_jobs
+                 WHERE next_run_time <= current_timestamp
+                   AND name IN %s
+              ORDER BY next_run_time
+                   FOR UPDATE SKIP LOCKED
+            """, (tuple(self.jobs),))
+            for name in queued:
+                job = self.jobs[name]
+                for slot in range(job.max_concurrency):
+                    if cursor.one("SELECT pg_try_advisory_lock(%s, %s)", (job.lock_key, slot)):
+                        break
+                else:
+                    continue
+                cursor.run("""
+                    UPDATE cron_jobs
+                       SET next_run_time = NULL
+                         , last_start_time = current_timestamp
+                     WHERE name = %s
+                """, (name,))
+                conn.commit()
+                try:
+                    self.run_job(job)
+                finally:
+                    cursor.run("SELECT pg_advisory_unlock(%s, %s)", (job.lock_key, slot))
+                return job
+
+    def run_job(self, job):
+        if isinstance(job.period, (float, int)) and job.period < 300:
+            logger.debug(f"Running {job!r}")
+        else:
+            logger.info(f"Running {job!r}")
+        job.running = True
+        try:
+            r = job.func()
+        except Exception as e:
+            self.website.tell_sentry(e)
+            job.record_error(traceback.format_exc())
+            if job.period == 'irregular':
+                # retry in a minute
+                self.enqueue([job.func.__name__], delay=60)
+        else:
+            job.record_success()
+            if job.period == 'irregular' and r is not None:
+                self.enqueue([job.func.__name__], delay=r)
+        finally:
+            job.running = False
+
+    def execute(self):
+        while not self.stopping.is_set():
+            try:
+                job = self.run_next_job()
+            except Exception as e:
+                self.website.tell_sentry(e)
+                job = None
+            if job is None:
+                self.stopping.wait(self.poll_interval)
+
+    def run(self):
+        """Start the executor threads and schedule the jobs until stopped.
+        """
+        irregular = [name for name, job in self.jobs.items() if job.period == 'irregular']
+        if irregular:
+            self.enqueue(irregular)
+        threads = [
+            threading.Thread(target=self.execute, name=f"cron_executor_{i}")
+            for i in range(self.threads)
+        ]
+        for t in threads:
+            t.start()
+        try:
+            while not self.stopping.is_set():
+                try:
+                    self.enqueue_due_jobs()
+                except Exception as e:
+                    self.website.tell_sentry(e)
+                self.stopping.wait(self.poll_interval)
+        finally:
+            self.stopping.set()
+            for t in threads:
+                t.join()
+
+    def stop(self, *args):
+        self.stopping.set()
+
+
+def get_running_jobs(db):
+    """Returns the number of running instances of each exclusive job.
+
+    This only covers the jobs run by `CronWorker` processes.
+    """
+    return dict(db.all("""
+        SELECT classid::bigint, count(*)
+          FROM pg_locks
+         WHERE locktype = 'advisory'
+           AND objsubid = 2
+           AND granted
+      GROUP BY classid
+    """))
+
+
+def main():
+    import signal
+    from liberapay.website import env
+
+    # The web workers must be running with `CRON_WORKER=yes`, otherwise the
+    # exclusive jobs are run by them too.
+    env.cache_static = env.clean_assets = False
+    env.run_cron_jobs = env.cron_worker = True
+
+    from liberapay.main import website
+    jobs = [job for job in website.cron.jobs if job.exclusive and job.period]
+    worker = CronWorker(website, jobs, env.cron_worker_threads)
+    signal.signal(signal.SIGTERM, worker.stop)
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        pass
+
 
 def break_before_call():
     return False
@@ -230,3 +440,7 @@ def break_before_call():
 
 def break_after_call():
     return False
+
+
+if __name__ == '__main__':
+    main()
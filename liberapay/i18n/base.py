@@ -3,6 +3,7 @@ from datetime import date, datetime, timedelta
 from decimal import Decimal, InvalidOperation
 from functools import cached_property
 from sys import intern
+from threading import Lock
 from unicodedata import combining, normalize
 import warnings
 
@@ -531,7 +532,69 @@ LOCALE_EN._data['languages'] = {
 }
 ACCEPTED_LANGUAGES = make_sorted_dict(Locale.LANGUAGE_NAMES, LOCALE_EN.languages)
 
-LOCALES = {}
+class LocaleDict(dict):
+    """A dict of locales, some of which are only loaded when they're first needed.
+
+    The lazy locales are added by calling `register` with a function that
+    creates the `Locale` object. Iterating over the dict loads all of them.
+    """
+
+    __slots__ = ('loaders', 'lock')
+
+    def __init__(self):
+        super().__init__()
+        self.loaders = {}
+        self.lock = Lock()
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.loaders
+
+    def __missing__(self, key):
+        with self.lock:
+            if dict.__contains__(self, key):
+                return dict.__getitem__(self, key)
+            loader = self.loaders.get(key)
+            if loader is None:
+                raise KeyError(key)
+            locale = loader()
+            dict.__setitem__(self, key, locale)
+            del self.loaders[key]
+            return locale
+
+    def __iter__(self):
+        self.load_all()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        return dict.__len__(self) + len(self.loaders)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def items(self):
+        self.load_all()
+        return dict.items(self)
+
+    def keys(self):
+        self.load_all()
+        return dict.keys(self)
+
+    def load_all(self):
+        for key in list(self.loaders):
+            self[key]
+
+    def register(self, key, loader):
+        self.loaders[key] = loader
+
+    def values(self):
+        self.load_all()
+        return dict.values(self)
+
+
+LOCALES = LocaleDict()
 LOCALE_EN = LOCALES['en'] = Locale('en')
 LOCALE_EN.catalog = Catalog('en')
 LOCALE_EN.catalog.plural_func = lambda n: n != 1
@@ -0,0 +1,171 @@
+"""Precompiled translation catalogs.
+
+Parsing the `.po` files with Babel is slow and results in heavy `Message`
+objects, so the catalogs are compiled into a single pickle file, which is only
+rebuilt when the `.po` files have been modified. The file can be generated
+ahead of time by running `python -m liberapay.i18n.catalogs`.
+"""
+
+import os
+import pickle
+from sys import intern
+from tempfile import NamedTemporaryFile
+
+from babel.messages.pofile import read_po
+
+from .plural_rules import get_function_from_rule
+
+
+class CompiledMessage:
+
+    __slots__ = ('id', 'string', 'fuzzy')
+
+    def __init__(self, id, string, fuzzy=False):
+        self.id = id
+        self.string = string
+        self.fuzzy = fuzzy
+
+    def __getstate__(self):
+        return (self.id, self.string, self.fuzzy)
+
+    def __setstate__(self, state):
+        self.id, self.string, self.fuzzy = state
+
+
+class CompiledCatalog:
+    """A lightweight substitute for Babel's `Catalog` class.
+
+    The messages are stored in the `_messages` dict, keyed by their singular
+    source strings, like in Babel's class.
+    """
+
+    __slots__ = (
+        '_messages', 'plural_expr', 'plural_func',
+        'missing_translations', 'fuzzy_translations',
+    )
+
+    def __init__(self, messages, plural_expr, missing_translations, fuzzy_translations):
+        self._messages = messages
+        self.plural_expr = plural_expr
+        self.plural_func = get_function_from_rule(plural_expr)
+        self.missing_translations = missing_translations
+        self.fuzzy_translations = fuzzy_translations
+
+    def __getstate__(self):
+        return (
+            self._messages, self.plural_expr,
+            self.missing_translations, self.fuzzy_translations,
+        )
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    @staticmethod
+    def _key_for(id):
+        return id[0] if isinstance(id, tuple) else id
+
+    def __contains__(self, id):
+        return self._key_for(id) in self._messages
+
+    def __getitem__(self, id):
+        return self._messages[self._key_for(id)]
+
+    def __iter__(self):
+        return iter(self._messages.values())
+
+    def __len__(self):
+        return len(self._messages)
+
+    def add(self, id, string=''):
+        self._messages[self._key_for(id)] = CompiledMessage(id, string)
+
+
+def compile_po_file(f):
+    """Parse a `.po` file and return a `CompiledCatalog`.
+    """
+    catalog = read_po(f)
+    messages = {}
+    missing = fuzzy = 0
+    for m in catalog:
+        if not m.id:
+            # This is the header
+            continue
+        if isinstance(m.id, tuple):
+            msg_id = tuple(map(intern, m.id))
+            if msg_id[0].startswith('<unused singular (hash='):
+                key = msg_id[1]
+            else:
+                key = msg_id[0]
+        else:
+            msg_id = key = intern(m.id)
+        messages[key] = CompiledMessage(msg_id, m.string, m.fuzzy)
+        if any(m.string):
+            if isinstance(m.string, tuple):
+                missing += sum(1 for s in m.string if not s) / len(m.string)
+            if m.fuzzy:
+                fuzzy += 1
+        else:
+            missing += 1
+    n = len(messages) or 1
+    return CompiledCatalog(messages, catalog.plural_expr, missing / n, fuzzy / n)
+
+
+def get_fingerprint(po_dir):
+    """Returns a summary of the state of the `.po` files in `po_dir`.
+    """
+    fingerprint = []
+    for filename in sorted(os.listdir(po_dir)):
+        if filename.endswith('.po'):
+            st = os.stat(os.path.join(po_dir, filename))
+            fingerprint.append((filename, st.st_size, st.st_mtime_ns))
+    return fingerprint
+
+
+def compile_catalogs(po_dir):
+    """Compile all the `.po` files in `po_dir`.
+
+    Returns a dict of `CompiledCatalog` objects keyed by language code.
+    """
+    catalogs = {}
+    for filename in sorted(os.listdir(po_dir)):
+        parts = filename.split('.')
+        if not (len(parts) == 2 and parts[1] == 'po'):
+            continue
+        with open(os.path.join(po_dir, filename), 'rb') as f:
+            catalogs[parts[0]] = compile_po_file(f)
+    return catalogs
+
+
+def load_catalogs(po_dir, cache_path, tell_sentry=None):
+    """Load the precompiled catalogs, rebuilding them first if they're stale.
+    """
+    fingerprint = get_fingerprint(po_dir)
+    try:
+        with open(cache_path, 'rb') as f:
+            cached_fingerprint, catalogs = pickle.load(f)
+        if cached_fingerprint == fingerprint:
+            return catalogs
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        if tell_sentry:
+            tell_sentry(e)
+    catalogs = compile_catalogs(po_dir)
+    try:
+        with NamedTemporaryFile(dir=os.path.dirname(cache_path), prefix='.', delete=False) as f:
+            pickle.dump((fingerprint, catalogs), f, pickle.HIGHEST_PROTOCOL)
+        os.chmod(f.name, 0o644)
+        os.replace(f.name, cache_path)
+    except OSError as e:
+        if tell_sentry:
+            tell_sentry(e)
+    return catalogs
+
+
+def get_default_paths(project_root='.'):
+    po_dir = os.path.join(project_root, 'i18n', 'core')
+    return po_dir, os.path.join(po_dir, '.compiled.pickle')
+
+
+if __name__ == '__main__':
+    load_catalogs(*get_default_paths())
@@ -110,6 +110,19 @@ class Money:
         self.currency = currency
         self.fuzzy = fuzzy
 
+    @classmethod
+    def _trusted(cls, amount, currency, fuzzy=False):
+        """Create a `Money` object without validating the `amount`.
+
+        The caller is responsible for passing a `Decimal` that isn't greater
+        than `D_MAX`, this is meant to be used in hot paths only.
+        """
+        r = object.__new__(cls)
+        r.amount = amount
+        r.currency = currency
+        r.fuzzy = fuzzy
+        return r
+
     def __abs__(self):
         return self.__class__(abs(self.amount), self.currency)
 
@@ -119,7 +132,9 @@ class Money:
                 raise CurrencyMismatch(self.currency, other.currency, '+')
             other = other.amount
         amount = self.amount + other
-        return self.__class__(amount, self.currency)
+        if amount > D_MAX and not amount.is_infinite():
+            raise InvalidNumber(amount)
+        return self._trusted(amount, self.currency)
 
     def __bool__(self):
         return bool(self.amount)
@@ -222,7 +237,12 @@ class Money:
     def __mul__(self, other):
         if isinstance(other, Money):
             raise TypeError("multiplying two sums of money isn't supported")
-        return self.__class__(self.amount * other, self.currency)
+        amount = self.amount * other
+        if isinstance(amount, Decimal):
+            if amount > D_MAX and not amount.is_infinite():
+                raise InvalidNumber(amount)
+            return self._trusted(amount, self.currency)
+        return self.__class__(amount, self.currency)
 
     def __ne__(self, other):
         return not self == other
@@ -231,7 +251,7 @@ class Money:
         return self.__class__(-self.amount, self.currency)
 
     def __pos__(self):
-        return self.__class__(+self.amount, self.currency)
+        return self._trusted(+self.amount, self.currency)
 
     def __pow__(self, other):
         if isinstance(other, Money):
@@ -258,7 +278,10 @@ class Money:
             if other.currency != self.currency:
                 raise CurrencyMismatch(self.currency, other.currency, '-')
             other = other.amount
-        return self.__class__(self.amount - other, self.currency)
+        amount = self.amount - other
+        if amount > D_MAX and not amount.is_infinite():
+            raise InvalidNumber(amount)
+        return self._trusted(amount, self.currency)
 
     def __rmul__(self, other):
         return self.__mul__(other)
@@ -282,14 +305,7 @@ class Money:
     def convert(self, c, rounding=ROUND_HALF_UP):
         if self.currency == c:
             return self
-        if 'EUR' in (self.currency, c):
-            rate = website.currency_exchange_rates[(self.currency, c)]
-        else:
-            rate = (
-                website.currency_exchange_rates[(self.currency, 'EUR')] *
-                website.currency_exchange_rates[('EUR', c)]
-            )
-        amount = self.amount * rate
+        amount = self.amount * website.currency_exchange_rates[(self.currency, c)]
         return Money(amount, c, rounding=rounding)
 
     def convert_if_currency_is_phased_out(self):
@@ -317,7 +333,11 @@ class Money:
             raise ValueError("%r is not a valid money amount" % amount_str)
 
     def round(self, rounding=ROUND_HALF_UP, allow_zero=True):
-        r = Money(self.amount, self.currency, rounding=rounding)
+        try:
+            amount = self.amount.quantize(self.MINIMUMS[self.currency].amount, rounding=rounding)
+        except InvalidOperation:
+            raise InvalidNumber(str(self.amount))
+        r = Money._trusted(amount, self.currency)
         if not allow_zero:
             if self.amount == 0:
                 raise ValueError("can't round zero away from zero")
@@ -333,12 +353,16 @@ class Money:
 
     @classmethod
     def sum(cls, amounts, currency):
+        """Add up an iterable of `Money` objects without creating intermediates.
+        """
         a = Money.ZEROS[currency].amount
         for m in amounts:
             if m.currency != currency:
                 raise CurrencyMismatch(m.currency, currency, 'sum')
             a += m.amount
-        return cls(a, currency)
+        if a > D_MAX and not a.is_infinite():
+            raise InvalidNumber(a)
+        return cls._trusted(a, currency)
 
     def zero(self):
         return self.ZEROS[self.currency]
@@ -375,10 +399,11 @@ class MoneyBasket:
             self.amounts[currency] = amount
 
     def __getitem__(self, currency):
-        return Money(self.amounts[currency], currency)
+        return Money._trusted(self.amounts[currency], currency)
 
     def __iter__(self):
-        return (Money(amount, currency) for currency, amount in self.amounts.items())
+        trusted = Money._trusted
+        return (trusted(amount, currency) for currency, amount in self.amounts.items())
 
     def __eq__(self, other):
         if isinstance(other, self.__class__):
@@ -411,15 +436,7 @@ class MoneyBasket:
     def __add__(self, other):
         if other == 0:
             return self
-        r = self.__class__(self.amounts)
-        if isinstance(other, self.__class__):
-            for currency, amount in other.amounts.items():
-                r.amounts[currency] += amount
-        elif isinstance(other, Money):
-            r.amounts[other.currency] += other.amount
-        else:
-            raise TypeError(other)
-        return r
+        return self._copy().iadd(other)
 
     def __radd__(self, other):
         return self.__add__(other)
@@ -427,16 +444,44 @@ class MoneyBasket:
     def __sub__(self, other):
         if other == 0:
             return self
-        r = self.__class__(self.amounts)
-        if isinstance(other, self.__class__):
-            for currency, v in other.amounts.items():
-                r.amounts[currency] -= v
-        elif isinstance(other, Money):
-            r.amounts[other.currency] -= other.amount
-        else:
-            raise TypeError(other)
+        return self._copy().isub(other)
+
+    def _copy(self):
+        r = self.__class__()
+        # The amounts are already nonzero, so `__setitem__` can be bypassed.
+        dict.update(r.amounts, self.amounts)
         return r
 
+    def iadd(self, other):
+        """Add a `Money` or `MoneyBasket` to this basket, in place.
+
+        Returns `self`.
+        """
+        amounts = self.amounts
+        if isinstance(other, Money):
+            amounts[other.currency] += other.amount
+        elif isinstance(other, MoneyBasket):
+            for currency, amount in other.amounts.items():
+                amounts[currency] += amount
+        elif other != 0:
+            raise TypeError(other)
+        return self
+
+    def isub(self, other):
+        """Subtract a `Money` or `MoneyBasket` from this basket, in place.
+
+        Returns `self`.
+        """
+        amounts = self.amounts
+        if isinstance(other, Money):
+            amounts[other.currency] -= other.amount
+        elif isinstance(other, MoneyBasket):
+            for currency, amount in other.amounts.items():
+                amounts[currency] -= amount
+        elif other != 0:
+            raise TypeError(other)
+        return self
+
     def __repr__(self):
         return '%s[%s]' % (
             self.__class__.__name__,
@@ -570,24 +615,30 @@ def fetch_currency_exchange_rates(db=None):
             rates[currency] = rate
         else:
             missing_currencies.append(currency)
+    new_rates = []
     for currency, rate in rates.items():
         if currency not in currencies:
             continue
-        db.run("""
-            INSERT INTO currency_exchange_rates
-                        (source_currency, target_currency, rate)
-                 VALUES ('EUR', %(target)s, %(rate)s)
-                      , (%(target)s, 'EUR', 1 / %(rate)s)
-            ON CONFLICT (source_currency, target_currency) DO UPDATE
-                    SET rate = excluded.rate
-        """, dict(target=currency, rate=Decimal(str(rate))))
+        new_rates.append((currency, Decimal(str(rate))))
+    # Upsert all the rates in a single statement, so that the version of the
+    # exchange rates is only incremented once.
+    db.run("""
+        INSERT INTO currency_exchange_rates
+                    (source_currency, target_currency, rate)
+             SELECT source_currency, target_currency, rate
+               FROM unnest(%(targets)s::currency[], %(rates)s::numeric[]) x (target, r)
+              CROSS JOIN LATERAL (VALUES ('EUR'::currency, x.target, x.r)
+                                       , (x.target, 'EUR'::currency, 1 / x.r)
+                                 ) y (source_currency, target_currency, rate)
+        ON CONFLICT (source_currency, target_currency) DO UPDATE
+                SET rate = excluded.rate
+    """, dict(
+        targets=[t[0] for t in new_rates], rates=[t[1] for t in new_rates],
+    ))
+    update_eur_amounts(db)
     # Update the local cache, unless it hasn't been created yet.
     if hasattr(website, 'currency_exchange_rates'):
-        website.currency_exchange_rates = get_currency_exchange_rates(db)
-    # Clear the cached auto-converted money amounts, so they'll be recomputed
-    # with the new exchange rates.
-    for d in MoneyAutoConvertDict.instances:
-        d.clear()
+        set_currency_exchange_rates(get_currency_exchange_rates(db))
     # Check for missing exchange rates.
     if missing_currencies:
         missing_currencies.sort()
@@ -596,9 +647,81 @@ def fetch_currency_exchange_rates(db=None):
         ))
 
 
+class CurrencyExchangeRates(dict):
+    """A full matrix of exchange rates, keyed by `(source, target)` tuples.
+
+    The rates stored in the database are only between the euro and the other
+    currencies, the cross rates are precomputed here so that converting an
+    amount only requires a single dict lookup.
+    """
+    __slots__ = ('version',)
+
+    def __init__(self, rows, version):
+        super().__init__()
+        from_eur = {}
+        to_eur = {}
+        for source, target, rate in rows:
+            if source == 'EUR':
+                from_eur[target] = rate
+            elif target == 'EUR':
+                to_eur[source] = rate
+        for source, rate_1 in to_eur.items():
+            for target, rate_2 in from_eur.items():
+                if source != target:
+                    self[(source, target)] = rate_1 * rate_2
+        for source, target, rate in rows:
+            self[(source, target)] = rate
+        self.version = version
+
+
+def update_eur_amounts(db):
+    """Recompute the `giving_eur` and `receiving_eur` columns of participants.
+
+    Those columns are maintained by a trigger when the amounts change, but they
+    also have to be updated when the exchange rates change.
+    """
+    db.run("""
+        UPDATE participants
+           SET giving_eur = (convert(giving, 'EUR')).amount
+             , receiving_eur = (convert(receiving, 'EUR')).amount
+         WHERE ((giving).currency <> 'EUR' OR (receiving).currency <> 'EUR')
+           AND ( giving_eur <> (convert(giving, 'EUR')).amount OR
+                 receiving_eur <> (convert(receiving, 'EUR')).amount )
+    """)
+
+
 def get_currency_exchange_rates(db):
-    r = {(r[0], r[1]): r[2] for r in db.all("SELECT * FROM currency_exchange_rates")}
-    if r:
-        return r
+    version = get_currency_exchange_rates_version(db)
+    rows = db.all("SELECT * FROM currency_exchange_rates")
+    if rows:
+        return CurrencyExchangeRates(rows, version)
     fetch_currency_exchange_rates(db)
     return get_currency_exchange_rates(db)
+
+
+def get_currency_exchange_rates_version(db):
+    return db.one("""
+        SELECT value
+          FROM db_meta
+         WHERE key = 'currency_exchange_rates_version'
+    """, default=0)
+
+
+def set_currency_exchange_rates(rates):
+    website.currency_exchange_rates = rates
+    # Clear the cached auto-converted money amounts, so they'll be recomputed
+    # with the new exchange rates.
+    for d in MoneyAutoConvertDict.instances:
+        d.clear()
+
+
+def refresh_currency_exchange_rates(db=None):
+    """Reload the exchange rates if they have been modified by another process.
+    """
+    db = db or website.db
+    current = getattr(website, 'currency_exchange_rates', None)
+    if current is None:
+        return
+    if getattr(current, 'version', None) == get_currency_exchange_rates_version(db):
+        return
+    set_currency_exchange_rates(get_currency_exchange_rates(db))
@@ -33,7 +33,9 @@ from liberapay.exceptions import PayinMethodIsUnavailable, TooManyAttempts
 from liberapay.i18n.base import (
     Bold, Country, Currency, add_currency_to_state, set_up_i18n, to_age
 )
-from liberapay.i18n.currencies import Money, MoneyBasket, fetch_currency_exchange_rates
+from liberapay.i18n.currencies import (
+    Money, MoneyBasket, fetch_currency_exchange_rates, refresh_currency_exchange_rates,
+)
 from liberapay.models.account_elsewhere import refetch_elsewhere_data
 from liberapay.models.community import Community
 from liberapay.models.participant import (
@@ -170,6 +172,7 @@ if not website.db:
 if env.cache_static:
     http_caching.compile_assets(website)
     website.request_processor.dispatcher.build_dispatch_tree()
+    website.asset_manifest.build(website.request_processor, env.compressed_assets_dir)
 elif env.clean_assets:
     http_caching.clean_assets(website.www_root)
     website.request_processor.dispatcher.build_dispatch_tree()
@@ -191,8 +194,12 @@ if conf:
     cron(intervals.get('refetch_repos', 20), refetch_repos, True)
     cron(Weekly(weekday=3, hour=2), create_payday_issue, True)
     cron(intervals.get('clean_up_counters', 3600), website.db.clean_up_counters, True)
+    cron(intervals.get('flush_rate_limits', 10), website.rate_limiter.flush)
+    cron(intervals.get('prune_query_cache', 3600), website.db.cache.prune)
     cron(Daily(hour=1), clean_up_emails, True)
     cron(Daily(hour=2), fetch_currency_exchange_rates, True)
+    cron(intervals.get('refresh_currency_exchange_rates', 60), refresh_currency_exchange_rates)
+    cron(intervals.get('poll_notifications', 5), website.listener.poll)
     cron(Daily(hour=3), reschedule_renewals, True)
     cron(Daily(hour=4), send_upcoming_debit_notifications, True)
     cron(Daily(hour=5), execute_scheduled_payins, True)
@@ -201,6 +208,7 @@ if conf:
     cron(Daily(hour=13), paypal.sync_all_pending_payments, True)
     cron(Daily(hour=14), detect_stuck_payins, True)
     cron(Daily(hour=18), Payday.update_cached_amounts, True)
+    cron(intervals.get('update_cached_amounts_incrementally', 3600), Payday.update_cached_amounts_incrementally, True)
     cron(Daily(hour=19), Participant.delete_old_feedback, True)
     cron(Daily(hour=20), free_up_usernames, True)
     cron(intervals.get('notify_patrons', 1200), Participant.notify_patrons, True)
@@ -229,6 +237,7 @@ algorithm.functions = [
     algorithm['extract_accept_header'],
     drop_accept_all_header,
     set_default_security_headers,
+    http_caching.serve_static_asset if env.cache_static else noop,
     csrf.add_csrf_token_to_state,
     set_up_i18n,
     authentication.start_user_as_anon,
@@ -247,6 +256,7 @@ algorithm.functions = [
     algorithm['load_resource_from_filesystem'],
     algorithm['render_response'],
     add_content_disposition_header,
+    http_caching.store_response_in_cache,
     algorithm['handle_negotiation_exception'],
 
     merge_responses,
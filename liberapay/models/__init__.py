@@ -9,7 +9,7 @@ import psycopg2
 from psycopg2 import IntegrityError, InterfaceError, ProgrammingError
 from psycopg2_pool import ThreadSafeConnectionPool
 
-from liberapay.constants import RATE_LIMITS
+from liberapay.constants import LOCAL_RATE_LIMITS, RATE_LIMITS
 from liberapay.website import website
 
 
@@ -167,7 +167,10 @@ def hit_rate_limit(db, key_prefix, key_unique, exception=None):
     try:
         cap, period = RATE_LIMITS[key_prefix]
         key = '%s:%s' % (key_prefix, key_unique)
-        r = db.one("SELECT hit_rate_limit(%s, %s, %s)", (key, cap, period))
+        if key_prefix in LOCAL_RATE_LIMITS:
+            r = website.rate_limiter.hit(key, cap, period)
+        else:
+            r = db.one("SELECT hit_rate_limit(%s, %s, %s)", (key, cap, period))
     except Exception as e:
         website.tell_sentry(e)
         return -1
@@ -183,6 +186,8 @@ def decrement_rate_limit(db, key_prefix, key_unique):
     try:
         cap, period = RATE_LIMITS[key_prefix]
         key = '%s:%s' % (key_prefix, key_unique)
+        if key_prefix in LOCAL_RATE_LIMITS:
+            return website.rate_limiter.decrement(key, cap, period)
         return db.one("SELECT decrement_rate_limit(%s, %s, %s)", (key, cap, period))
     except Exception as e:
         website.tell_sentry(e)
@@ -1,5 +1,6 @@
 from base64 import b64decode, b64encode
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta
 from decimal import Decimal
 from email.utils import formataddr
@@ -8,7 +9,6 @@ from hashlib import pbkdf2_hmac, md5, sha1
 from operator import attrgetter, itemgetter
 from os import urandom
 from random import randint
-from threading import Lock
 from time import sleep
 from types import SimpleNamespace
 import unicodedata
@@ -87,6 +87,7 @@ from liberapay.models.tip import Tip
 from liberapay.payin.common import resolve_amounts
 from liberapay.payin.prospect import PayinProspect
 from liberapay.security.crypto import constant_time_compare
+from liberapay.security.session_cache import CachedSession, invalidate_cached_sessions
 from liberapay.utils import (
     deserialize, erase_cookie, get_recordable_headers, serialize, set_cookie,
     tweak_avatar_url,
@@ -94,8 +95,9 @@ from liberapay.utils import (
 )
 from liberapay.utils.emails import (
     NormalizedEmailAddress, EmailVerificationResult, check_email_blacklist,
-    normalize_email_address,
+    normalize_email_address, prerender_email_base,
 )
+from liberapay.utils.http_caching import invalidate_cached_responses
 from liberapay.utils.types import LocalizedString, Object
 from liberapay.website import website
 
@@ -103,8 +105,9 @@ from liberapay.website import website
 FOUR_WEEKS = timedelta(weeks=4)
 TEN_YEARS = timedelta(days=3652)
 
+# Pre-rendered email bases, keyed by (simplate name, content type, locale)
+EMAIL_BASES = {}
 
-email_lock = Lock()
 
 DNS = DNSResolver()
 DNS.lifetime = 1.0  # 1 second timeout, per https://github.com/liberapay/liberapay.com/pull/1043#issuecomment-377891723
@@ -503,17 +506,28 @@ class Participant(Model, MixinTeam):
                 )
             else:
                 rate_limit = False
-        r = cls.db.one("""
-            SELECT p, s.secret, s.mtime, s.latest_use
-              FROM user_secrets s
-              JOIN participants p ON p.id = s.participant
-             WHERE s.participant = %s
-               AND s.id = %s
-        """, (p_id, session_id))
-        if not r:
-            erase_cookie(cookies, SESSION)
-            return None, 'invalid'
-        p, stored_secret, mtime, latest_use = r
+        session_cache = website.session_cache
+        cached = None if rate_limit else session_cache.get(p_id, session_id)
+        if cached and constant_time_compare(cached.secret, secret):
+            p = cls(cached.participant)
+            stored_secret, mtime, latest_use = cached.secret, cached.mtime, cached.latest_use
+        else:
+            generation = session_cache.generation
+            r = cls.db.one("""
+                SELECT p, s.secret, s.mtime, s.latest_use
+                  FROM user_secrets s
+                  JOIN participants p ON p.id = s.participant
+                 WHERE s.participant = %s
+                   AND s.id = %s
+            """, (p_id, session_id))
+            if not r:
+                erase_cookie(cookies, SESSION)
+                return None, 'invalid'
+            p, stored_secret, mtime, latest_use = r
+            if not rate_limit and constant_time_compare(stored_secret, secret):
+                session_cache.set(p_id, session_id, CachedSession(
+                    stored_secret, [getattr(p, k) for k in p.attnames], mtime, latest_use,
+                ), generation)
         if not constant_time_compare(stored_secret, secret):
             erase_cookie(cookies, SESSION)
             return None, 'invalid'
@@ -593,6 +607,7 @@ class Participant(Model, MixinTeam):
             session_id=session.id,
             current_mtime=session.mtime,
         ))
+        invalidate_cached_sessions(self.id)
         if self.session:
             if self.session.secret == session.secret:
                 # Very unlikely, unless there's a bug in the generator. Try again.
@@ -685,6 +700,7 @@ class Participant(Model, MixinTeam):
         """, locals())
         if session is None:
             return self.start_session(token=token, id_min=id_min, id_max=id_max)
+        invalidate_cached_sessions(self.id)
         return session
 
     def sign_in(self, cookies, session=None, **session_kw):
@@ -698,6 +714,7 @@ class Participant(Model, MixinTeam):
         """
         self.db.run("DELETE FROM user_secrets WHERE participant = %s AND id = %s",
                     (self.id, self.session.id))
+        invalidate_cached_sessions(self.id)
         del self.session
         erase_cookie(cookies, SESSION)
 
@@ -860,6 +877,7 @@ class Participant(Model, MixinTeam):
                    AND type=%s
                    AND lang=%s
             """, (self.id, type, lang))
+            invalidate_cached_responses(self.db, [self.id])
             return
         search_conf = i18n.SEARCH_CONFS.get(lang, 'simple')
         self.db.run("""
@@ -870,6 +888,7 @@ class Participant(Model, MixinTeam):
                     SET content = excluded.content
                       , mtime = excluded.mtime
         """, (lang, statement, self.id, search_conf, type))
+        invalidate_cached_responses(self.db, [self.id])
 
 
     # Stubs
@@ -1321,6 +1340,8 @@ class Participant(Model, MixinTeam):
         context = context.copy()
         self.fill_notification_context(context)
         context['email'] = email
+        if spt_name == 'newsletter':
+            context['unsubscribe_url'] = self.get_newsletter_unsubscribe_url(context['sender'])
         i18n.add_helpers_to_context(context, locale)
         context['escape'] = lambda s: s
         context_html = context.copy()
@@ -1330,15 +1351,15 @@ class Participant(Model, MixinTeam):
         if spt_name == 'newsletter':
             def render(t, context):
                 if t == 'text/html':
-                    context['body'] = markdown.render(context['body']).strip()
+                    # The same body is sent to many subscribers
+                    context['body'] = markdown.render_cached(context['body']).strip()
                 return spt[t].render(context).strip()
         else:
             base_spt = None if spt_name.startswith('once/') else 'base'
             base_spt = context.get('base_spt', base_spt)
-            base_spt = website.emails[base_spt] if base_spt else None
             bodies = {}
             def render(t, context):
-                b = base_spt[t].render(context).strip() if base_spt else '$body'
+                b = self.render_email_base(base_spt, t, context, locale) if base_spt else '$body'
                 if t == 'text/plain' and t not in spt:
                     body = html2text(bodies['text/html']).strip()
                 else:
@@ -1365,6 +1386,32 @@ class Participant(Model, MixinTeam):
         )
         return message, partial_translation
 
+    def render_email_base(self, spt_name, content_type, context, locale):
+        """Render the base of an email.
+
+        The parts that don't depend on the recipient are only rendered once
+        per locale, see `prerender_email_base`.
+        """
+        template = website.emails[spt_name][content_type]
+        key = (spt_name, content_type, locale)
+        prerendered = EMAIL_BASES.get(key, False)
+        if prerendered is False:
+            prerender_context = {}
+            i18n.add_helpers_to_context(prerender_context, locale)
+            prerender_context['escape'] = context['escape']
+            prerendered = EMAIL_BASES[key] = prerender_email_base(template, prerender_context)
+        if prerendered is None:
+            return template.render(context).strip()
+        parts, calls, partial_translation = prerendered
+        if partial_translation:
+            context['partial_translation'] = True
+        parts = parts.copy()
+        escape = context['escape']
+        for i in range(1, len(parts), 2):
+            args, kw = calls[int(parts[i])]
+            parts[i] = escape(self.url(*args, **kw))
+        return ''.join(parts)
+
     def send_email(self, spt_name, email_row, **context):
         email = email_row.address
         check_email_blacklist(email, check_domain=False)
@@ -1385,79 +1432,173 @@ class Participant(Model, MixinTeam):
             except AssertionError as e:
                 website.tell_sentry(e)
 
-        with email_lock:
+        try:
+            website.mailer.send(**message)
+        except Exception as e:
+            website.tell_sentry(e)
             try:
+                # Retry without the user's name in the `To:` header
+                message['to'] = [email]
                 website.mailer.send(**message)
             except Exception as e:
                 website.tell_sentry(e)
-                try:
-                    # Retry without the user's name in the `To:` header
-                    message['to'] = [email]
-                    website.mailer.send(**message)
-                except Exception as e:
-                    website.tell_sentry(e)
-                    raise UnableToSendEmail(email)
-            website.log_email(message)
+                raise UnableToSendEmail(email)
+        website.log_email(message)
 
     @classmethod
-    def dequeue_emails(cls):
-        fetch_messages = lambda last_id: cls.db.all("""
-            SELECT *
-              FROM notifications
-             WHERE id > %s
-               AND email AND email_status = 'queued'
-          ORDER BY id ASC
-             LIMIT 60
-        """, (last_id,))
-        def dequeue(msg, status):
+    def dequeue_emails(cls, batch_size=100):
+        """Send the queued email notifications.
+
+        The messages are claimed in batches with `SKIP LOCKED`, so that they
+        can be dequeued by multiple threads or processes simultaneously. They
+        are rendered and sent by up to `email_sending_threads` threads, and the
+        mailer pool limits the rate at which they're sent.
+
+        The status of each message is recorded as soon as it has been sent. If
+        something goes wrong, the messages that haven't been sent yet are put
+        back in the queue, and claims older than an hour are assumed to have
+        been abandoned by a process that crashed.
+        """
+        def dequeue(statuses):
             try:
-                return cls.db.run(
-                    "UPDATE notifications SET email_status = %(status)s WHERE id = %(id)s",
-                    dict(id=msg.id, status=status)
-                )
+                return cls.db.run("""
+                    UPDATE notifications n
+                       SET email_status = x.status
+                      FROM unnest(%s::bigint[], %s::email_status[]) x (id, status)
+                     WHERE n.id = x.id
+                """, (list(statuses), list(statuses.values())))
             except Exception as e:
                 website.tell_sentry(e)
                 sleep(5)
-                return dequeue(msg, status)
-        last_id = 0
-        while True:
-            messages = fetch_messages(last_id)
-            if not messages:
-                break
-            for msg in messages:
+                return dequeue(statuses)
+
+        def requeue(ids):
+            try:
+                cls.db.run("""
+                    UPDATE notifications
+                       SET email_status = 'queued'
+                         , email_claimed_at = NULL
+                     WHERE id IN %s
+                       AND email_status = 'sending'
+                """, (tuple(ids),))
+            except Exception as e:
+                # The rows will be requeued once their claim has expired
+                website.tell_sentry(e)
+
+        def send(msg, p, email_row, context):
+            try:
+                p.send_email(msg.event, email_row, **context)
+            except EmailAddressIsBlacklisted:
+                return 'skipped'
+            except Exception as e:
+                website.tell_sentry(e)
+                return 'failed'
+            else:
+                return 'sent'
+
+        def send_all(tasks):
+            return [
+                (msg.id, send(msg, p, email_row, context))
+                for msg, p, email_row, context in tasks
+            ]
+
+        def record(statuses):
+            dequeue(statuses)
+            claimed.difference_update(statuses)
+
+        # Requeue the messages that were claimed by a process which crashed
+        try:
+            cls.db.run("""
+                UPDATE notifications
+                   SET email_status = 'queued'
+                     , email_claimed_at = NULL
+                 WHERE email AND email_status = 'sending'
+                   AND coalesce(email_claimed_at, ts) < (current_timestamp - interval '1 hour')
+            """)
+        except ReadOnlySqlTransaction:
+            # The database is in read-only mode, give up for now
+            return
+        n_threads = website.app_conf.email_sending_threads
+        executor = ThreadPoolExecutor(n_threads) if n_threads > 1 else None
+        claimed = set()
+        try:
+            while True:
                 try:
-                    r = cls.db.one("""
+                    messages = cls.db.all("""
                         UPDATE notifications
                            SET email_status = 'sending'
-                         WHERE id = %s
-                           AND email_status = 'queued'
-                     RETURNING email_status
-                    """, (msg.id,))
+                             , email_claimed_at = current_timestamp
+                         WHERE id IN (
+                                   SELECT id
+                                     FROM notifications
+                                    WHERE email AND email_status = 'queued'
+                                 ORDER BY id ASC
+                                    LIMIT %s
+                                      FOR UPDATE SKIP LOCKED
+                               )
+                     RETURNING *
+                    """, (batch_size,))
                 except ReadOnlySqlTransaction:
                     # The database is in read-only mode, give up for now
                     return
-                if not r:
-                    # Message already (being) sent by another thread
-                    continue
-                d = deserialize(msg.context)
-                d['notification_ts'] = msg.ts
-                p = cls.from_id(msg.participant)
-                email = d.get('email') or p.email
-                if not email or p.status != 'active':
-                    dequeue(msg, 'skipped')
-                    continue
-                email_row = p.get_email(email)
-                try:
-                    p.send_email(msg.event, email_row, **d)
-                except EmailAddressIsBlacklisted:
-                    dequeue(msg, 'skipped')
-                except Exception as e:
-                    website.tell_sentry(e)
-                    dequeue(msg, 'failed')
+                if not messages:
+                    break
+                claimed.update(msg.id for msg in messages)
+                messages.sort(key=lambda msg: msg.id)
+                participants = dict(cls.db.all("""
+                    SELECT p.id, p
+                      FROM participants p
+                     WHERE p.id IN %s
+                """, (set(msg.participant for msg in messages),)))
+                statuses, tasks = {}, []
+                for msg in messages:
+                    try:
+                        d = deserialize(msg.context)
+                        d['notification_ts'] = msg.ts
+                        p = participants[msg.participant]
+                        email = d.get('email') or p.email
+                    except Exception as e:
+                        website.tell_sentry(e)
+                        statuses[msg.id] = 'failed'
+                        continue
+                    if not email or p.status != 'active':
+                        statuses[msg.id] = 'skipped'
+                        continue
+                    tasks.append((msg, p, email.lower(), d))
+                if statuses:
+                    record(statuses)
+                email_rows = {}
+                if tasks:
+                    email_rows = {
+                        (e.participant, e.address.lower()): e
+                        for e in cls.db.all("""
+                            SELECT e.*
+                              FROM unnest(%s::bigint[], %s::text[]) x (participant, address)
+                              JOIN emails e ON e.participant = x.participant
+                                           AND lower(e.address) = x.address
+                        """, ([t[1].id for t in tasks], [t[2] for t in tasks]))
+                    }
+                tasks = [
+                    (msg, p, email_rows.get((p.id, email)), d)
+                    for msg, p, email, d in tasks
+                ]
+                if executor:
+                    # The messages of a participant are sent one after the
+                    # other, because rendering them modifies the `Participant`
+                    # object.
+                    tasks_by_participant = defaultdict(list)
+                    for task in tasks:
+                        tasks_by_participant[task[1].id].append(task)
+                    for results in executor.map(send_all, tasks_by_participant.values()):
+                        record(dict(results))
                 else:
-                    dequeue(msg, 'sent')
-                sleep(1)
-            last_id = messages[-1].id
+                    for msg, p, email_row, d in tasks:
+                        record({msg.id: send(msg, p, email_row, d)})
+        finally:
+            if executor:
+                executor.shutdown()
+            if claimed:
+                requeue(claimed)
         # Delete old email-only notifications
         cls.db.run("""
             DELETE FROM notifications
@@ -1516,6 +1657,75 @@ class Participant(Model, MixinTeam):
         self.set_attributes(pending_notifs=self.pending_notifs + 1)
         return n_id
 
+    @classmethod
+    def notify_many(cls, notifications, force_email=False, email=True, web=True,
+                    email_unverified_address=False, cursor=None):
+        """Insert multiple notifications at once.
+
+        Args:
+            notifications (list):
+                `(participant, event, context)` or
+                `(participant, event, context, idem_key)` tuples
+            cursor: the database cursor to use, if any
+
+        The other arguments have the same meaning as in `notify`, but they
+        apply to all the notifications. Unlike `notify`, this method silently
+        skips the duplicate notifications instead of raising an exception.
+
+        Returns the `(id, participant)` rows of the inserted notifications.
+        """
+        participants, values, seen = {}, [], set()
+        for p, event, context, *rest in notifications:
+            idem_key = rest[0] if rest else None
+            p_email = email
+            if email and not force_email:
+                bit = EVENTS.get(event.split('~', 1)[0]).bit
+                p_email = p.email_notif_bits & bit > 0
+                if not p_email and not web:
+                    continue
+            if email_unverified_address and not p.email:
+                context = dict(context, email=p.get_email_address())
+            context = serialize(context)
+            key = (p.id, event, idem_key or context)
+            if key in seen:
+                continue
+            seen.add(key)
+            participants[p.id] = p
+            values.append((p.id, event, context, p_email, idem_key))
+        if not values:
+            return []
+        with cls.db.get_cursor(cursor=cursor) as c:
+            inserted = c.all("""
+                LOCK TABLE notifications IN SHARE ROW EXCLUSIVE MODE;
+                INSERT INTO notifications
+                            (participant, event, context, web, email, email_status, idem_key)
+                     SELECT x.participant, x.event, x.context, %(web)s, x.email
+                          , (CASE WHEN x.email THEN 'queued' END)::email_status
+                          , x.idem_key
+                       FROM unnest(%(participants)s::bigint[], %(events)s::text[],
+                                   %(contexts)s::bytea[], %(emails)s::boolean[],
+                                   %(idem_keys)s::text[])
+                            WITH ORDINALITY AS x (participant, event, context, email, idem_key, i)
+                      WHERE NOT EXISTS (
+                                SELECT 1
+                                  FROM notifications n
+                                 WHERE n.participant = x.participant
+                                   AND n.event = x.event
+                                   AND ( n.idem_key = x.idem_key OR
+                                         n.ts::date = current_date AND n.context = x.context )
+                            )
+                   ORDER BY x.i
+                  RETURNING id, participant
+            """, dict(zip(
+                ('participants', 'events', 'contexts', 'emails', 'idem_keys'),
+                map(list, zip(*values))
+            ), web=web))
+        if web:
+            for n in inserted:
+                p = participants[n.participant]
+                p.set_attributes(pending_notifs=p.pending_notifs + 1)
+        return inserted
+
     def mark_notification_as_read(self, n_id):
         p_id = self.id
         r = self.db.one("""
@@ -1787,22 +1997,31 @@ class Participant(Model, MixinTeam):
              WHERE publisher = %s AND subscriber = %s
         """, (self.id, subscriber.id))
 
-    @classmethod
-    def get_subscriptions(cls, publisher):
-        unsub_url = '{}/~{}/unsubscribe?id=%s&token=%s'.format(website.canonical_url, publisher)
-        return cls.db.all("""
-            SELECT s.*
-                 , format(%(unsub_url)s, s.id, s.token) AS unsubscribe_url
-              FROM subscriptions s
-             WHERE s.publisher = %(publisher)s
-        """, locals())
+    def get_newsletter_unsubscribe_url(self, publisher):
+        s = self.db.one("""
+            SELECT id, token
+              FROM subscriptions
+             WHERE publisher = %s
+               AND subscriber = %s
+        """, (publisher, self.id))
+        if not s:
+            return
+        return '{}/~{}/news/unsubscribe?id={}&token={}'.format(
+            website.canonical_url, publisher, s.id, s.token
+        )
 
     @classmethod
     def send_newsletters(cls):
+        """Queue the emails of the newsletters that are scheduled to be sent.
+
+        The notifications of all the subscribers are inserted by a single
+        query. Their contexts are identical, the unsubscribe link is added
+        when the email is rendered.
+        """
         fetch_messages = lambda: cls.db.all("""
-            SELECT n.sender
+            SELECT t.id, n.sender
                  , row_to_json((SELECT a FROM (
-                        SELECT t.newsletter, t.lang, t.subject, t.body
+                        SELECT t.newsletter, n.sender, t.lang, t.subject, t.body
                    ) a)) AS context
               FROM newsletter_texts t
               JOIN newsletters n ON n.id = t.newsletter
@@ -1816,18 +2035,20 @@ class Participant(Model, MixinTeam):
                 break
             for msg in messages:
                 with cls.db.get_cursor() as cursor:
-                    count = 0
-                    for s in cls.get_subscriptions(msg.sender):
-                        context = dict(msg.context, unsubscribe_url=s.unsubscribe_url)
-                        count += cursor.one("""
+                    count = cursor.one("""
+                        WITH queued AS (
                             INSERT INTO notifications
                                         (participant, event, context, web, email, email_status)
                                  SELECT p.id, 'newsletter', %s, false, true, 'queued'
-                                   FROM participants p
-                                  WHERE p.id = %s
+                                   FROM subscriptions s
+                                   JOIN participants p ON p.id = s.subscriber
+                                  WHERE s.publisher = %s
+                                    AND s.is_on
                                     AND p.email IS NOT NULL
-                         RETURNING count(*)
-                        """, (serialize(context), s.subscriber))
+                              RETURNING 1
+                        )
+                        SELECT count(*) FROM queued
+                    """, (serialize(msg.context), msg.sender))
                     assert cursor.one("""
                         UPDATE newsletter_texts
                            SET sent_at = now()
@@ -1835,7 +2056,6 @@ class Participant(Model, MixinTeam):
                          WHERE id = %s
                      RETURNING sent_at
                     """, (count, msg.id))
-                sleep(1)
 
 
     # Recipient settings
@@ -2243,6 +2463,7 @@ class Participant(Model, MixinTeam):
 
                 self.add_event(c, 'set_username', suggested, recorder=recorder_id)
                 self.set_attributes(username=suggested)
+                invalidate_cached_responses(c, [self.id])
 
             if last_rename and self.kind == 'group':
                 assert isinstance(recorder, Participant)
@@ -2293,6 +2514,7 @@ class Participant(Model, MixinTeam):
                 if r:
                     self.add_event(c, 'set_public_name', new_public_name)
                     self.set_attributes(public_name=new_public_name)
+                    invalidate_cached_responses(c, [self.id])
 
         return new_public_name
 
@@ -2418,6 +2640,7 @@ class Participant(Model, MixinTeam):
              WHERE id = %s
          RETURNING avatar_url, avatar_src, avatar_email
         """, (avatar_url, src, avatar_email, self.id))._asdict())
+        invalidate_cached_responses(cursor or self.db, [self.id])
 
         return avatar_url
 
@@ -2439,6 +2662,7 @@ class Participant(Model, MixinTeam):
             json = None if goal is None else str(goal)
             self.add_event(c, 'set_goal', json)
             self.set_attributes(goal=goal)
+            invalidate_cached_responses(c, [self.id])
             if not self.accepts_tips:
                 tippers = c.all("""
                     SELECT p
@@ -2479,6 +2703,8 @@ class Participant(Model, MixinTeam):
             """, dict(id=self.id, status=status, goal=goal))
             self.set_attributes(**r._asdict())
             self.add_event(c, 'set_status', status)
+            invalidate_cached_responses(c, [self.id])
+            invalidate_cached_sessions(self.id)
             if not self.accepts_tips:
                 self.update_receiving(c)
 
@@ -2575,6 +2801,7 @@ class Participant(Model, MixinTeam):
          RETURNING giving
         """, dict(id=self.id))
         self.set_attributes(giving=giving)
+        invalidate_cached_responses(cursor or self.db, [self.id])
 
         return updated
 
@@ -2602,6 +2829,7 @@ class Participant(Model, MixinTeam):
              RETURNING receiving, npatrons
             """, dict(id=self.id, currency=self.main_currency, zero=zero))
             self.set_attributes(receiving=r.receiving, npatrons=r.npatrons)
+            invalidate_cached_responses(c, [self.id])
             if self.kind == 'group':
                 self.recompute_actual_takes(c)
 
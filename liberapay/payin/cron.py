@@ -1,5 +1,6 @@
 from collections import defaultdict
 from datetime import date
+from itertools import chain
 from operator import itemgetter
 from time import sleep
 
@@ -107,7 +108,6 @@ def send_donation_reminder_notifications():
     The notifications are sent two weeks before the due date.
     """
     db = website.db
-    counts = defaultdict(int)
     rows = db.all("""
         SELECT (SELECT p FROM participants p WHERE p.id = sp.payer) AS payer
              , json_agg((SELECT a FROM (
@@ -140,6 +140,7 @@ def send_donation_reminder_notifications():
     """)
     today = utcnow().date()
     next_payday = compute_next_payday_date()
+    notifications, payin_ids = [], {}
     for payer, payins in rows:
         if not payer.can_attempt_payment:
             continue
@@ -165,22 +166,24 @@ def send_donation_reminder_notifications():
                     overdue = True
         if not donations:
             continue
-        payer.notify(
-            'donate_reminder~v2',
+        notifications.append((payer, 'donate_reminder~v2', dict(
             donations=donations,
             overdue=overdue,
-            email_unverified_address=True,
+        )))
+        payin_ids[payer.id] = [sp['id'] for sp in payins]
+    if not notifications:
+        return
+    with db.get_cursor() as cursor:
+        inserted = db.Participant.notify_many(
+            notifications, email_unverified_address=True, cursor=cursor,
         )
-        counts['donate_reminder'] += 1
-        db.run("""
+        cursor.run("""
             UPDATE scheduled_payins
                SET notifs_count = notifs_count + 1
                  , last_notif_ts = now()
-             WHERE payer = %s
-               AND id IN %s
-        """, (payer.id, tuple(sp['id'] for sp in payins)))
-    for k, n in sorted(counts.items()):
-        logger.info("Sent %i %s notifications." % (n, k))
+             WHERE id = ANY(%s)
+        """, (list(chain.from_iterable(payin_ids[n.participant] for n in inserted)),))
+    logger.info("Sent %i donate_reminder notifications." % len(inserted))
 
 
 def send_upcoming_debit_notifications():
@@ -1,7 +1,9 @@
 import fnmatch
+from hashlib import blake2b
 import os
 import posixpath
 import re
+from tempfile import NamedTemporaryFile
 from urllib.parse import urlsplit
 
 import sass
@@ -10,6 +12,75 @@ from aspen import renderers
 from ..website import website
 
 
+import_re = re.compile(r'@import\s+([^;]+);')
+quoted_string_re = re.compile(r"""(['"])(.+?)\1""")
+
+
+def find_imports(src, base_dir, include_paths):
+    """Yield the paths of the SCSS files imported by `src`.
+
+    The imports that can't be resolved are ignored, they're either plain CSS
+    imports or errors that the compiler will report.
+    """
+    for m in import_re.finditer(src):
+        for m2 in quoted_string_re.finditer(m.group(1)):
+            dirname, basename = posixpath.split(m2.group(2))
+            found = False
+            for root in (base_dir, *include_paths):
+                for filename in (basename + '.scss', '_' + basename + '.scss'):
+                    path = os.path.join(root, dirname, filename)
+                    if os.path.isfile(path):
+                        yield path
+                        found = True
+                        break
+                if found:
+                    break
+
+
+def compile_scss(string, cache_dir, include_paths=(), **kw):
+    """Compile SCSS code, or fetch the result of a previous compilation.
+
+    The cache key is a hash of the compiler options and of the contents of all
+    the files imported (directly or indirectly) by `string`, so the cache never
+    has to be invalidated. Nothing is cached if `cache_dir` is empty.
+    """
+    if isinstance(include_paths, str):
+        include_paths = (include_paths,)
+    if not cache_dir:
+        return sass.compile(string=string, include_paths=list(include_paths), **kw)
+    h = blake2b(digest_size=20)
+    h.update(repr((sorted(kw.items()), include_paths)).encode('utf8'))
+    h.update(string.encode('utf8'))
+    seen = set()
+    queue = [(string, '.')]
+    while queue:
+        src, base_dir = queue.pop()
+        for path in find_imports(src, base_dir, include_paths):
+            if path in seen:
+                continue
+            seen.add(path)
+            with open(path, 'rb') as f:
+                content = f.read()
+            h.update(path.encode('utf8'))
+            h.update(content)
+            queue.append((content.decode('utf8'), os.path.dirname(path)))
+    cache_path = os.path.join(cache_dir, h.hexdigest() + '.css')
+    try:
+        with open(cache_path, encoding='utf8') as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    css = sass.compile(string=string, include_paths=list(include_paths), **kw)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with NamedTemporaryFile('w', dir=cache_dir, prefix='.', delete=False, encoding='utf8') as f:
+            f.write(css)
+        os.replace(f.name, cache_path)
+    except OSError as e:
+        website.tell_sentry(e)
+    return css
+
+
 class Renderer(renderers.Renderer):
 
     def __init__(self, factory, *a, **kw):
@@ -22,6 +93,7 @@ class Renderer(renderers.Renderer):
         if self.request_processor.project_root is not None:
             kw['include_paths'] = self.request_processor.project_root
         self.sass_conf = kw
+        self.cache_dir = website.env.scss_cache_dir
 
     # SASS doesn't support wildcard imports, so we implement it ourselves
     wildcard_import_re = re.compile(r'@import "(.*/)\*"')
@@ -58,7 +130,7 @@ class Renderer(renderers.Renderer):
         return self.url_re.sub(self.url_sub, css)
 
     def render_content(self, context):
-        css = sass.compile(**dict(self.sass_conf, string=self.compiled))
+        css = compile_scss(self.compiled, self.cache_dir, **self.sass_conf)
         if self.cache_static:
             css = self.replace_urls(css)
         return css
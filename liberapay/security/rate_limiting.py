@@ -0,0 +1,136 @@
+"""An in-process rate limiter for the high-volume rate limits.
+
+The counters of the rate limits listed in `LOCAL_RATE_LIMITS` are kept in
+memory by each process instead of being upserted into the `rate_limiting`
+table on every hit. The hits are periodically sent to the database in a single
+query, which returns the global values of the counters, so the processes are
+kept in sync with each other.
+
+The flushes are triggered by a cron job, and also by `hit` when the last one is
+too old or when there are too many buckets, so that the limits are still shared
+and the idle buckets still dropped when the cron jobs aren't running.
+"""
+
+from threading import Lock
+from time import monotonic
+
+from liberapay.constants import RATE_LIMITS
+from liberapay.website import website
+
+
+class Bucket:
+
+    __slots__ = ('counter', 'ts', 'unflushed')
+
+    def __init__(self, ts):
+        self.counter = 0
+        self.ts = ts
+        self.unflushed = 0
+
+
+class LocalRateLimiter:
+
+    def __init__(self, db, flush_interval=10, max_size=10000):
+        self.buckets = {}
+        self.db = db
+        self.lock = Lock()
+        self.flush_lock = Lock()
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.last_flush = monotonic()
+
+    def hit(self, key, cap, period):
+        """Works like the `hit_rate_limit` SQL function.
+
+        Returns the number of remaining hits, or `None` if the limit has been
+        reached.
+        """
+        now = monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = Bucket(now)
+            leak = min(int(cap * (now - bucket.ts) / period), bucket.counter)
+            if bucket.counter - leak >= cap and bucket.ts >= now - period / cap * 0.8:
+                return None
+            bucket.counter += 1 - leak
+            bucket.ts = now
+            bucket.unflushed += 1
+            remaining = cap - bucket.counter
+        self.flush_if_needed(now)
+        return remaining
+
+    def decrement(self, key, cap, period):
+        """Works like the `decrement_rate_limit` SQL function.
+        """
+        now = monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                return None
+            leak = int(cap * (now - bucket.ts) / period)
+            bucket.counter = max(bucket.counter - 1 - leak, 0)
+            bucket.ts = now
+            return bucket.counter
+
+    def flush_if_needed(self, now):
+        """Flush if it hasn't been done recently enough, unless another thread
+        is already doing it.
+        """
+        elapsed = now - self.last_flush
+        if elapsed < self.flush_interval:
+            if len(self.buckets) <= self.max_size or elapsed < 1:
+                return
+        if not self.flush_lock.acquire(blocking=False):
+            return
+        try:
+            self.flush()
+        finally:
+            self.flush_lock.release()
+
+    def flush(self):
+        """Add the recent hits to the counters in the database.
+
+        The local counters are then replaced by the global ones, and the
+        buckets which have been idle for a whole period are dropped.
+        """
+        now = self.last_flush = monotonic()
+        hits = []
+        with self.lock:
+            for key, bucket in list(self.buckets.items()):
+                cap, period = RATE_LIMITS[key.split(':', 1)[0]]
+                if bucket.unflushed:
+                    hits.append((key, cap, period, bucket.unflushed))
+                    bucket.unflushed = 0
+                elif bucket.ts < now - period:
+                    del self.buckets[key]
+        if not hits:
+            return
+        try:
+            counters = self.db.all("""
+                SELECT x.key, add_rate_limit_hits(x.key, x.cap, x.period, x.hits)
+                  FROM unnest(%s::text[], %s::int[], %s::float[], %s::int[])
+                       AS x (key, cap, period, hits)
+              ORDER BY x.key
+            """, tuple(map(list, zip(*hits))))
+        except Exception as e:
+            website.tell_sentry(e)
+            with self.lock:
+                for key, _, _, n in hits:
+                    bucket = self.buckets.get(key)
+                    if bucket:
+                        bucket.unflushed += n
+            return
+        now = monotonic()
+        with self.lock:
+            for key, counter in counters:
+                bucket = self.buckets.get(key)
+                if bucket:
+                    cap = RATE_LIMITS[key.split(':', 1)[0]][0]
+                    bucket.counter = min(counter + bucket.unflushed, cap)
+                    bucket.ts = now
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+            self.last_flush = monotonic()
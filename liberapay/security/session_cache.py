@@ -0,0 +1,103 @@
+"""A short-lived in-process cache of authenticated sessions.
+
+Looking up the session in the database on every request is the most frequent
+query of the app, so `Participant.authenticate_with_session` stores the result
+here for a little while.
+
+The entries are dropped when the session or the participant is modified: the
+database triggers defined in `sql/schema.sql` send the IDs of the modified
+participants to all the processes through the `session_cache` channel, and the
+methods of `Participant` which end or regenerate a session also drop the local
+entries directly.
+
+The bulk updates of the cached amounts (`giving`, `receiving`, etc) don't drop
+the cached sessions, so those amounts can be up to `max_age` seconds old.
+"""
+
+from threading import Lock
+from time import monotonic
+
+from liberapay.utils.listener import parse_ids_payload
+from liberapay.website import website
+
+
+class CachedSession:
+
+    __slots__ = ('secret', 'participant', 'mtime', 'latest_use', 'time')
+
+    def __init__(self, secret, participant, mtime, latest_use):
+        self.secret = secret
+        self.participant = participant
+        self.mtime = mtime
+        self.latest_use = latest_use
+        self.time = monotonic()
+
+
+class SessionCache:
+
+    CHANNEL = 'session_cache'
+
+    def __init__(self, listener, max_age, max_size=10000):
+        self.entries = {}
+        self.generation = 0
+        self.listener = listener
+        self.lock = Lock()
+        self.max_age = max_age
+        self.max_size = max_size
+
+    def get(self, p_id, session_id):
+        """Return the cached session, or `None`.
+        """
+        if not self.max_age:
+            return
+        try:
+            self.listener.poll(blocking=False)
+        except Exception as e:
+            website.tell_sentry(e)
+            return
+        entry = self.entries.get(p_id, {}).get(session_id)
+        if entry is None or entry.time < monotonic() - self.max_age:
+            return
+        return entry
+
+    def set(self, p_id, session_id, entry, generation):
+        """Store an entry, unless the cache has been invalidated since `generation`.
+
+        The `generation` argument should be the value of the `generation`
+        attribute before the entry was fetched from the database.
+        """
+        if not self.max_age:
+            return
+        try:
+            self.listener.poll()
+        except Exception as e:
+            website.tell_sentry(e)
+            return
+        with self.lock:
+            if self.generation != generation:
+                return
+            if len(self.entries) >= self.max_size and p_id not in self.entries:
+                self.entries.pop(next(iter(self.entries)))
+            self.entries.setdefault(p_id, {})[session_id] = entry
+
+    def invalidate(self, participant_ids=None):
+        """Drop the entries of the specified participants, or all of them.
+        """
+        with self.lock:
+            self.generation += 1
+            if participant_ids is None:
+                self.entries.clear()
+            else:
+                for p_id in participant_ids:
+                    self.entries.pop(p_id, None)
+
+    def on_notification(self, payload):
+        self.invalidate(parse_ids_payload(payload))
+
+
+def invalidate_cached_sessions(participant_id):
+    """Drop the cached sessions of a participant from this process's cache.
+    """
+    session_cache = getattr(website, 'session_cache', None)
+    if session_cache is not None:
+        session_cache.invalidate([participant_id])
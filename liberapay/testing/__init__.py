@@ -236,6 +236,7 @@ class Harness(unittest.TestCase):
                 tried.add(tuple(tablenames))
         self.db.run("ALTER SEQUENCE participants_id_seq RESTART WITH 1")
         self.db.run("ALTER SEQUENCE paydays_id_seq RESTART WITH 1")
+        self.client.website.rate_limiter.clear()
 
 
     @classmethod
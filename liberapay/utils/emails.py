@@ -3,9 +3,11 @@ from enum import Enum, auto
 from ipaddress import ip_address
 import json
 import logging
+from queue import LifoQueue
 from random import random
 import re
 from smtplib import SMTP, SMTPException, SMTPNotSupportedError, SMTPResponseException
+from threading import Lock
 import time
 
 from aspen.simplates.pagination import parse_specline, split_and_escape
@@ -13,6 +15,7 @@ from aspen_jinja2_renderer import SimplateLoader
 import boto3
 from dns.exception import DNSException
 from dns.resolver import Cache, NXDOMAIN, Resolver
+from jinja2 import meta
 from pando import Response
 from pando.utils import utcnow
 
@@ -59,9 +62,111 @@ def compile_email_spt(fpath):
         content_type, renderer = parse_specline(page.header)
         env = jinja_env_html if content_type == 'text/html' else jinja_env
         r[content_type] = SimplateLoader(fpath, tmpl).load(env, fpath)
+        r[content_type].variables = meta.find_undeclared_variables(env.parse(tmpl))
     return r
 
 
+class TemplateNotCacheable(Exception):
+    pass
+
+
+class RecipientPlaceholder:
+    """Stands in for the recipient of an email while its base is pre-rendered.
+
+    The calls to the `url` method are recorded and replaced by markers, any
+    other attribute access raises `TemplateNotCacheable`.
+    """
+
+    __slots__ = ('calls',)
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        raise TemplateNotCacheable(name)
+
+    def url(self, *args, **kw):
+        self.calls.append((args, kw))
+        return f'\x00{len(self.calls) - 1}\x00'
+
+
+BASE_TEMPLATE_VARIABLES = frozenset(('_', 'escape', 'locale', 'ngettext', 'participant'))
+
+
+def prerender_email_base(template, context):
+    """Render the parts of an email base template that don't depend on the recipient.
+
+    Args:
+        template: a compiled page of an email simplate
+        context (dict): contains the i18n helpers and the `escape` function
+
+    Returns:
+        `None` if the template uses other variables than the ones in
+        `BASE_TEMPLATE_VARIABLES`, otherwise a tuple containing the list of
+        rendered parts (the odd items are indexes in the second element), the
+        list of `participant.url()` calls, and the `partial_translation` flag.
+    """
+    if not template.variables <= BASE_TEMPLATE_VARIABLES:
+        return None
+    participant = context['participant'] = RecipientPlaceholder()
+    try:
+        output = template.render(context).strip()
+    except TemplateNotCacheable:
+        return None
+    return output.split('\x00'), participant.calls, bool(context.get('partial_translation'))
+
+
+class MailerPool:
+    """A pool of mailers which keep their connections open between messages.
+
+    Args:
+        make_mailer (callable): returns a new mailer object
+        size (int): the maximum number of mailers, i.e. of connections
+        send_rate (float): the maximum number of messages sent per second (0 disables the limit)
+        max_idle_time (float): the number of seconds after which an unused connection is reopened
+    """
+
+    def __init__(self, make_mailer, size, send_rate=0, max_idle_time=60):
+        self.make_mailer = make_mailer
+        self.send_rate = send_rate
+        self.max_idle_time = max_idle_time
+        self.mailers = LifoQueue()
+        for i in range(max(size, 1)):
+            self.mailers.put((None, 0))
+        self.rate_lock = Lock()
+        self.next_send_time = 0
+
+    def wait_for_turn(self):
+        if not self.send_rate:
+            return
+        with self.rate_lock:
+            now = time.monotonic()
+            send_time = max(now, self.next_send_time)
+            self.next_send_time = send_time + 1 / self.send_rate
+        if send_time > now:
+            time.sleep(send_time - now)
+
+    def send(self, **message):
+        self.wait_for_turn()
+        mailer, last_use_time = self.mailers.get()
+        try:
+            if mailer is None:
+                mailer = self.make_mailer()
+            elif time.monotonic() - last_use_time > self.max_idle_time:
+                mailer.close()
+            mailer.open()
+            return mailer.send(**message)
+        except Exception:
+            if mailer is not None:
+                try:
+                    mailer.close()
+                except Exception:
+                    pass
+            raise
+        finally:
+            self.mailers.put((mailer, time.monotonic()))
+
+
 DNS = Resolver()
 DNS.lifetime = 5.0  # limit queries to 5 seconds
 DNS.cache = Cache()
@@ -1,8 +1,12 @@
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
 from decimal import Decimal as D
+from io import StringIO
 import random
 import string
 
 from faker import Faker
+from pando.utils import utcnow
 from psycopg2 import IntegrityError
 
 from liberapay.constants import DONATION_LIMITS, PERIOD_CONVERSION_RATES
@@ -169,9 +173,225 @@ def populate_db(website, num_participants=100, num_tips=200, num_teams=5, num_co
         tips.append(fake_tip(db, tipper, tippee))
 
 
-def main():
+#: The number of rows generated by `populate_db_bulk` at scale 1.
+BULK_SIZES = dict(participants=1000, teams=20, communities=50, tips=3000, paydays=20)
+
+
+def _copy_value(v):
+    if v is None:
+        return r'\N'
+    if v is True:
+        return 't'
+    if v is False:
+        return 'f'
+    if isinstance(v, Money):
+        return f'({v.amount},{v.currency})'
+    if isinstance(v, datetime):
+        return v.isoformat()
+    return str(v).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+def copy_rows(cursor, tablename, columns, rows):
+    """Stream rows into a table with `COPY FROM STDIN`.
+    """
+    buffer = StringIO()
+    for row in rows:
+        buffer.write('\t'.join(map(_copy_value, row)))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor.copy_expert(
+        "COPY {} ({}) FROM STDIN".format(tablename, ', '.join(columns)), buffer
+    )
+
+
+def reserve_ids(cursor, tablename, n):
+    """Return `n` new values from the `id` sequence of a table.
+    """
+    return cursor.all("""
+        SELECT nextval(pg_get_serial_sequence(%s, 'id'))
+          FROM generate_series(1, %s)
+    """, (tablename, n))
+
+
+def unique_names(n, make_name):
+    """Generate `n` distinct names, appending a counter to the duplicates.
+    """
+    names, seen = [], set()
+    for i in range(n):
+        name = make_name()
+        while name.lower() in seen:
+            name = make_name() + str(i)
+        seen.add(name.lower())
+        names.append(name)
+    return names
+
+
+def random_datetime(start, end):
+    return start + (end - start) * random.random()
+
+
+def populate_db_bulk(website, scale=1):
+    """Populate DB with a large amount of fake data, using `COPY` instead of
+    `INSERT` statements.
+
+    The number of rows is `BULK_SIZES` multiplied by `scale`.
+    """
+    db = website.db
+    sizes = {k: max(int(v * scale), 1) for k, v in BULK_SIZES.items()}
+    sizes['paydays'] = BULK_SIZES['paydays']
+    now = utcnow()
+    year_ago = now - timedelta(days=365)
+    platforms = [p.name for p in website.platforms]
+
+    with db.get_cursor() as cursor:
+        cursor.run("SET LOCAL synchronous_commit TO off")
+
+        print("Making Participants")
+        n_people, n_teams = sizes['participants'], sizes['teams']
+        n_communities = sizes['communities']
+        n = n_people + n_teams + n_communities
+        ids = reserve_ids(cursor, 'participants', n)
+        usernames = unique_names(n_people + n_teams, lambda: faker.first_name() + fake_text_id(3))
+        participants = []
+        for i, p_id in enumerate(ids):
+            if i < n_people:
+                kind = random.choice(('individual', 'organization'))
+            elif i < n_people + n_teams:
+                kind = 'group'
+            else:
+                kind = 'community'
+            is_a_person = kind in ('individual', 'organization')
+            username = usernames[i] if i < len(usernames) else '~%i' % p_id
+            participants.append((
+                p_id, username,
+                username + '@example.org' if is_a_person else None,
+                is_a_person and (random.randrange(5) == 0),
+                is_a_person and (random.randrange(5) == 0),
+                'active', random_datetime(year_ago, now), kind,
+            ))
+        copy_rows(cursor, 'participants', (
+            'id', 'username', 'email', 'hide_giving', 'hide_receiving',
+            'status', 'join_time', 'kind',
+        ), participants)
+        people = participants[:n_people]
+        teams = participants[n_people:n_people + n_teams]
+        join_times = {p[0]: p[6] for p in participants}
+
+        print("Making Teams")
+        takes = []
+        members_of = {}
+        for team in teams:
+            members = random.sample(people, min(random.randint(1, 3), n_people))
+            members_of[team[0]] = [m[0] for m in members]
+            for m in members:
+                ctime = max(team[6], m[6])
+                takes.append((
+                    ctime, ctime, m[0], team[0], Money(-1, 'EUR'), team[0],
+                    '(0,0,{})',
+                ))
+        copy_rows(cursor, 'takes', (
+            'ctime', 'mtime', 'member', 'team', 'amount', 'recorder', 'actual_amount',
+        ), takes)
+
+        print("Making Elsewheres")
+        elsewheres = []
+        for p in participants[:n_people + n_teams]:
+            for platform_name in random.sample(platforms, random.randint(0, 3)):
+                elsewheres.append((
+                    platform_name, str(len(elsewheres)), p[1], p[0], '',
+                ))
+        copy_rows(cursor, 'elsewhere', (
+            'platform', 'user_id', 'user_name', 'participant', 'domain',
+        ), elsewheres)
+
+        print("Making Communities")
+        names = unique_names(n_communities, lambda: community.normalize(faker.city())[:30])
+        c_ids = reserve_ids(cursor, 'communities', n_communities)
+        communities, memberships = [], []
+        for c_id, name, p in zip(c_ids, names, participants[n_people + n_teams:]):
+            creator = random.choice(people)
+            communities.append((c_id, name, p[6], creator[0], 'mul', p[0]))
+            members = {creator[0]}
+            members.update(m[0] for m in random.sample(people, min(random.randint(1, 3), n_people)))
+            memberships.extend((m, c_id, p[6], p[6], True) for m in members)
+        copy_rows(cursor, 'communities', (
+            'id', 'name', 'ctime', 'creator', 'lang', 'participant',
+        ), communities)
+        copy_rows(cursor, 'community_memberships', (
+            'participant', 'community', 'ctime', 'mtime', 'is_on',
+        ), memberships)
+
+        print("Making Tips")
+        tippees = people + teams
+        pairs = set()
+        max_tips = min(sizes['tips'], n_people * (len(tippees) - 1))
+        while len(pairs) < max_tips:
+            tipper, tippee = random.choice(people)[0], random.choice(tippees)[0]
+            if tipper != tippee:
+                pairs.add((tipper, tippee))
+        tips = []
+        for tipper, tippee in pairs:
+            period = random.choice(DONATION_PERIODS)
+            limits = [l.amount for l in DONATION_LIMITS['EUR'][period]]
+            periodic_amount = random_money_amount(*limits)
+            amount = (periodic_amount * PERIOD_CONVERSION_RATES[period]).quantize(D_CENT)
+            ctime = random_datetime(max(join_times[tipper], join_times[tippee]), now)
+            tips.append((
+                ctime, ctime, tipper, tippee, Money(amount, 'EUR'), period,
+                Money(periodic_amount, 'EUR'), 1,
+            ))
+        copy_rows(cursor, 'tips', (
+            'ctime', 'mtime', 'tipper', 'tippee', 'amount', 'period',
+            'periodic_amount', 'visibility',
+        ), tips)
+
+        print("Making Paydays and Transfers")
+        for i in range(sizes['paydays'], 0, -1):
+            ts_start = now - timedelta(weeks=i)
+            ts_end = ts_start + timedelta(hours=1)
+            cursor.run("""
+                INSERT INTO paydays (ts_start, ts_end, stage, public_log)
+                     VALUES (%s, %s, NULL, '')
+            """, (ts_start, ts_end))
+            transfers = []
+            for ctime, _, tipper, tippee, amount, *_ in tips:
+                if ctime > ts_start or random.randrange(5) == 0:
+                    continue
+                timestamp = random_datetime(ts_start, ts_end)
+                if tippee in members_of:
+                    member = random.choice(members_of[tippee])
+                    if member == tipper:
+                        continue
+                    transfers.append((
+                        timestamp, tipper, member, amount, 'take', tippee,
+                        'succeeded', 'fake-%i' % tipper, 'fake-%i' % member,
+                    ))
+                else:
+                    transfers.append((
+                        timestamp, tipper, tippee, amount, 'tip', None,
+                        'succeeded', 'fake-%i' % tipper, 'fake-%i' % tippee,
+                    ))
+            copy_rows(cursor, 'transfers', (
+                'timestamp', 'tipper', 'tippee', 'amount', 'context', 'team',
+                'status', 'wallet_from', 'wallet_to',
+            ), transfers)
+
+    print("Computing Stats")
+    from liberapay.billing.payday import Payday
+    Payday.recompute_stats()
+    Payday.update_cached_amounts()
+
+
+def main(argv=None):
+    parser = ArgumentParser()
+    parser.add_argument('--bulk', action='store_true', help="use COPY to insert the data")
+    parser.add_argument('--scale', default=1, type=float, help="only used in bulk mode")
+    args = parser.parse_args(argv)
     from liberapay.main import website
-    populate_db(website)
+    if args.bulk:
+        populate_db_bulk(website, args.scale)
+    else:
+        populate_db(website)
     website.db.self_check()
 
 
@@ -528,15 +528,15 @@ def iter_payin_events(db, participant, period_start, period_end, minimize=False)
                 if use_destination_amounts:
                     event['amount'] = event['destination_amount']
                     event['reversed_amount'] = event['reversed_destination_amount']
-                totals['received'][event_date.month] += event['amount']
+                totals['received'][event_date.month].iadd(event['amount'])
                 if event['reversed_amount']:
-                    totals['received'][event_date.month] -= event['reversed_amount']
+                    totals['received'][event_date.month].isub(event['reversed_amount'])
         else:
             event['kind'] = 'payin'
             if event['status'] == 'succeeded':
-                totals['sent'][event_date.month] += event['amount']
+                totals['sent'][event_date.month].iadd(event['amount'])
                 if event['refunded_amount']:
-                    totals['sent'][event_date.month] -= event['refunded_amount']
+                    totals['sent'][event_date.month].isub(event['refunded_amount'])
         yield event
 
     if events:
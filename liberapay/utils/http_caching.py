@@ -3,18 +3,21 @@ Handles HTTP caching.
 """
 
 import atexit
+from collections import OrderedDict
+import gzip
 from hashlib import md5
 import os
-from tempfile import mkstemp
+from tempfile import NamedTemporaryFile, mkstemp
+from threading import Lock
+from time import monotonic
 
 from aspen.request_processor.dispatcher import DispatchResult, DispatchStatus
 from pando import Response
 
 from liberapay.security import DEFAULT_CACHE_CONTROL
 from liberapay.utils import b64encode_s, find_files
-
-
-ETAGS = {}
+from liberapay.utils.listener import parse_ids_payload, serialize_ids_payload
+from liberapay.website import website
 
 
 def compile_assets(website):
@@ -50,15 +53,148 @@ def clean_assets(www_root):
     rm_f(*[spt[:-4] for spt in find_files(www_root+'/assets/', '*.spt')])
 
 
-def asset_etag(path):
-    if path.endswith('.spt'):
-        return ''
-    if path in ETAGS:
-        return ETAGS[path]
-    with open(path, 'rb') as f:
-        h = b64encode_s(md5(f.read()).digest())
-    ETAGS[path] = h
-    return h
+class StaticAsset:
+    """A static file loaded in memory, along with its compressed variants.
+    """
+
+    __slots__ = ('etag', 'content_type', 'bodies')
+
+    def __init__(self, etag, content_type, bodies):
+        self.etag = etag
+        self.content_type = content_type
+        self.bodies = bodies
+
+
+class AssetManifest:
+    """The list of the static assets and of their ETags.
+
+    The ETags are computed lazily by `get_etag`, unless `build` has been
+    called, in which case all the assets are hashed and loaded in memory once,
+    along with their gzipped variants, so that `serve_static_asset` can
+    respond to the requests for them without going through the rest of the
+    state chain.
+    """
+
+    COMPRESSIBLE_MEDIA_TYPES = {
+        'application/javascript', 'application/json', 'application/xml',
+        'image/svg+xml', 'text/css', 'text/javascript', 'text/plain',
+    }
+    ENCODINGS = ('gzip',)
+
+    def __init__(self, assets_root):
+        self.assets_root = assets_root
+        self.assets = {}
+        self.etags = {}
+
+    def build(self, request_processor, cache_dir=''):
+        """Load the assets and their compressed variants.
+
+        The gzipped files are stored in `cache_dir`, named after the hash of
+        the original content, so that they're only compressed by the first
+        process which needs them. Nothing is stored if `cache_dir` is empty.
+        """
+        assets = {}
+        for fspath in find_files(self.assets_root, '*'):
+            if fspath.endswith('.spt'):
+                continue
+            with open(fspath, 'rb') as f:
+                body = f.read()
+            digest = md5(body).digest()
+            self.etags[fspath] = etag = b64encode_s(digest)
+            content_type = request_processor.guess_media_type(fspath)
+            bodies = {'identity': body}
+            if content_type in self.COMPRESSIBLE_MEDIA_TYPES:
+                compressed = self.gzip(body, digest.hex(), cache_dir)
+                if len(compressed) < len(body):
+                    bodies['gzip'] = compressed
+            if request_processor.charset_static:
+                content_type += '; charset=' + request_processor.charset_static
+            url_path = '/assets/' + fspath[len(self.assets_root):]
+            assets[url_path] = StaticAsset(etag, content_type.encode('ascii'), bodies)
+        self.assets = assets
+
+    @staticmethod
+    def gzip(body, key, cache_dir):
+        """Compress `body`, or fetch the result of a previous compression.
+        """
+        if not cache_dir:
+            return gzip.compress(body, compresslevel=9, mtime=0)
+        cache_path = os.path.join(cache_dir, key + '.gz')
+        try:
+            with open(cache_path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+        compressed = gzip.compress(body, compresslevel=9, mtime=0)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with NamedTemporaryFile('wb', dir=cache_dir, prefix='.', delete=False) as f:
+                f.write(compressed)
+            os.replace(f.name, cache_path)
+        except OSError as e:
+            website.tell_sentry(e)
+        return compressed
+
+    def get_etag(self, fspath):
+        if fspath.endswith('.spt'):
+            return ''
+        etag = self.etags.get(fspath)
+        if etag is None:
+            with open(fspath, 'rb') as f:
+                etag = b64encode_s(md5(f.read()).digest())
+            self.etags[fspath] = etag
+        return etag
+
+
+def parse_accept_encoding(header):
+    """Returns the set of content codings that the client accepts.
+    """
+    accepted = set()
+    for value in header.decode('ascii', 'replace').split(','):
+        coding, _, params = value.partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def serve_static_asset(request, response, website):
+    """Respond immediately to the requests for the assets listed in the manifest.
+
+    Only the requests for the current version of an asset are handled here,
+    the other ones go through the normal state chain.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return
+    asset = website.asset_manifest.assets.get(request.path.raw)
+    if asset is None or request.qs.get('etag') != asset.etag:
+        return
+    etag = asset.etag.encode('ascii')
+    response.headers[b'Cache-Control'] = b'public, max-age=31536000, immutable'
+    response.headers[b'Content-Type'] = asset.content_type
+    response.headers[b'Etag'] = etag
+    if len(asset.bodies) > 1:
+        response.headers[b'Vary'] = b'Accept-Encoding'
+    if request.headers.get(b'If-None-Match') == etag:
+        response.code = 304
+        raise response
+    accepted = parse_accept_encoding(request.headers.get(b'Accept-Encoding', b''))
+    for encoding in AssetManifest.ENCODINGS:
+        if encoding in accepted and encoding in asset.bodies:
+            response.headers[b'Content-Encoding'] = encoding.encode('ascii')
+            body = asset.bodies[encoding]
+            break
+    else:
+        body = asset.bodies['identity']
+    response.code = 200
+    response.headers[b'Content-Length'] = str(len(body)).encode('ascii')
+    response.body = body
+    raise response
 
 
 # algorithm functions
@@ -67,7 +203,7 @@ def get_etag_for_file(dispatch_result, website):
     if dispatch_result.status != DispatchStatus.okay:
         return {'etag': None}
     try:
-        return {'etag': asset_etag(dispatch_result.match)}
+        return {'etag': website.asset_manifest.get_etag(dispatch_result.match)}
     except Exception as e:
         website.tell_sentry(e)
         return {'etag': None}
@@ -113,3 +249,184 @@ def add_caching_to_response(website, response, request=None, etag=None):
         else:
             # Otherwise we cache for 1 hour
             response.headers[b'Cache-Control'] = b'public, max-age=3600'
+
+
+def set_etag_and_try_to_serve_304(request, response, etag):
+    """Set the `ETag` header of a dynamic response, and serve a 304 if the
+    client already has the current version of the resource.
+    """
+    etag = '"%s"' % etag
+    response.headers[b'ETag'] = etag.encode('ascii')
+    headers_etag = request.headers.get(b'If-None-Match', b'').decode('ascii', 'replace')
+    if headers_etag:
+        client_etags = set(e.strip().removeprefix('W/') for e in headers_etag.split(','))
+        if etag in client_etags or '*' in client_etags:
+            raise response.success(304)
+
+
+# response cache
+
+class CachedResponse:
+
+    __slots__ = ('participant', 'body', 'headers', 'etag', 'time')
+
+    def __init__(self, participant, body, headers, etag):
+        self.participant = participant
+        self.body = body
+        self.headers = headers
+        self.etag = etag
+        self.time = monotonic()
+
+
+class ResponseCache:
+    """An in-process cache of rendered responses.
+
+    It's meant for public resources that are requested very often, like the
+    widgets embedded in other websites. Each entry is linked to a participant,
+    so that it can be dropped when that participant's public data is modified,
+    see `invalidate_cached_responses`. The other processes are informed of the
+    invalidations through PostgreSQL's `NOTIFY` command, see `Listener`.
+
+    When the cache is full, the least recently used entry is dropped.
+
+    A response isn't stored if an invalidation happened while it was being
+    rendered, because it could contain data from before that invalidation.
+    """
+
+    CHANNEL = 'response_cache'
+    HEADERS = (
+        b'Access-Control-Allow-Origin', b'Cache-Control', b'Content-Disposition',
+        b'Content-Type', b'Vary',
+    )
+
+    def __init__(self, listener, max_age, max_size=5000):
+        self.entries = OrderedDict()
+        self.keys_by_participant = {}
+        self.listener = listener
+        self.lock = Lock()
+        self.max_age = max_age
+        self.max_size = max_size
+        self.generation = 0
+
+    @staticmethod
+    def get_key(state):
+        request = state['request']
+        return (request.hostname, bytes(request.line.uri), state['locale'].tag)
+
+    def serve_if_cached(self, state):
+        """Raise the cached response to the current request, if there is one.
+        """
+        if not self.max_age:
+            return
+        try:
+            self.listener.poll(blocking=False)
+        except Exception as e:
+            website.tell_sentry(e)
+            return
+        key = self.get_key(state)
+        state['response_cache_generation'] = self.generation
+        entry = self.entries.get(key)
+        if entry is None or entry.time < monotonic() - self.max_age:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+        request, response = state['request'], state['response']
+        for k, v in entry.headers:
+            response.headers[k] = v
+        set_etag_and_try_to_serve_304(request, response, entry.etag)
+        response.body = entry.body
+        raise response
+
+    def cache_response(self, state, participant):
+        """Mark the response to the current request as cacheable.
+
+        The response is stored by `store_response_in_cache` once it's rendered.
+        """
+        if self.max_age:
+            state['response_cache_entry'] = (
+                self.get_key(state), participant.id,
+                state.get('response_cache_generation'),
+            )
+
+    def store(self, key, participant_id, response, generation=None):
+        """Store a rendered response.
+
+        Returns `None` if the response wasn't stored because the cache has been
+        invalidated since the given `generation`.
+        """
+        headers = tuple(
+            (k, response.headers[k]) for k in self.HEADERS if k in response.headers
+        )
+        etag = b64encode_s(md5(response.body).digest())
+        entry = CachedResponse(participant_id, response.body, headers, etag)
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return None
+            self._pop(key)
+            self.entries[key] = entry
+            self.keys_by_participant.setdefault(participant_id, set()).add(key)
+            while len(self.entries) > self.max_size:
+                self._pop(next(iter(self.entries)))
+        return entry
+
+    def _pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            keys = self.keys_by_participant.get(entry.participant)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.keys_by_participant[entry.participant]
+
+    def invalidate(self, participant_ids=None):
+        """Drop the entries of the specified participants, or all of them.
+
+        This only affects the current process, call `invalidate_cached_responses`
+        to reach the other ones.
+        """
+        with self.lock:
+            self.generation += 1
+            if participant_ids is None:
+                self.entries.clear()
+                self.keys_by_participant.clear()
+                return
+            for p_id in participant_ids:
+                for key in self.keys_by_participant.pop(p_id, ()):
+                    self.entries.pop(key, None)
+
+    def on_notification(self, payload):
+        self.invalidate(parse_ids_payload(payload))
+
+
+def invalidate_cached_responses(db, participant_ids=None):
+    """Drop the cached responses linked to the specified participants, in all
+    the processes.
+
+    `participant_ids` should be a list, or `None` to drop everything. If `db` is
+    a cursor, then the other processes are only notified when the transaction
+    is committed.
+
+    The entries of the current process are dropped immediately, and again when
+    the process receives its own notification, that is after the commit. This
+    discards the responses rendered by concurrent requests from the data that
+    the transaction was modifying.
+    """
+    response_cache = getattr(website, 'response_cache', None)
+    if response_cache is not None and not response_cache.max_age:
+        # The cache is disabled.
+        return
+    payload = serialize_ids_payload(participant_ids)
+    if payload:
+        db.run("SELECT pg_notify(%s, %s)", (ResponseCache.CHANNEL, payload))
+    if response_cache is not None:
+        response_cache.invalidate(participant_ids)
+
+
+def store_response_in_cache(request, response, website, response_cache_entry=None):
+    if response_cache_entry is None or response.code != 200:
+        return
+    key, participant_id, generation = response_cache_entry
+    entry = website.response_cache.store(key, participant_id, response, generation)
+    if entry is not None:
+        set_etag_and_try_to_serve_304(request, response, entry.etag)
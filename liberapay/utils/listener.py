@@ -0,0 +1,101 @@
+"""Receive the messages sent through PostgreSQL's `NOTIFY` command.
+
+This is used to invalidate the in-process caches of all the processes.
+"""
+
+from threading import Lock
+
+import psycopg2
+
+
+class Listener:
+    """A dedicated database connection which listens on some channels.
+
+    Each channel is linked to a callback, which is called with the payload of
+    each message. When the connection is (re)established the callbacks are also
+    called with `None` as the payload, since messages could have been missed.
+    """
+
+    def __init__(self, dsn):
+        self.dsn = dsn
+        self.callbacks = {}
+        self.conn = None
+        self.lock = Lock()
+
+    def subscribe(self, channel, callback):
+        with self.lock:
+            self.callbacks[channel] = callback
+            if self.conn is not None:
+                self.conn.cursor().execute('LISTEN ' + channel)
+
+    def poll(self, blocking=True):
+        """Process the messages that have been received.
+
+        This method doesn't send any query to the database, it only reads what
+        has already been received by the connection's socket. It's called
+        periodically by a cron job, and also by the caches before they return
+        an entry.
+
+        If `blocking` is `False` and another thread is already polling, then
+        this method returns immediately.
+        """
+        if not self.callbacks:
+            return
+        if not self.lock.acquire(blocking=blocking):
+            return
+        try:
+            try:
+                if self.conn is None:
+                    conn = psycopg2.connect(self.dsn)
+                    conn.autocommit = True
+                    cursor = conn.cursor()
+                    for channel in self.callbacks:
+                        cursor.execute('LISTEN ' + channel)
+                    self.conn = conn
+                    notifies = [(channel, None) for channel in self.callbacks]
+                else:
+                    notifies = []
+                self.conn.poll()
+            except psycopg2.OperationalError:
+                if self.conn is not None:
+                    self.conn.close()
+                    self.conn = None
+                for callback in self.callbacks.values():
+                    callback(None)
+                raise
+            notifies.extend((n.channel, n.payload) for n in self.conn.notifies)
+            self.conn.notifies.clear()
+        finally:
+            self.lock.release()
+        for channel, payload in notifies:
+            self.callbacks[channel](payload)
+
+
+def parse_ids_payload(payload):
+    """Parse a payload containing comma-separated IDs.
+
+    Returns `None` if the payload is `None` or `'*'`, which means everything
+    should be invalidated.
+
+    >>> parse_ids_payload('1,23')
+    [1, 23]
+    >>> parse_ids_payload('*')
+    """
+    if payload is None or payload == '*':
+        return None
+    return [int(s) for s in payload.split(',')]
+
+
+def serialize_ids_payload(ids):
+    """Serialize a list of IDs. Returns `'*'` if `ids` is `None` or too long.
+
+    >>> serialize_ids_payload([1, 23])
+    '1,23'
+    """
+    if ids is None:
+        return '*'
+    payload = ','.join(map(str, ids))
+    if len(payload) >= 8000:
+        # That's the size limit of `NOTIFY` payloads.
+        return '*'
+    return payload
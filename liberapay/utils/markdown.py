@@ -1,3 +1,4 @@
+from functools import lru_cache
 import re
 
 from markupsafe import Markup
@@ -21,3 +22,10 @@ md = m.Markdown(renderer, extensions=(
 
 def render(markdown):
     return Markup(md(markdown))
+
+
+@lru_cache(maxsize=16)
+def render_cached(markdown):
+    """Same as `render`, for texts which are rendered many times.
+    """
+    return render(markdown)
@@ -0,0 +1,156 @@
+"""Keyset pagination (also known as cursor-based pagination).
+
+Instead of skipping the rows of the previous pages with an `OFFSET`, which
+forces the database to compute and sort all of them, the queries filter out the
+rows which come before the last row of the previous page. The `after` (or
+`before`) querystring parameter contains the ID of that row.
+"""
+
+from liberapay.utils import NO_DEFAULT
+
+
+class KeysetPager:
+    """Paginate a list sorted by `sort_key`.
+
+    Args:
+        qs (Mapping): the querystring of the request
+        per_page (int): the number of rows shown in each page
+        sort_key (list):
+            a list of `(sql_expression, 'asc' | 'desc')` tuples, the last
+            expression must be the unique ID that is put in the `after` and
+            `before` parameters, the expressions can contain placeholders for
+            table aliases (e.g. `{p}.join_time`)
+        max_page (int):
+            the maximum value of the legacy `page` parameter when it isn't
+            accompanied by a cursor
+        row_comparison (bool):
+            must be `False` if one of the sort expressions has a type which
+            doesn't have a btree operator class (e.g. `currency_amount`), since
+            PostgreSQL can't compare rows containing values of such a type
+
+    The `page` parameter is still accepted without a cursor, so that old links
+    keep working, but then an offset has to be used.
+    """
+
+    def __init__(self, qs, per_page, sort_key, max_page=100, row_comparison=True):
+        self.qs = qs
+        self.per_page = per_page
+        self.sort_key = sort_key
+        self.row_comparison = row_comparison
+        self.after = qs.get_int('after', default=None)
+        self.before = None if self.after else qs.get_int('before', default=None)
+        self.cursor = self.after or self.before
+        self.current_page = qs.get_int(
+            'page', default=1, minimum=1,
+            maximum=None if self.cursor else max_page,
+        )
+        self.has_prev = self.has_next = False
+
+    @property
+    def limit(self):
+        return self.per_page + 1
+
+    @property
+    def offset(self):
+        if self.cursor:
+            return 0
+        return (self.current_page - 1) * self.per_page
+
+    @property
+    def backwards(self):
+        return self.before is not None
+
+    def _directions(self):
+        for expression, order in self.sort_key:
+            if self.backwards:
+                order = 'asc' if order == 'desc' else 'desc'
+            yield expression, order
+
+    def sql_order(self, **aliases):
+        """Returns the `ORDER BY` clause of the query.
+        """
+        return ', '.join(
+            f"{expression.format(**aliases)} {order}"
+            for expression, order in self._directions()
+        )
+
+    def sql_filter(self, ref_from, **aliases):
+        """Returns the condition which selects the rows that come after the cursor.
+
+        The `ref_from` argument is the `FROM` clause which is used to find the
+        row referenced by the cursor. It uses the same placeholders as the sort
+        key, but they're replaced by different aliases.
+
+        The values of the referenced row are fetched by scalar subqueries, so
+        that the database can use them as the bounds of an index scan.
+        """
+        if not self.cursor:
+            return 'true'
+        ref_aliases = {k: v + '_ref' for k, v in aliases.items()}
+        ref_from = ref_from.format(**ref_aliases)
+        ref_id = self.sort_key[-1][0].format(**ref_aliases)
+        columns = []
+        for expression, order in self._directions():
+            ref_expression = expression.format(**ref_aliases)
+            if ref_expression == ref_id:
+                ref_value = f"{self.cursor:d}"
+            else:
+                ref_value = (
+                    f"(SELECT {ref_expression} FROM {ref_from} "
+                    f"WHERE {ref_id} = {self.cursor:d})"
+                )
+            columns.append((
+                expression.format(**aliases),
+                ref_value,
+                '<' if order == 'desc' else '>',
+            ))
+        operators = set(op for _, _, op in columns)
+        if len(operators) == 1 and self.row_comparison:
+            return '({}) {} ({})'.format(
+                ', '.join(a for a, _, _ in columns),
+                operators.pop(),
+                ', '.join(b for _, b, _ in columns),
+            )
+        # The sort orders are mixed, or the types can't be compared as rows.
+        a, b, op = columns[-1]
+        condition = f"{a} {op} {b}"
+        for a, b, op in reversed(columns[:-1]):
+            condition = f"{a} {op} {b} OR {a} = {b} AND ({condition})"
+        a, b, op = columns[0]
+        return f"({a} {op}= {b} AND ({condition}))"
+
+    def process(self, rows, get_id=NO_DEFAULT):
+        """Trims and reorders the rows, and determines which links to show.
+
+        The optional `get_id` argument is a function which extracts the ID of a
+        row, by default the first column of the row is assumed to be the ID, or
+        to be an object with an `id` attribute.
+        """
+        if get_id is NO_DEFAULT:
+            get_id = lambda row: getattr(row[0], 'id', row[0])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if self.backwards:
+            rows.reverse()
+            self.has_prev, self.has_next = has_more, True
+        else:
+            self.has_prev, self.has_next = self.current_page > 1, has_more
+        if rows:
+            self.first_id, self.last_id = get_id(rows[0]), get_id(rows[-1])
+        else:
+            self.has_prev = self.has_next = False
+        return rows
+
+    @property
+    def prev_url(self):
+        if not self.has_prev:
+            return
+        if self.current_page <= 2:
+            return self.qs.derive(page=None, after=None, before=None)
+        return self.qs.derive(page=self.current_page - 1, after=None, before=self.first_id)
+
+    @property
+    def next_url(self):
+        if not self.has_next:
+            return
+        return self.qs.derive(page=self.current_page + 1, after=self.last_id, before=None)
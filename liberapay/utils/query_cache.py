@@ -0,0 +1,170 @@
+"""A query cache shared by all the processes running on the same machine.
+
+The `postgres` library caches the results of the queries sent with a `max_age`
+argument, but each process has its own cache, so an expensive query is sent
+once per worker. The `SharedQueryCache` class extends that cache by storing the
+results in a directory (preferably in a memory-backed filesystem like
+`/dev/shm`), where the other processes can find them.
+
+A process which needs to (re)compute an entry first locks it with `flock`, so
+the other processes wait for the results instead of sending the same query
+(single-flight).
+
+Since the files are unpickled, the directory must only be writable by the user
+running the app, so it's created with restrictive permissions, and those are
+checked when the cache is initialized.
+"""
+
+import fcntl
+from hashlib import blake2b
+import os
+import pickle
+import stat
+from tempfile import NamedTemporaryFile
+from time import perf_counter, time
+
+from postgres.cache import Cache, CacheEntry
+
+from liberapay.website import website
+
+
+class InsecureCacheDirectory(Exception):
+
+    def __str__(self):
+        return (
+            "the query cache directory %r isn't a directory that only the current "
+            "user can access" % self.args
+        )
+
+
+def make_private_directory(path):
+    """Create the directory if it doesn't exist, then check that it's safe.
+
+    Raises `InsecureCacheDirectory` if the directory is a symlink, belongs to
+    another user, or is accessible by other users.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise InsecureCacheDirectory(path)
+
+
+class SharedLock:
+    """A lock that excludes the other threads, then the other processes.
+    """
+
+    __slots__ = ('thread_lock', 'path', 'fd')
+
+    def __init__(self, thread_lock, path):
+        self.thread_lock = thread_lock
+        self.path = path
+        self.fd = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        try:
+            self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        except OSError as e:
+            website.tell_sentry(e)
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            if self.fd is not None:
+                os.close(self.fd)  # this also releases the `flock`
+                self.fd = None
+        finally:
+            self.thread_lock.release()
+
+
+class SharedQueryCache(Cache):
+    """A `postgres.cache.Cache` backed by a shared directory.
+
+    Each entry is stored in a pickle file whose modification time is set to the
+    entry's expiration time, which allows `prune` to find the stale files
+    without reading them. The locks are striped over 256 files, so that the
+    lock files never need to be deleted.
+    """
+
+    __slots__ = ('directory',)
+
+    def __init__(self, directory, max_size=128):
+        super().__init__(max_size=max_size)
+        self.directory = directory
+        make_private_directory(directory)
+        make_private_directory(os.path.join(directory, 'locks'))
+
+    def get_path(self, key):
+        return os.path.join(self.directory, blake2b(key, digest_size=20).hexdigest())
+
+    def get_lock(self, key):
+        thread_lock = super().get_lock(key)
+        lock_path = os.path.join(self.directory, 'locks', self.get_path(key)[-2:])
+        return SharedLock(thread_lock, lock_path)
+
+    def lookup(self, key, max_age):
+        entry = super().lookup(key, max_age)
+        if entry is not None:
+            return entry
+        try:
+            with open(self.get_path(key), 'rb') as f:
+                wall_time, columns, rows = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            website.tell_sentry(e)
+            return
+        age = time() - wall_time
+        if age > max_age:
+            return
+        entry = CacheEntry(key, max_age, columns, rows)
+        entry.lock = self.entries.get(key, entry).lock
+        entry.time = perf_counter() - age
+        super().__setitem__(key, entry)
+        return entry
+
+    def __setitem__(self, key, entry):
+        super().__setitem__(key, entry)
+        if not self.max_size:
+            return
+        try:
+            data = pickle.dumps((time(), entry.columns, entry.rows), pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            # The rows contain objects that can't be pickled, so this entry
+            # can only be cached in memory.
+            return
+        try:
+            with NamedTemporaryFile(dir=self.directory, prefix='.', delete=False) as f:
+                f.write(data)
+            expiration_time = time() + entry.max_age
+            os.utime(f.name, (expiration_time, expiration_time))
+            os.replace(f.name, self.get_path(key))
+        except OSError as e:
+            website.tell_sentry(e)
+
+    def clear(self):
+        super().clear()
+        self.prune(expired_only=False)
+
+    def prune(self, expired_only=True):
+        """Drop the stale entries from the memory and from the shared directory.
+        """
+        super().prune()
+        now = time()
+        with os.scandir(self.directory) as it:
+            for dir_entry in it:
+                if not dir_entry.is_file():
+                    continue
+                try:
+                    mtime = dir_entry.stat().st_mtime
+                    if dir_entry.name.startswith('.'):
+                        # Temporary file, it's only stale if it's been left behind.
+                        mtime += 3600
+                    if not expired_only or mtime < now:
+                        os.unlink(dir_entry.path)
+                except FileNotFoundError:
+                    pass
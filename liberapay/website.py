@@ -107,8 +107,18 @@ env = Environment(
     CACHE_STATIC=is_yesish,
     CLEAN_ASSETS=is_yesish,
     RUN_CRON_JOBS=is_yesish,
+    CRON_WORKER=is_yesish,
+    CRON_WORKER_THREADS=int,
     OVERRIDE_PAYDAY_CHECKS=is_yesish,
+    PAYDAY_IN_MEMORY=is_yesish,
+    PAYDAY_PROCESSES=int,
+    PAYDAY_TRANSFERS_BATCH_SIZE=int,
     OVERRIDE_QUERY_CACHE=is_yesish,
+    QUERY_CACHE_DIR=str,
+    RESPONSE_CACHE_MAX_AGE=int,
+    SESSION_CACHE_MAX_AGE=int,
+    SCSS_CACHE_DIR=str,
+    COMPRESSED_ASSETS_DIR=str,
     GRATIPAY_BASE_URL=str,
     SECRET_FOR_GRATIPAY=str,
     INSTANCE_TYPE=str,
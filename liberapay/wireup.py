@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from decimal import Decimal
 from functools import partial
@@ -12,7 +13,6 @@ import traceback
 import xml.etree.ElementTree as ET
 
 import babel
-from babel.messages.pofile import read_po
 from babel.numbers import parse_pattern
 import boto3
 from mailshake import AmazonSESMailer, ToConsoleMailer, SMTPMailer
@@ -22,7 +22,6 @@ import psycopg2
 from psycopg2.extensions import adapt, AsIs, new_type, register_adapter, register_type
 from psycopg2_pool import PoolError
 import requests
-import sass
 import sentry_sdk
 from state_chain import StateChain
 
@@ -32,12 +31,12 @@ from liberapay.elsewhere._base import (
     BadUserId, ElsewhereError, HTTPError, RateLimitError, UserNotFound,
 )
 from liberapay.exceptions import NeedDatabase
+from liberapay.i18n.catalogs import get_default_paths, load_catalogs
 from liberapay.i18n.base import (
     ACCEPTED_LANGUAGES, COUNTRIES, LOCALE_EN, LOCALES, LOCALES_DEFAULT_MAP, Locale,
     make_sorted_dict, to_age,
 )
 from liberapay.i18n.currencies import Money, MoneyBasket, get_currency_exchange_rates
-from liberapay.i18n.plural_rules import get_function_from_rule
 from liberapay.models import DB
 from liberapay.models.account_elsewhere import _AccountElsewhere, AccountElsewhere
 from liberapay.models.community import _Community, Community
@@ -48,11 +47,16 @@ from liberapay.models.payin import Payin
 from liberapay.models.payin_transfer import PayinTransfer
 from liberapay.models.repository import Repository
 from liberapay.models.tip import Tip
+from liberapay.renderers.scss import compile_scss
 from liberapay.security.crypto import Cryptograph
 from liberapay.security.csp import CSP
+from liberapay.security.rate_limiting import LocalRateLimiter
+from liberapay.security.session_cache import SessionCache
 from liberapay.utils import find_files, markdown, resolve
-from liberapay.utils.emails import compile_email_spt
-from liberapay.utils.http_caching import asset_etag
+from liberapay.utils.emails import MailerPool, compile_email_spt
+from liberapay.utils.http_caching import AssetManifest, ResponseCache
+from liberapay.utils.listener import Listener
+from liberapay.utils.query_cache import SharedQueryCache
 from liberapay.utils.types import LocalizedString, Object
 from liberapay.version import get_version
 from liberapay.website import Website
@@ -107,8 +111,11 @@ class NoDB:
 def database(env, tell_sentry):
     dburl = env.database_url
     maxconn = env.database_maxconn
+    cache = None
+    if env.query_cache_dir and not env.override_query_cache:
+        cache = SharedQueryCache(env.query_cache_dir)
     try:
-        db = DB(dburl, maxconn=maxconn, cursor_factory=SimpleRowCursor)
+        db = DB(dburl, maxconn=maxconn, cursor_factory=SimpleRowCursor, cache=cache)
     except psycopg2.OperationalError as e:
         tell_sentry(e, allow_reraise=False)
         db = NoDB()
@@ -209,6 +216,8 @@ class AppConf:
     check_email_domains:  bool
     check_email_servers:  bool
     cron_intervals:  dict
+    email_send_rate:  float
+    email_sending_threads:  int
     fixer_access_key:  str | None
     github_callback:  str
     github_id:  str
@@ -306,6 +315,10 @@ class AppConf:
         }
 
 
+def rate_limiter(db):
+    return {'rate_limiter': LocalRateLimiter(db)}
+
+
 def app_conf(db):
     if not db:
         return {'app_conf': None}
@@ -322,14 +335,18 @@ def mail(app_conf, env, project_root='.'):
     if smtp_conf:
         smtp_conf.setdefault('timeout', app_conf.socket_timeout)
     if getattr(app_conf, 'ses_region', None):
-        mailer = AmazonSESMailer(
+        make_mailer = partial(
+            AmazonSESMailer,
             env.aws_access_key_id, env.aws_secret_access_key,
             region_name=app_conf.ses_region
         )
     elif smtp_conf:
-        mailer = SMTPMailer(**smtp_conf)
+        make_mailer = partial(SMTPMailer, **smtp_conf)
     else:
-        mailer = ToConsoleMailer()
+        make_mailer = ToConsoleMailer
+    mailer = MailerPool(
+        make_mailer, app_conf.email_sending_threads, app_conf.email_send_rate
+    )
     emails = {}
     emails_dir = project_root+'/emails/'
     i = len(emails_dir)
@@ -348,7 +365,7 @@ def mail(app_conf, env, project_root='.'):
         print(text)
         print('  ', '='*27, 'END EMAIL', '='*27)
 
-    if app_conf.log_emails and not isinstance(mailer, ToConsoleMailer):
+    if app_conf.log_emails and make_mailer is not ToConsoleMailer:
         log_email = log_email
     else:
         log_email = lambda *a, **kw: None
@@ -655,82 +672,35 @@ def accounts_elsewhere(app_conf, asset, canonical_url, db):
     return {'platforms': platforms}
 
 
-def replace_unused_singulars(c):
-    for m in list(c):
-        msg = m.id
-        if not isinstance(msg, tuple):
-            continue
-        if msg[0].startswith('<unused singular (hash='):
-            del c[msg[0]]
-            c[msg[1]] = m
-
-
-def intern_source_strings(catalog):
-    """Intern message IDs to save memory and speed up translation lookups.
-    """
-    for m in list(catalog):
-        m.id = tuple(map(intern, m.id)) if isinstance(m.id, tuple) else intern(m.id)
-        catalog.delete(m.id)
-        catalog[m.id] = m
-
-
 def load_i18n(canonical_host, canonical_scheme, project_root, tell_sentry):
-    def compute_percentage(it, total):
-        return sum(
-            (compute_percentage(s, len(s)) if isinstance(s, tuple) else 1) for s in it if s
-        ) / total
-
     # Load the base locales
-    localeDir = os.path.join(project_root, 'i18n', 'core')
     locales = LOCALES
     supported_currencies_en = locales['en'].supported_currencies
-    for file in os.listdir(localeDir):
-        parts = file.split(".")
-        if not (len(parts) == 2 and parts[1] == "po"):
+    catalogs = load_catalogs(*get_default_paths(project_root), tell_sentry=tell_sentry)
+    for lang, c in catalogs.items():
+        if c.missing_translations == 1:
             continue
-        lang = parts[0]
-        with open(os.path.join(localeDir, file), 'rb') as f:
-            l = Locale.parse(lang)
-            c = l.catalog = read_po(f)
-            del l.catalog['']
-            intern_source_strings(c)
-            c.plural_func = get_function_from_rule(c.plural_expr)
-            replace_unused_singulars(c)
-            missing = fuzzy = 0
-            for msg in c:
-                if any(msg.string):
-                    if isinstance(msg.string, tuple):
-                        missing += sum(1 for s in msg.string if not s) / len(msg.string)
-                    if msg.fuzzy:
-                        fuzzy += 1
-                else:
-                    missing += 1
-            l.missing_translations = missing / len(c)
-            l.fuzzy_translations = fuzzy / len(c)
-            l.completion = 1 - (
-                l.missing_translations +
-                l.fuzzy_translations
-            )
-            del missing, fuzzy
-            if l.missing_translations == 1:
-                continue
-            else:
-                locales[l.tag] = l
-            l.countries = make_sorted_dict(
-                COUNTRIES, l.territories, COUNTRIES
-            )
-            l._data['languages'] = {
-                intern(k.replace('_', '-').lower()): v
-                for k, v in l.languages.items()
-            }
-            l.accepted_languages = make_sorted_dict(
-                ACCEPTED_LANGUAGES, l.languages, ACCEPTED_LANGUAGES
-            )
-            l.supported_currencies = make_sorted_dict(
-                supported_currencies_en, l.currencies, supported_currencies_en,
-                l.title,
-            )
-            l.grouped_time_zones
+        l = Locale.parse(lang)
+        l.catalog = c
+        l.missing_translations = c.missing_translations
+        l.fuzzy_translations = c.fuzzy_translations
+        l.completion = 1 - (l.missing_translations + l.fuzzy_translations)
+        locales[l.tag] = l
+        l.countries = make_sorted_dict(
+            COUNTRIES, l.territories, COUNTRIES
+        )
+        l._data['languages'] = {
+            intern(k.replace('_', '-').lower()): v
+            for k, v in l.languages.items()
+        }
+        l.accepted_languages = make_sorted_dict(
+            ACCEPTED_LANGUAGES, l.languages, ACCEPTED_LANGUAGES
+        )
+        l.supported_currencies = make_sorted_dict(
+            supported_currencies_en, l.currencies, supported_currencies_en,
+            l.title,
+        )
+        l.grouped_time_zones
         if l.script and l.language not in LOCALES_DEFAULT_MAP:
             tell_sentry(Warning(
                 f"the default script for language {l.language!r} is not "
@@ -741,9 +711,14 @@ def load_i18n(canonical_host, canonical_scheme, project_root, tell_sentry):
     # Prepare a unique and sorted list for use in the navbar language switcher
     domain, port = (canonical_host.split(':') + [None])[:2]
     port = int(port) if port else socket.getservbyname(canonical_scheme, 'tcp')
+    base_locales = list(locales.values())
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        subdomains_exist = list(executor.map(
+            lambda l: bool(resolve(f"{l.tag}.{domain}", port)), base_locales
+        ))
     lang_list = []
-    for l in locales.values():
-        if resolve(f"{l.tag}.{domain}", port):
+    for l, subdomain_exists in zip(base_locales, subdomains_exist):
+        if subdomain_exists:
             l.base_url = f"{canonical_scheme}://{l.tag}.{canonical_host}"
             if l.completion > 0.5:
                 lang_list.append((l.title(l.display_name), l))
@@ -756,66 +731,74 @@ def load_i18n(canonical_host, canonical_scheme, project_root, tell_sentry):
                 ))
     lang_list.sort()
 
-    # Load the territorial locales
+    # Add year-less date format
+    year_re = re.compile(r'(^y+[^a-zA-Z]+|[^a-zA-Z]+y+$|y+[^a-zA-Z]+$)')
+
+    def finish_locale(l):
+        short_format = l.date_formats['short'].pattern
+        assert year_re.search(short_format), (l.language, short_format)
+        l.date_formats['short_yearless'] = year_re.sub('', short_format)
+        # Patch the locales to look less formal
+        # The territorial locales can inherit the patched data from their base.
+        if l.language == 'fr':
+            if l.currency_formats['standard'] is not friendlier_french_currency_format:
+                assert l.currency_formats['standard'].pattern == '#,##0.00\xa0¤'
+                l.currency_formats['standard'] = friendlier_french_currency_format
+            if l.currencies['USD'] != 'dollar états-unien':
+                assert l.currencies['USD'] == 'dollar des États-Unis'
+                l.currencies['USD'] = 'dollar états-unien'
+
+    friendlier_french_currency_format = parse_pattern('#,##0.00\u202f\xa4')
+    for l in base_locales:
+        finish_locale(l)
+        # Add universal strings
+        # These strings don't need to be translated, but they have to be in the
+        # catalogs so that they're counted as translated.
+        l.catalog.add("PayPal", "PayPal")
+
+    # Register the territorial locales, they're only loaded when they're needed
+    def load_territorial_locale(loc_id, base):
+        l = Locale.parse(loc_id)
+        l.catalog = base.catalog
+        l.missing_translations = base.missing_translations
+        l.fuzzy_translations = base.fuzzy_translations
+        l.completion = base.completion
+        l._data['languages'] = base.languages
+        l.countries = base.countries
+        l.accepted_languages = base.accepted_languages
+        l.supported_currencies = base.supported_currencies
+        if l.grouped_time_zones == base.grouped_time_zones:
+            l.grouped_time_zones = base.grouped_time_zones
+        finish_locale(l)
+        return l
+
     for loc_id in sorted(babel.localedata.locale_identifiers()):
         key = loc_id.replace('_', '-').lower()
         if key in locales:
             continue
         base = locales.get(key.rsplit('-', 1)[0])
         if base:
-            l = Locale.parse(loc_id)
-            if not l.territory or l.variant:
+            language, territory, script, variant = babel.core.parse_locale(loc_id)
+            if not territory or variant:
                 continue
-            l.catalog = base.catalog
-            l.missing_translations = base.missing_translations
-            l.fuzzy_translations = base.fuzzy_translations
-            l.completion = base.completion
-            l._data['languages'] = base.languages
-            l.countries = base.countries
-            l.accepted_languages = base.accepted_languages
-            l.supported_currencies = base.supported_currencies
-            if l.grouped_time_zones == base.grouped_time_zones:
-                l.grouped_time_zones = base.grouped_time_zones
-            if l.script:
-                scriptless_tag = f"{l.language}-{l.territory.lower()}"
+            if script:
+                scriptless_tag = f"{language}-{territory.lower()}"
                 if scriptless_tag not in LOCALES_DEFAULT_MAP:
                     tell_sentry(Warning(
                         f"the default script for language {scriptless_tag!r} is "
-                        f"not defined in LOCALES_DEFAULT_MAP, using {l.script!r}"
+                        f"not defined in LOCALES_DEFAULT_MAP, using {script!r}"
                     ))
-                    LOCALES_DEFAULT_MAP[scriptless_tag] = l.tag
-            locales[l.tag] = l
+                    LOCALES_DEFAULT_MAP[scriptless_tag] = key
+            locales.register(key, partial(load_territorial_locale, loc_id, base))
 
     # Unload the Babel data that we no longer need
     # We load a lot of data to populate the LANGUAGE_NAMES dict, we don't want
     # to keep it all in RAM.
-    used_data_dict_addresses = set(id(l._data._data) for l in locales.values())
+    used_data_dict_addresses = set(id(l._data._data) for l in base_locales)
     for key, data_dict in list(babel.localedata._cache.items()):
         if id(data_dict) not in used_data_dict_addresses:
             del babel.localedata._cache[key]
 
-    # Add year-less date format
-    year_re = re.compile(r'(^y+[^a-zA-Z]+|[^a-zA-Z]+y+$|y+[^a-zA-Z]+$)')
-    for l in locales.values():
-        short_format = l.date_formats['short'].pattern
-        assert year_re.search(short_format), (l.language, short_format)
-        l.date_formats['short_yearless'] = year_re.sub('', short_format)
-
-    # Add universal strings
-    # These strings don't need to be translated, but they have to be in the catalogs
-    # so that they're counted as translated.
-    for l in locales.values():
-        l.catalog.add("PayPal", "PayPal")
-
-    # Patch the locales to look less formal
-    friendlier_french_currency_format = parse_pattern('#,##0.00\u202f\xa4')
-    for l in locales.values():
-        if l.language == 'fr':
-            assert l.currency_formats['standard'].pattern == '#,##0.00\xa0¤'
-            l.currency_formats['standard'] = friendlier_french_currency_format
-            assert l.currencies['USD'] == 'dollar des États-Unis'
-            l.currencies['USD'] = 'dollar états-unien'
-
     # Load the markdown files
     docs = {}
     heading_re = re.compile(r'^(#+ )', re.M)
@@ -833,14 +816,18 @@ def load_i18n(canonical_host, canonical_scheme, project_root, tell_sentry):
     return {'docs': docs, 'lang_list': lang_list, 'locales': locales}
 
 
-def asset_url_generator(env, asset_url, tell_sentry, www_root):
+def asset_manifest(www_root):
+    return {'asset_manifest': AssetManifest(www_root+'/assets/')}
+
+
+def asset_url_generator(env, asset_manifest, asset_url, tell_sentry, www_root):
     def asset(*paths, domain=True):
         for path in paths:
             fspath = www_root+'/assets/'+path
             etag = ''
             try:
                 if env.cache_static:
-                    etag = asset_etag(fspath)
+                    etag = asset_manifest.get_etag(fspath)
                 else:
                     os.stat(fspath)
             except FileNotFoundError as e:
@@ -878,7 +865,7 @@ def icon_names(www_root):
     return {'icon_names': icon_identifiers}
 
 
-def load_scss_variables(project_root):
+def load_scss_variables(env, project_root):
     """Build a dict representing the `style/variables.scss` file.
     """
     # Get the names of all the variables
@@ -887,7 +874,7 @@ def load_scss_variables(project_root):
     names = [m.group(1) for m in re.finditer(r'^\$([\w-]+):', variables, re.M)]
     # Compile a big rule that uses all the variables
     props = ''.join('-x-{0}: ${0};'.format(name) for name in names)
-    css = sass.compile(string=('%s\nx { %s }' % (variables, props)))
+    css = compile_scss('%s\nx { %s }' % (variables, props), env.scss_cache_dir)
     # Read the final values from the generated CSS
     d = dict((m.group(1), m.group(2)) for m in re.finditer(r'-x-([\w-]+): (.+?);\s', css))
     return {'scss_variables': d}
@@ -902,6 +889,24 @@ def s3(env):
     return {'s3': s3}
 
 
+def listener(env):
+    return {'listener': Listener(env.database_url)}
+
+
+def response_cache(env, listener):
+    cache = ResponseCache(listener, env.response_cache_max_age)
+    if cache.max_age:
+        listener.subscribe(ResponseCache.CHANNEL, cache.on_notification)
+    return {'response_cache': cache}
+
+
+def session_cache(env, listener):
+    cache = SessionCache(listener, env.session_cache_max_age)
+    if cache.max_age:
+        listener.subscribe(SessionCache.CHANNEL, cache.on_notification)
+    return {'session_cache': cache}
+
+
 def currency_exchange_rates(db):
     if not db:
         return
@@ -919,6 +924,7 @@ full_chain = StateChain(
     make_sentry_teller,
     crypto,
     database,
+    rate_limiter,
     canonical,
     csp,
     app_conf,
@@ -926,11 +932,15 @@ full_chain = StateChain(
     stripe,
     username_restrictions,
     load_i18n,
+    asset_manifest,
     asset_url_generator,
     icon_names,
     accounts_elsewhere,
     load_scss_variables,
     s3,
+    listener,
+    response_cache,
+    session_cache,
     currency_exchange_rates,
 )
 
@@ -9,6 +9,8 @@ INSERT INTO app_conf (key, value) VALUES
     ('check_email_domains', 'true'::jsonb),
     ('check_email_servers', 'true'::jsonb),
     ('cron_intervals', jsonb_build_object()),
+    ('email_send_rate', '1.0'::jsonb),
+    ('email_sending_threads', '2'::jsonb),
     ('fixer_access_key', 'null'::jsonb),
     ('github_callback', '"http://127.0.0.1:8339/on/github/associate"'::jsonb),
     ('github_id', '"18891d01e40e5aef93b8"'::jsonb),
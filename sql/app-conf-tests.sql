@@ -6,6 +6,8 @@ DO $$
 BEGIN
     PERFORM update_app_conf('check_avatar_urls', 'false'::jsonb);
     PERFORM update_app_conf('check_email_domains', 'false'::jsonb);
+    PERFORM update_app_conf('email_send_rate', '0.0'::jsonb);
+    PERFORM update_app_conf('email_sending_threads', '1'::jsonb);
     PERFORM update_app_conf('payin_methods', '{"*": true}'::jsonb);
     PERFORM update_app_conf('s3_endpoint', '"https://tests.liberapay.org"'::jsonb);
     PERFORM update_app_conf('s3_secret_key', '"fake"'::jsonb);
@@ -0,0 +1,564 @@
+-- participants whose cached amounts (giving, receiving, etc) are out of date
+
+CREATE TABLE dirty_participants
+( participant   bigint        PRIMARY KEY REFERENCES participants ON DELETE CASCADE
+, ts            timestamptz   NOT NULL DEFAULT current_timestamp
+);
+
+CREATE FUNCTION mark_participants_as_dirty() RETURNS trigger AS $$
+    DECLARE
+        rec record;
+    BEGIN
+        IF (TG_OP = 'DELETE') THEN
+            rec := OLD;
+        ELSE
+            rec := NEW;
+        END IF;
+        IF (TG_TABLE_NAME = 'tips') THEN
+            INSERT INTO dirty_participants (participant)
+                 SELECT p.id FROM participants p WHERE p.id IN (rec.tipper, rec.tippee)
+            ON CONFLICT (participant) DO NOTHING;
+        ELSIF (TG_TABLE_NAME = 'takes') THEN
+            INSERT INTO dirty_participants (participant)
+                 SELECT p.id FROM participants p WHERE p.id IN (rec.team, rec.member)
+            ON CONFLICT (participant) DO NOTHING;
+        ELSE
+            INSERT INTO dirty_participants (participant)
+                 VALUES (rec.id)
+            ON CONFLICT (participant) DO NOTHING;
+        END IF;
+        RETURN NULL;
+    END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER mark_participants_as_dirty
+    AFTER INSERT OR DELETE OR UPDATE OF amount, paid_in_advance ON tips
+    FOR EACH ROW EXECUTE PROCEDURE mark_participants_as_dirty();
+
+CREATE TRIGGER mark_participants_as_dirty
+    AFTER INSERT OR DELETE OR UPDATE OF amount, paid_in_advance ON takes
+    FOR EACH ROW EXECUTE PROCEDURE mark_participants_as_dirty();
+
+CREATE TRIGGER mark_participants_as_dirty
+    AFTER UPDATE OF status, is_suspended, goal, main_currency, accepted_currencies ON participants
+    FOR EACH ROW WHEN (
+        OLD.status IS DISTINCT FROM NEW.status OR
+        OLD.is_suspended IS DISTINCT FROM NEW.is_suspended OR
+        OLD.goal IS DISTINCT FROM NEW.goal OR
+        OLD.main_currency IS DISTINCT FROM NEW.main_currency OR
+        OLD.accepted_currencies IS DISTINCT FROM NEW.accepted_currencies
+    )
+    EXECUTE PROCEDURE mark_participants_as_dirty();
+
+CREATE FUNCTION bump_currency_exchange_rates_version() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO db_meta (key, value)
+             VALUES ('currency_exchange_rates_version', '1'::jsonb)
+        ON CONFLICT (key) DO UPDATE
+                SET value = to_jsonb(db_meta.value::text::bigint + 1);
+        RETURN NULL;
+    END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER bump_currency_exchange_rates_version
+    AFTER INSERT OR UPDATE OR DELETE ON currency_exchange_rates
+    FOR EACH STATEMENT EXECUTE PROCEDURE bump_currency_exchange_rates_version();
+
+-- A helper that raises an exception, for use in `LANGUAGE sql` functions. It's
+-- only called when the error needs to be raised, so the functions below can be
+-- inlined by the query planner.
+
+CREATE FUNCTION currency_mismatch(currency, currency, anyelement) RETURNS anyelement AS $$
+    BEGIN
+        IF ($1 IS NULL OR $2 IS NULL) THEN RETURN NULL; END IF;
+        RAISE 'currency mistmatch: % != %', $1, $2;
+    END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION currency_amount_add(currency_amount, currency_amount)
+RETURNS currency_amount AS $$
+    SELECT CASE WHEN $1.currency = $2.currency
+                THEN ($1.amount + $2.amount, $1.currency)::currency_amount
+                ELSE currency_mismatch($1.currency, $2.currency, NULL::currency_amount)
+           END;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION currency_amount_sub(currency_amount, currency_amount)
+RETURNS currency_amount AS $$
+    SELECT CASE WHEN $1.currency = $2.currency
+                THEN ($1.amount - $2.amount, $1.currency)::currency_amount
+                ELSE currency_mismatch($1.currency, $2.currency, NULL::currency_amount)
+           END;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION currency_amount_neg(currency_amount)
+RETURNS currency_amount AS $$
+    SELECT CASE WHEN $1.currency IS NOT NULL
+                THEN (-$1.amount, $1.currency)::currency_amount
+           END;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION currency_amount_mul(currency_amount, numeric)
+RETURNS currency_amount AS $$
+    SELECT CASE WHEN $1.currency IS NOT NULL AND $2 IS NOT NULL
+                THEN ($1.amount * $2, $1.currency)::currency_amount
+           END;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION currency_amount_mul(numeric, currency_amount)
+RETURNS currency_amount AS $$
+    SELECT CASE WHEN $1 IS NOT NULL AND $2.currency IS NOT NULL
+                THEN ($2.amount * $1, $2.currency)::currency_amount
+           END;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION currency_amount_div(currency_amount, currency_amount)
+RETURNS numeric AS $$
+    SELECT CASE WHEN $1.currency = $2.currency
+                THEN $1.amount / $2.amount
+                ELSE currency_mismatch($1.currency, $2.currency, NULL::numeric)
+           END;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION get_currency_exponent(currency) RETURNS int AS $$
+    SELECT CASE
+        WHEN $1 IN ('ISK', 'JPY', 'KRW') THEN 0
+        WHEN $1 IS NOT NULL THEN 2
+    END;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION get_currency(currency_amount) RETURNS currency AS $$
+    SELECT $1.currency;
+$$ LANGUAGE sql IMMUTABLE STRICT;
+
+CREATE OR REPLACE FUNCTION round(currency_amount) RETURNS currency_amount AS $$
+    SELECT CASE WHEN $1.currency IS NOT NULL
+                THEN (round($1.amount, get_currency_exponent($1.currency)), $1.currency)::currency_amount
+           END;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION zero(currency) RETURNS currency_amount AS $$
+    SELECT CASE WHEN $1 IS NOT NULL
+                THEN (round(0, get_currency_exponent($1)), $1)::currency_amount
+           END;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION zero(currency_amount) RETURNS currency_amount AS $$
+    SELECT zero($1.currency);
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION currency_amount_eq(currency_amount, currency_amount)
+RETURNS boolean AS $$
+    SELECT $1.currency = $2.currency AND $1.amount = $2.amount;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION currency_amount_ne(currency_amount, currency_amount)
+RETURNS boolean AS $$
+    SELECT $1.currency <> $2.currency OR $1.amount <> $2.amount;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION currency_amount_gt(currency_amount, currency_amount)
+RETURNS boolean AS $$
+    SELECT CASE WHEN $1.currency = $2.currency
+                THEN $1.amount > $2.amount
+                ELSE currency_mismatch($1.currency, $2.currency, NULL::boolean)
+           END;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION currency_amount_gte(currency_amount, currency_amount)
+RETURNS boolean AS $$
+    SELECT CASE WHEN $1.currency = $2.currency
+                THEN $1.amount >= $2.amount
+                ELSE currency_mismatch($1.currency, $2.currency, NULL::boolean)
+           END;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION currency_amount_lt(currency_amount, currency_amount)
+RETURNS boolean AS $$
+    SELECT CASE WHEN $1.currency = $2.currency
+                THEN $1.amount < $2.amount
+                ELSE currency_mismatch($1.currency, $2.currency, NULL::boolean)
+           END;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION currency_amount_lte(currency_amount, currency_amount)
+RETURNS boolean AS $$
+    SELECT CASE WHEN $1.currency = $2.currency
+                THEN $1.amount <= $2.amount
+                ELSE currency_mismatch($1.currency, $2.currency, NULL::boolean)
+           END;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION currency_amount_eq_numeric(currency_amount, numeric)
+RETURNS boolean AS $$
+    SELECT $1.amount = $2;
+$$ LANGUAGE sql IMMUTABLE STRICT;
+
+CREATE OR REPLACE FUNCTION currency_amount_ne_numeric(currency_amount, numeric)
+RETURNS boolean AS $$
+    SELECT $1.amount <> $2;
+$$ LANGUAGE sql IMMUTABLE STRICT;
+
+CREATE OR REPLACE FUNCTION currency_amount_gt_numeric(currency_amount, numeric)
+RETURNS boolean AS $$
+    SELECT $1.amount > $2;
+$$ LANGUAGE sql IMMUTABLE STRICT;
+
+CREATE OR REPLACE FUNCTION currency_amount_gte_numeric(currency_amount, numeric)
+RETURNS boolean AS $$
+    SELECT $1.amount >= $2;
+$$ LANGUAGE sql IMMUTABLE STRICT;
+
+CREATE OR REPLACE FUNCTION currency_amount_lt_numeric(currency_amount, numeric)
+RETURNS boolean AS $$
+    SELECT $1.amount < $2;
+$$ LANGUAGE sql IMMUTABLE STRICT;
+
+CREATE OR REPLACE FUNCTION currency_amount_lte_numeric(currency_amount, numeric)
+RETURNS boolean AS $$
+    SELECT $1.amount <= $2;
+$$ LANGUAGE sql IMMUTABLE STRICT;
+
+-- The transition function of an aggregate must be strict for the first non-null
+-- input to become the initial state, so it can't be `currency_amount_add`.
+CREATE FUNCTION currency_amount_sum_sfunc(currency_amount, currency_amount)
+RETURNS currency_amount AS $$
+    BEGIN
+        IF ($1.currency <> $2.currency) THEN
+            RAISE 'currency mistmatch: % != %', $1.currency, $2.currency;
+        END IF;
+        RETURN ($1.amount + $2.amount, $1.currency);
+    END;
+$$ LANGUAGE plpgsql IMMUTABLE STRICT;
+
+DROP AGGREGATE sum(currency_amount);
+CREATE AGGREGATE sum(currency_amount) (
+    sfunc = currency_amount_sum_sfunc,
+    stype = currency_amount
+);
+
+-- The rate lookup can't be inlined into the queries that call `convert()`,
+-- since it reads a table, so it's a PL/pgSQL function: its query plans are
+-- cached for the whole session, which makes it cheaper to call for each row
+-- than a `LANGUAGE sql` function. `convert()` itself is inlined, so converting
+-- an amount into its own currency doesn't involve any function call.
+CREATE FUNCTION get_exchange_rate(currency, currency) RETURNS numeric AS $$
+    DECLARE
+        rate numeric;
+    BEGIN
+        IF ($1 = 'EUR' OR $2 = 'EUR') THEN
+            rate := (
+                SELECT r.rate
+                  FROM currency_exchange_rates r
+                 WHERE r.source_currency = $1
+                   AND r.target_currency = $2
+            );
+        ELSE
+            rate := (
+                SELECT r1.rate * r2.rate
+                  FROM currency_exchange_rates r1
+                     , currency_exchange_rates r2
+                 WHERE r1.source_currency = $1
+                   AND r1.target_currency = 'EUR'
+                   AND r2.source_currency = 'EUR'
+                   AND r2.target_currency = $2
+            );
+        END IF;
+        IF (rate IS NULL) THEN
+            RAISE 'missing exchange rate %->%', $1, $2;
+        END IF;
+        RETURN rate;
+    END;
+$$ LANGUAGE plpgsql STABLE STRICT;
+
+CREATE OR REPLACE FUNCTION convert(currency_amount, currency, boolean) RETURNS currency_amount AS $$
+    SELECT CASE
+        WHEN $1.currency IS NULL OR $2 IS NULL OR $3 IS NULL THEN NULL
+        WHEN $1.currency = $2 THEN $1
+        WHEN $3 THEN round(($1.amount * get_exchange_rate($1.currency, $2), $2)::currency_amount)
+        ELSE ($1.amount * get_exchange_rate($1.currency, $2), $2)::currency_amount
+    END;
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION convert(currency_amount, currency) RETURNS currency_amount AS $$
+    SELECT convert($1, $2, true);
+$$ LANGUAGE sql STABLE;
+
+-- per-recipient stats, used by the `/%username/charts.json` endpoint
+CREATE TABLE payday_recipient_stats
+( payday        int               NOT NULL REFERENCES paydays
+, recipient     bigint            NOT NULL REFERENCES participants
+, npatrons      int               NOT NULL
+, receipts      currency_basket   NOT NULL
+, PRIMARY KEY (recipient, payday)
+);
+
+INSERT INTO payday_recipient_stats
+            (payday, recipient, npatrons, receipts)
+     SELECT p.id, t.recipient, count(DISTINCT t.tipper), basket_sum(t.amount)
+       FROM ( SELECT p.id, p.ts_end
+                   , coalesce(
+                         lag(p.ts_end) OVER (ORDER BY p.ts_end),
+                         '1970-01-01T00:00:00+00'::timestamptz
+                     ) AS previous_ts_end
+                FROM paydays p
+               WHERE p.stage IS NULL
+            ) p
+       JOIN ( SELECT t.timestamp, t.tippee AS recipient, t.tipper, t.amount
+                FROM transfers t
+                JOIN participants tippee ON tippee.id = t.tippee
+               WHERE t.status = 'succeeded'
+                 AND t.context IN ('tip', 'take', 'partial-take')
+                 AND tippee.kind <> 'group'
+               UNION ALL
+              SELECT t.timestamp, t.team AS recipient, t.tipper, t.amount
+                FROM transfers t
+               WHERE t.status = 'succeeded'
+                 AND t.context IN ('tip', 'take', 'partial-take')
+                 AND t.team IS NOT NULL
+            ) t ON t.timestamp >= p.previous_ts_end AND t.timestamp < p.ts_end
+   GROUP BY p.id, t.recipient;
+
+-- Inform the web processes that they should drop the sessions and participants
+-- they have cached, see `liberapay/security/session_cache.py`
+CREATE FUNCTION notify_session_cache() RETURNS trigger AS $$
+    DECLARE
+        payload text;
+    BEGIN
+        SELECT (CASE WHEN count(DISTINCT participant) > 500 THEN '*'
+                     ELSE string_agg(DISTINCT participant::text, ',') END)
+          INTO payload
+          FROM changed_rows;
+        IF (payload IS NOT NULL) THEN
+            PERFORM pg_notify('session_cache', payload);
+        END IF;
+        RETURN NULL;
+    END;
+$$ LANGUAGE plpgsql;
+
+-- The cached amounts (`giving`, `receiving`, etc) are recomputed in bulk
+-- periodically, those changes are ignored when they affect more than 500 rows,
+-- instead of dropping all the cached sessions.
+CREATE FUNCTION notify_session_cache_of_participants() RETURNS trigger AS $$
+    DECLARE
+        cached_amounts text[] := ARRAY[
+            'giving', 'receiving', 'taking', 'npatrons', 'nteampatrons',
+            'leftover', 'giving_eur', 'receiving_eur'
+        ];
+        payload text;
+    BEGIN
+        WITH changes AS (
+                 SELECT n.id
+                      , ( (to_jsonb(n) - cached_amounts) IS DISTINCT FROM
+                          (to_jsonb(o) - cached_amounts)
+                        ) AS other_columns_changed
+                   FROM new_rows n
+                   JOIN old_rows o ON o.id = n.id
+                  WHERE to_jsonb(n) IS DISTINCT FROM to_jsonb(o)
+             )
+           , ids AS (
+                 SELECT c.id
+                   FROM changes c
+                  WHERE c.other_columns_changed
+                     OR (SELECT count(*) FROM changes c2 WHERE NOT c2.other_columns_changed) <= 500
+             )
+        SELECT (CASE WHEN count(*) > 500 THEN '*' ELSE string_agg(id::text, ',') END)
+          INTO payload
+          FROM ids;
+        IF (payload IS NOT NULL) THEN
+            PERFORM pg_notify('session_cache', payload);
+        END IF;
+        RETURN NULL;
+    END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notify_session_cache
+    AFTER UPDATE ON participants
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_session_cache_of_participants();
+
+CREATE TRIGGER notify_session_cache_on_update
+    AFTER UPDATE ON user_secrets
+    REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_session_cache();
+
+CREATE TRIGGER notify_session_cache_on_delete
+    AFTER DELETE ON user_secrets
+    REFERENCING OLD TABLE AS changed_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE notify_session_cache();
+
+CREATE OR REPLACE FUNCTION add_rate_limit_hits(key text, cap int, period float, hits int) RETURNS int AS $$
+    INSERT INTO rate_limiting AS r
+                (key, counter, ts)
+         VALUES (key, least(hits, cap), current_timestamp)
+    ON CONFLICT (key) DO UPDATE
+            SET counter = least(r.counter - least(compute_leak(cap, period, r.ts), r.counter) + hits, cap)
+              , ts = current_timestamp
+      RETURNING counter;
+$$ LANGUAGE sql;
+
+ALTER TABLE tips ADD COLUMN is_current boolean NOT NULL DEFAULT false;
+UPDATE tips
+   SET is_current = true
+ WHERE id IN (
+           SELECT DISTINCT ON (tipper, tippee) id
+             FROM tips
+         ORDER BY tipper, tippee, mtime DESC, id DESC
+       );
+CREATE UNIQUE INDEX tips_current_idx ON tips (tipper, tippee) WHERE is_current;
+CREATE INDEX tips_current_tippee_idx ON tips (tippee) WHERE is_current;
+CREATE FUNCTION update_current_tip() RETURNS trigger AS $$
+    BEGIN
+        IF (TG_OP = 'DELETE') THEN
+            IF (OLD.is_current) THEN
+                UPDATE tips
+                   SET is_current = true
+                 WHERE id = (
+                           SELECT t.id
+                             FROM tips t
+                            WHERE t.tipper = OLD.tipper
+                              AND t.tippee = OLD.tippee
+                         ORDER BY t.mtime DESC, t.id DESC
+                            LIMIT 1
+                       );
+            END IF;
+            RETURN NULL;
+        END IF;
+        PERFORM pg_advisory_xact_lock(hashtextextended('tips:' || NEW.tipper || ':' || NEW.tippee, 0));
+        IF (EXISTS (
+            SELECT 1
+              FROM tips t
+             WHERE t.tipper = NEW.tipper
+               AND t.tippee = NEW.tippee
+               AND t.is_current
+               AND t.mtime > NEW.mtime
+        )) THEN
+            NEW.is_current := false;
+        ELSE
+            UPDATE tips
+               SET is_current = false
+             WHERE tipper = NEW.tipper
+               AND tippee = NEW.tippee
+               AND is_current;
+            NEW.is_current := true;
+        END IF;
+        RETURN NEW;
+    END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER update_current_tip BEFORE INSERT ON tips
+    FOR EACH ROW EXECUTE PROCEDURE update_current_tip();
+CREATE TRIGGER update_current_tip_on_delete AFTER DELETE ON tips
+    FOR EACH ROW EXECUTE PROCEDURE update_current_tip();
+CREATE OR REPLACE VIEW current_tips AS
+    SELECT *
+      FROM tips
+     WHERE is_current;
+ALTER TABLE takes ADD COLUMN is_current boolean NOT NULL DEFAULT false;
+UPDATE takes
+   SET is_current = true
+ WHERE id IN (
+           SELECT DISTINCT ON (team, member) id
+             FROM takes
+         ORDER BY team, member, mtime DESC, id DESC
+       );
+CREATE UNIQUE INDEX takes_current_idx ON takes (team, member) WHERE is_current;
+CREATE INDEX takes_current_member_idx ON takes (member) WHERE is_current;
+CREATE FUNCTION update_current_take() RETURNS trigger AS $$
+    BEGIN
+        IF (TG_OP = 'DELETE') THEN
+            IF (OLD.is_current) THEN
+                UPDATE takes
+                   SET is_current = true
+                 WHERE id = (
+                           SELECT t.id
+                             FROM takes t
+                            WHERE t.team = OLD.team
+                              AND t.member = OLD.member
+                         ORDER BY t.mtime DESC, t.id DESC
+                            LIMIT 1
+                       );
+            END IF;
+            RETURN NULL;
+        END IF;
+        PERFORM pg_advisory_xact_lock(hashtextextended('takes:' || NEW.team || ':' || NEW.member, 0));
+        IF (EXISTS (
+            SELECT 1
+              FROM takes t
+             WHERE t.team = NEW.team
+               AND t.member = NEW.member
+               AND t.is_current
+               AND t.mtime > NEW.mtime
+        )) THEN
+            NEW.is_current := false;
+        ELSE
+            UPDATE takes
+               SET is_current = false
+             WHERE team = NEW.team
+               AND member = NEW.member
+               AND is_current;
+            NEW.is_current := true;
+        END IF;
+        RETURN NEW;
+    END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER update_current_take BEFORE INSERT ON takes
+    FOR EACH ROW EXECUTE PROCEDURE update_current_take();
+CREATE TRIGGER update_current_take_on_delete AFTER DELETE ON takes
+    FOR EACH ROW EXECUTE PROCEDURE update_current_take();
+
+CREATE OR REPLACE VIEW current_takes AS
+    SELECT *
+      FROM takes
+     WHERE is_current
+       AND amount IS NOT NULL;
+
+CREATE INDEX participants_explore_join_time_idx ON participants (join_time, id)
+    WHERE status = 'active' AND hide_from_lists = 0;
+CREATE INDEX repositories_stars_count_idx ON repositories (stars_count, id)
+    WHERE show_on_profile AND stars_count > 1;
+
+ALTER TABLE participants
+    ADD COLUMN giving_eur numeric NOT NULL DEFAULT 0,
+    ADD COLUMN receiving_eur numeric NOT NULL DEFAULT 0;
+UPDATE participants
+   SET giving_eur = (convert(giving, 'EUR')).amount
+     , receiving_eur = (convert(receiving, 'EUR')).amount;
+CREATE FUNCTION update_eur_amounts() RETURNS trigger AS $$
+    BEGIN
+        NEW.giving_eur = (convert(NEW.giving, 'EUR')).amount;
+        NEW.receiving_eur = (convert(NEW.receiving, 'EUR')).amount;
+        RETURN NEW;
+    END;
+$$ LANGUAGE plpgsql;
+CREATE TRIGGER update_eur_amounts
+    BEFORE INSERT OR UPDATE OF giving, receiving ON participants
+    FOR EACH ROW EXECUTE PROCEDURE update_eur_amounts();
+CREATE INDEX participants_explore_receiving_idx
+    ON participants (kind, receiving_eur, join_time, id)
+ WHERE status = 'active' AND hide_from_lists = 0;
+CREATE INDEX participants_recipients_receiving_idx
+    ON participants (receiving_eur DESC, join_time, id)
+ WHERE status = 'active' AND hide_from_lists = 0;
+CREATE OR REPLACE VIEW sponsors AS
+    SELECT username, giving, avatar_url, giving_eur
+      FROM participants p
+     WHERE status = 'active'
+       AND kind = 'organization'
+       AND giving > receiving
+       AND giving >= 10
+       AND hide_from_lists = 0
+       AND profile_noindex = 0
+    ;
+
+ALTER TABLE cron_jobs ADD COLUMN next_run_time timestamptz;
+
+INSERT INTO app_conf (key, value) VALUES
+    ('email_send_rate', '1.0'::jsonb),
+    ('email_sending_threads', '2'::jsonb)
+    ON CONFLICT (key) DO NOTHING;
+
+ALTER TABLE notifications ADD COLUMN email_claimed_at timestamptz;
+CREATE INDEX sending_emails_idx ON notifications (id ASC)
+    WHERE (email AND email_status = 'sending');
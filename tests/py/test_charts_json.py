@@ -139,3 +139,31 @@ class TestChartsJson(Harness):
 
         r = self.client.GxT('/carl/charts.json', auth_as=self.alice)
         assert r.code == 403
+
+    def test_etag(self):
+        self.run_payday()
+        r = self.client.GET('/carl/charts.json')
+        etag = r.headers[b'ETag']
+        r = self.client.GET('/carl/charts.json', HTTP_IF_NONE_MATCH=etag, raise_immediately=False)
+        assert r.code == 304
+        r = self.client.GET('/about/charts.json')
+        about_etag = r.headers[b'ETag']
+        r = self.client.GET('/about/charts.json', HTTP_IF_NONE_MATCH=about_etag, raise_immediately=False)
+        assert r.code == 304
+
+        # A new payday changes the ETags
+        self.run_payday()
+        r = self.client.GET('/carl/charts.json', HTTP_IF_NONE_MATCH=etag)
+        assert r.code == 200
+        assert r.headers[b'ETag'] != etag
+        assert len(json.loads(r.text)) == 2
+
+    def test_recipient_stats_are_recomputed(self):
+        payday = self.run_payday()
+        self.db.run("DELETE FROM payday_recipient_stats")
+        Payday.recompute_stats()
+        expected = [
+            {"date": date(payday), "npatrons": 2, "receipts": {"amount": "3.00", "currency": "EUR"}},
+        ]
+        actual = json.loads(self.client.GET('/carl/charts.json').text)
+        assert actual == expected
@@ -5,7 +5,7 @@ from unittest.mock import patch
 from pando.utils import utcnow
 
 from liberapay.constants import PAYIN_AMOUNTS
-from liberapay.cron import Daily, Weekly
+from liberapay.cron import CronWorker, Daily, Weekly
 from liberapay.i18n.currencies import fetch_currency_exchange_rates
 from liberapay.models.participant import (
     generate_profile_description_missing_notifications,
@@ -110,6 +110,63 @@ class TestCronJobs(EmailHarness):
             finally:
                 job.period = period
 
+    def test_cron_worker(self):
+        job = next(
+            job for job in self.website.cron.jobs
+            if job.func.__name__ == 'dequeue_emails'
+        )
+        worker = CronWorker(self.website, [job])
+        with patch.object(job, 'func', autospec=True) as mock_func:
+            mock_func.return_value = None
+            # The job has never been run, so it's due
+            assert worker.enqueue_due_jobs() == ['dequeue_emails']
+            assert worker.enqueue_due_jobs() == []
+            # The job isn't started when its concurrency limit has been reached
+            with self.db.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.run("SELECT pg_advisory_lock(%s, 0)", (job.lock_key,))
+                assert worker.run_next_job() is None
+                cursor.run("SELECT pg_advisory_unlock(%s, 0)", (job.lock_key,))
+            assert mock_func.call_count == 0
+            # Now the job can be run
+            assert worker.run_next_job() is job
+            assert mock_func.call_count == 1
+            assert worker.run_next_job() is None
+            row = self.db.one("SELECT * FROM cron_jobs WHERE name = 'dequeue_emails'")
+            assert row.next_run_time is None
+            assert row.last_success_time >= row.last_start_time
+            # The job isn't due again until its period has elapsed
+            assert worker.enqueue_due_jobs() == []
+            # Errors are recorded
+            self.db.run("UPDATE cron_jobs SET last_start_time = last_start_time - interval '1 day'")
+            mock_func.side_effect = ValueError("fake error")
+            assert worker.enqueue_due_jobs() == ['dequeue_emails']
+            with patch.object(self.website, 'tell_sentry') as tell_sentry:
+                assert worker.run_next_job() is job
+            assert tell_sentry.call_count == 1
+            last_error = self.db.one("SELECT last_error FROM cron_jobs WHERE name = 'dequeue_emails'")
+            assert 'fake error' in last_error
+
+    def test_cron_worker_retries_failed_irregular_jobs(self):
+        job = next(
+            job for job in self.website.cron.jobs
+            if job.func.__name__ == 'rotate_stored_data'
+        )
+        worker = CronWorker(self.website, [job])
+        with patch.object(job, 'func', autospec=True) as mock_func:
+            mock_func.side_effect = ValueError("fake error")
+            worker.enqueue(['rotate_stored_data'])
+            with patch.object(self.website, 'tell_sentry') as tell_sentry:
+                assert worker.run_next_job() is job
+            assert tell_sentry.call_count == 1
+            # The job should be retried in a minute
+            delay = self.db.one("""
+                SELECT extract(epoch FROM next_run_time - current_timestamp)
+                  FROM cron_jobs
+                 WHERE name = 'rotate_stored_data'
+            """)
+            assert 50 < delay <= 60
+
     def test_fetch_currency_exchange_rates(self):
         assert PAYIN_AMOUNTS['paypal']['min_acceptable']['HUF']
         assert 'HUF' in PAYIN_AMOUNTS['paypal']['min_acceptable']
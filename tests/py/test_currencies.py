@@ -1,9 +1,15 @@
 from decimal import Decimal as D
+from unittest.mock import patch
 
+from psycopg2 import InternalError
 import pytest
 
 from liberapay.constants import CURRENCIES, DONATION_LIMITS, STANDARD_TIPS
-from liberapay.i18n.currencies import Money, MoneyBasket
+from liberapay.exceptions import InvalidNumber
+from liberapay.i18n.currencies import (
+    CurrencyMismatch, Money, MoneyBasket, refresh_currency_exchange_rates,
+    set_currency_exchange_rates, update_eur_amounts,
+)
 from liberapay.payin.stripe import int_to_Money, Money_to_int
 from liberapay.testing import EUR, JPY, USD, Harness
 
@@ -33,6 +39,51 @@ class TestCurrencies(Harness):
         actual = original.convert(expected.currency)
         assert expected == actual
 
+    def test_refresh_currency_exchange_rates(self):
+        website = self.client.website
+        rates = website.currency_exchange_rates
+        assert rates[('CHF', 'GBP')] == rates[('CHF', 'EUR')] * rates[('EUR', 'GBP')]
+        refresh_currency_exchange_rates()
+        assert website.currency_exchange_rates is rates
+        try:
+            with self.allow_changes_to('currency_exchange_rates'), self.db.get_cursor() as cursor:
+                cursor.run("""
+                    UPDATE currency_exchange_rates
+                       SET rate = rate * 2
+                     WHERE source_currency = 'EUR'
+                       AND target_currency = 'USD'
+                """)
+                refresh_currency_exchange_rates(cursor)
+                assert EUR('1.00').convert('USD') == USD('2.40')
+                assert website.currency_exchange_rates.version > rates.version
+                cursor.connection.rollback()
+        finally:
+            # This also clears the amounts converted with the modified rates.
+            set_currency_exchange_rates(rates)
+        assert EUR('1.00').convert('USD') == USD('1.20')
+
+    def test_update_eur_amounts(self):
+        alice = self.make_participant('alice', main_currency='USD')
+        self.db.run(
+            "UPDATE participants SET giving = %s WHERE id = %s", (USD('12.00'), alice.id)
+        )
+        eur_amounts = lambda p: self.db.one(
+            "SELECT giving_eur, receiving_eur FROM participants WHERE id = %s", (p.id,)
+        )
+        assert eur_amounts(alice) == (D('10.00'), 0)
+        with self.allow_changes_to('currency_exchange_rates'), self.db.get_cursor() as cursor:
+            cursor.run("""
+                UPDATE currency_exchange_rates
+                   SET rate = rate * 2
+                 WHERE source_currency = 'USD'
+                   AND target_currency = 'EUR'
+            """)
+            update_eur_amounts(cursor)
+            giving_eur = cursor.one("SELECT giving_eur FROM participants WHERE id = %s", (alice.id,))
+            assert giving_eur == D('20.00')
+            cursor.connection.rollback()
+        assert eur_amounts(alice) == (D('10.00'), 0)
+
     def test_minimums(self):
         assert Money.MINIMUMS['EUR'].amount == D('0.01')
         assert Money.MINIMUMS['USD'].amount == D('0.01')
@@ -68,6 +119,49 @@ class TestCurrencies(Harness):
         b2 = MoneyBasket(EUR=1, USD=1)
         assert not (b >= b2)
 
+    def test_MoneyBasket_iadd_and_isub(self):
+        b = MoneyBasket(EUR('1.00'))
+        assert b.iadd(USD('2.00')) is b
+        assert b.iadd(MoneyBasket(EUR('0.50'), JPY('100'))) is b
+        assert b == MoneyBasket(EUR('1.50'), USD('2.00'), JPY('100'))
+        assert b.isub(USD('2.00')).isub(0) is b
+        assert b == MoneyBasket(EUR('1.50'), JPY('100'))
+        assert b.currencies_present == ['EUR', 'JPY']
+        b2 = b + EUR('1.00')
+        assert b2 is not b
+        assert b == MoneyBasket(EUR('1.50'), JPY('100'))
+        with pytest.raises(TypeError):
+            b.iadd(1)
+
+    def test_Money_sum(self):
+        assert Money.sum([], 'EUR') == EUR('0.00')
+        assert Money.sum((EUR('0.01') for i in range(10)), 'EUR') == EUR('0.10')
+        with pytest.raises(CurrencyMismatch):
+            Money.sum([EUR('1.00'), USD('1.00')], 'EUR')
+        with pytest.raises(InvalidNumber):
+            Money.sum([EUR('999999999999.99'), EUR('0.01')], 'EUR')
+
+    def test_arithmetic_overflow(self):
+        with pytest.raises(InvalidNumber):
+            EUR('999999999999.99') + EUR('0.01')
+        with pytest.raises(InvalidNumber):
+            EUR('0.01') - EUR('-999999999999.99')
+        with pytest.raises(InvalidNumber):
+            EUR('999999999999.99') * 2
+        assert EUR('1.00') + Money('inf', 'EUR') == Money('inf', 'EUR')
+
+    def test_arithmetic_does_not_revalidate_amounts(self):
+        a, b = EUR('1.00'), EUR('0.25')
+        basket = MoneyBasket()
+        with patch.object(Money, '__init__', autospec=True, side_effect=Money.__init__) as init:
+            for i in range(1000):
+                c = (a + b - b) * 2
+                basket.iadd(c.round_down())
+            total = Money.sum(basket, 'EUR')
+            list(basket)
+        assert init.call_count == 0
+        assert total == EUR('2000.00')
+
     def test_donation_limits(self):
         for currency in CURRENCIES:
             currency_minimum = Money.MINIMUMS[currency]
@@ -185,6 +279,41 @@ class TestCurrenciesInDB(Harness):
         actual = self.db.one("SELECT sum(x, 'EUR') FROM unnest(%s) x", (amounts + [None],))
         assert expected == actual, (expected.__dict__, actual.__dict__)
 
+    def test_arithmetic_operators(self):
+        assert self.db.one("SELECT %s + %s", (EUR('1.00'), EUR('0.50'))) == EUR('1.50')
+        assert self.db.one("SELECT %s - %s", (EUR('1.00'), EUR('0.50'))) == EUR('0.50')
+        assert self.db.one("SELECT -%s::currency_amount", (JPY('3'),)) == JPY('-3')
+        assert self.db.one("SELECT %s * 2", (USD('0.25'),)) == USD('0.50')
+        assert self.db.one("SELECT 2 * %s", (USD('0.25'),)) == USD('0.50')
+        assert self.db.one("SELECT %s / %s", (EUR('1.00'), EUR('0.50'))) == 2
+        assert self.db.one("SELECT %s > %s", (EUR('1.00'), EUR('0.50'))) is True
+        assert self.db.one("SELECT %s <= %s", (EUR('1.00'), EUR('0.50'))) is False
+        assert self.db.one("SELECT %s = %s", (EUR('1.00'), USD('1.00'))) is False
+        assert self.db.one("SELECT %s <> %s", (EUR('1.00'), USD('1.00'))) is True
+        # Constant amounts
+        assert self.db.one("""
+            SELECT ('1.00','USD')::currency_amount + ('0.20','USD')::currency_amount
+        """) == USD('1.20')
+        assert self.db.one("""
+            SELECT convert(('1.00','EUR')::currency_amount, 'USD')
+        """) == USD('1.20')
+
+    def test_currency_mismatch(self):
+        for op in ('+', '-', '/', '>', '>=', '<', '<='):
+            with pytest.raises(InternalError, match='currency mistmatch: EUR != USD'):
+                self.db.one(f"SELECT %s {op} %s", (EUR('1.00'), USD('1.00')))
+
+    def test_operators_return_null_when_an_argument_is_null(self):
+        for op in ('+', '-', '/', '=', '<>', '>', '>=', '<', '<='):
+            assert self.db.one(
+                f"SELECT %s {op} NULL::currency_amount", (EUR('1.00'),)
+            ) is None
+        assert self.db.one("SELECT NULL::currency_amount * 2") is None
+        assert self.db.one("SELECT -(NULL::currency_amount) IS NULL")
+        assert self.db.one("SELECT round(NULL::currency_amount) IS NULL")
+        assert self.db.one("SELECT convert(NULL::currency_amount, 'EUR') IS NULL")
+        assert self.db.one("SELECT convert(%s, NULL) IS NULL", (EUR('1.00'),))
+
     @pytest.mark.xfail
     def test_sorting(self):
         amounts = [JPY('130'), EUR('99.58'), Money('79', 'KRW'), USD('35.52')]
@@ -1,5 +1,6 @@
 from datetime import timedelta
 import json
+from time import monotonic
 from unittest.mock import MagicMock, patch
 
 from liberapay.exceptions import (
@@ -9,13 +10,14 @@ from liberapay.exceptions import (
     InvalidEmailDomain, NonEmailDomain,
     TooManyEmailAddresses, TooManyEmailVerifications,
 )
-from liberapay.models.participant import Participant
+from liberapay.models.participant import EMAIL_BASES, Participant
 from liberapay.security.authentication import ANON, SESSION
 from liberapay.security.csrf import CSRF_TOKEN
 from liberapay.testing import Harness, postgres_readonly
 from liberapay.testing.emails import EmailHarness
 from liberapay.utils.emails import (
-    EmailVerificationResult, check_email_blacklist, _handle_ses_notification,
+    EmailVerificationResult, MailerPool, check_email_blacklist,
+    _handle_ses_notification,
 )
 
 
@@ -554,6 +556,41 @@ class TestEmail(EmailHarness):
         assert self.mailer.call_count == 0
         assert self.db.one("SELECT email_status FROM notifications") == 'skipped'
 
+    def test_emails_are_not_left_in_sending_state(self):
+        larry = self.make_participant('larry', email='larry@example.com')
+        self.queue_email(larry, 'team_invite', team='team', team_url='fake_url', inviter='bob')
+        self.queue_email(larry, 'team_invite', team='team2', team_url='fake_url2', inviter='bob')
+
+        # An unexpected error puts the claimed messages back in the queue
+        with patch('liberapay.models.participant.deserialize', side_effect=KeyError):
+            with self.assertRaises(KeyError):
+                Participant.dequeue_emails()
+        assert self.mailer.call_count == 0
+        statuses = self.db.all("SELECT email_status FROM notifications ORDER BY id")
+        assert statuses == ['queued', 'queued']
+
+        # Messages abandoned by a crashed process are requeued after an hour
+        self.db.run("""
+            UPDATE notifications
+               SET email_status = 'sending'
+                 , email_claimed_at = current_timestamp - interval '61 minutes'
+        """)
+        Participant.dequeue_emails()
+        assert self.mailer.call_count == 2
+        statuses = self.db.all("SELECT email_status FROM notifications ORDER BY id")
+        assert statuses == ['sent', 'sent']
+
+        # Recent claims are left alone
+        self.queue_email(larry, 'team_invite', team='team3', team_url='fake_url3', inviter='bob')
+        self.db.run("""
+            UPDATE notifications
+               SET email_status = 'sending'
+                 , email_claimed_at = current_timestamp
+             WHERE email_status = 'queued'
+        """)
+        Participant.dequeue_emails()
+        assert self.mailer.call_count == 2
+
     def test_emails_are_not_sent_went_database_is_read_only(self):
         larry = self.make_participant('larry')
         self.queue_email(larry, 'team_invite', team='team', team_url='fake_url', inviter='bob')
@@ -589,10 +626,11 @@ class TestEmail(EmailHarness):
         email_row = alice.get_email('alice@liberapay.com')
         translation = self.website.locales['fr'].catalog._messages.pop("Greetings,")
         try:
-            alice.send_email(
-                'login_link', email_row,
-                username='alice', link_validity=timedelta(hours=6)
-            )
+            with patch.dict(EMAIL_BASES, clear=True):
+                alice.send_email(
+                    'login_link', email_row,
+                    username='alice', link_validity=timedelta(hours=6)
+                )
         finally:
             self.website.locales['fr'].catalog._messages["Greetings,"] = translation
         emails = self.get_emails()
@@ -700,3 +738,39 @@ class TestEmail2(Harness):
         fred.notify('team_invite', team='team', team_url='fake_url', inviter='bob')
         Participant.dequeue_emails()
         assert self.db.one("SELECT email_status FROM notifications") == 'sent'
+
+    def test_mailer_pool(self):
+        mailers = []
+        def make_mailer():
+            mailers.append(MagicMock())
+            return mailers[-1]
+        pool = MailerPool(make_mailer, 2, send_rate=100)
+        start_time = monotonic()
+        for i in range(4):
+            pool.send(to=['fred@example.org'])
+        assert monotonic() - start_time >= 0.03
+        # The connection is reused
+        assert len(mailers) == 1
+        assert mailers[0].open.call_count == 4
+        assert mailers[0].send.call_count == 4
+        assert mailers[0].close.call_count == 0
+        # The connection is closed after an error
+        mailers[0].send.side_effect = OSError
+        with self.assertRaises(OSError):
+            pool.send(to=['fred@example.org'])
+        assert mailers[0].close.call_count == 1
+
+    def test_email_bases_are_prerendered(self):
+        fred = self.make_participant('fred', email='fred@example.org')
+        fred.notify('team_invite', team='team', team_url='fake_url', inviter='bob')
+        fred.notify('team_invite', team='team2', team_url='fake_url2', inviter='bob')
+        with patch.dict(EMAIL_BASES, clear=True):
+            with patch.object(
+                self.website.emails['base']['text/html'], 'render',
+                side_effect=self.website.emails['base']['text/html'].render,
+            ) as render:
+                Participant.dequeue_emails()
+            assert render.call_count == 1
+            assert len(EMAIL_BASES) == 2
+        emails = self.db.all("SELECT email_status FROM notifications")
+        assert emails == ['sent', 'sent']
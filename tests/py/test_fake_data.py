@@ -20,3 +20,14 @@ class TestFakeData(Harness):
         participants = self.db.all("SELECT * FROM participants")
         assert len(tips) == num_tips
         assert len(participants) == num_participants + num_teams + num_communities
+
+    def test_fake_data_bulk(self):
+        fake_data.populate_db_bulk(self.client.website, scale=0.01)
+        sizes = fake_data.BULK_SIZES
+        assert self.db.one("SELECT count(*) FROM tips") == sizes['tips'] // 100
+        assert self.db.one("SELECT count(*) FROM participants") == (
+            sizes['participants'] // 100 + 1 + 1
+        )
+        assert self.db.one("SELECT count(*) FROM paydays") == sizes['paydays']
+        assert self.db.one("SELECT count(*) FROM transfers") > 0
+        self.db.self_check()
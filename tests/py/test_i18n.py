@@ -1,6 +1,10 @@
+import os
+from tempfile import TemporaryDirectory
+
 from liberapay.constants import CURRENCIES, PAYPAL_CURRENCIES
 from liberapay.exceptions import AmbiguousNumber, InvalidNumber
 from liberapay.i18n.base import CURRENCIES_MAP, DEFAULT_CURRENCY, LOCALE_EN, Money
+from liberapay.i18n.catalogs import load_catalogs
 from liberapay.security.authentication import ANON
 from liberapay.testing import Harness
 
@@ -102,6 +106,40 @@ class Tests(Harness):
         )
         assert state['locale'] is self.website.locales['zh-hant-tw']
 
+    def test_precompiled_catalogs(self):
+        po = (
+            'msgid ""\nmsgstr ""\n'
+            '"Plural-Forms: nplurals=2; plural=n > 1;\\n"\n\n'
+            'msgid "Save"\nmsgstr "Enregistrer"\n\n'
+            '#, fuzzy\nmsgid "Cancel"\nmsgstr "Annuler"\n\n'
+            'msgid "Delete"\nmsgstr ""\n\n'
+            'msgid "{n} donor"\nmsgid_plural "{n} donors"\n'
+            'msgstr[0] "{n} donateur"\nmsgstr[1] "{n} donateurs"\n'
+        )
+        with TemporaryDirectory() as tmpdir:
+            with open(os.path.join(tmpdir, 'fr.po'), 'w') as f:
+                f.write(po)
+            cache_path = os.path.join(tmpdir, 'catalogs.pickle')
+            for i in range(2):
+                c = load_catalogs(tmpdir, cache_path)['fr']
+                assert os.path.exists(cache_path)
+                assert c['Save'].string == 'Enregistrer'
+                assert c['Cancel'].fuzzy
+                assert c['{n} donor'].string[c.plural_func(2)] == '{n} donateurs'
+                assert c.missing_translations == 0.25
+                assert c.fuzzy_translations == 0.25
+
+    def test_territorial_locales_are_loaded_lazily(self):
+        locales = self.website.locales
+        assert 'fr-be' in locales
+        locale_fr_be = locales.get('fr-be')
+        assert locale_fr_be.tag == 'fr-be'
+        assert locale_fr_be.catalog is locales['fr'].catalog
+        assert locales['fr-be'] is locale_fr_be
+        assert 'fr-be' not in locales.loaders
+        assert 'xx-yy' not in locales
+        assert locales.get('xx-yy') is None
+
     def test_american_english(self):
         state = self.client.GET('/', HTTP_ACCEPT_LANGUAGE=b'en-us', want='state')
         locale = state['locale']
@@ -1,10 +1,11 @@
-from liberapay.testing import Harness
+from liberapay.models.participant import Participant
+from liberapay.testing.emails import EmailHarness
 
 
-class TestNewsletters(Harness):
+class TestNewsletters(EmailHarness):
 
     def setUp(self):
-        Harness.setUp(self)
+        EmailHarness.setUp(self)
         self.alice = self.make_participant('alice')
         self.bob = self.make_participant('bob')
 
@@ -34,3 +35,34 @@ class TestNewsletters(Harness):
         subscribe_url = unsubscribe_url.replace('/unsubscribe', '/subscribe')
         r = self.client.POST(subscribe_url, json=True)
         assert r.code == 200
+
+    def test_send_newsletters(self):
+        carl = self.make_participant('carl', email='carl@example.org')
+        dana = self.make_participant('dana', email='dana@example.org')
+        subscription = carl.upsert_subscription(True, self.alice.id)
+        dana.upsert_subscription(True, self.alice.id)
+        dana.upsert_subscription(False, self.alice.id)
+        self.bob.upsert_subscription(True, self.alice.id)
+        newsletter_id = self.db.one("""
+            INSERT INTO newsletters (sender) VALUES (%s) RETURNING id
+        """, (self.alice.id,))
+        self.db.run("""
+            INSERT INTO newsletter_texts
+                        (newsletter, lang, subject, body, scheduled_for)
+                 VALUES (%s, 'en', 'News', 'Some *news*', current_timestamp)
+        """, (newsletter_id,))
+        Participant.send_newsletters()
+        # Only carl is subscribed and has an email address
+        assert self.db.one("SELECT sent_count FROM newsletter_texts") == 1
+        emails = self.get_emails()
+        assert len(emails) == 1
+        assert emails[0]['to'] == ['carl <carl@example.org>']
+        assert emails[0]['subject'] == 'News'
+        assert '<em>news</em>' in emails[0]['html']
+        unsubscribe_url = '/~{publisher}/news/unsubscribe?id={id}&amp;token={token}'.format(
+            **subscription._asdict()
+        )
+        assert unsubscribe_url in emails[0]['html']
+        # The newsletter isn't sent twice
+        Participant.send_newsletters()
+        assert not self.get_emails()
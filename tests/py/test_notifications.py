@@ -1,3 +1,4 @@
+from liberapay.models.participant import Participant
 from liberapay.testing import Harness
 from liberapay.utils.emails import jinja_env_html, SimplateLoader
 
@@ -10,6 +11,25 @@ class TestNotifications(Harness):
         alice.notify('1234', email=False)
         assert alice.pending_notifs == 2
 
+    def test_notify_many(self):
+        alice = self.make_participant('alice')
+        bob = self.make_participant('bob')
+        alice.notify('abcd', email=False, idem_key='1')
+        inserted = Participant.notify_many([
+            (alice, 'abcd', {}, '1'),  # duplicate
+            (alice, 'abcd', {}, '2'),
+            (alice, 'abcd', {}, '2'),  # duplicate
+            (bob, 'abcd', {'foo': 'bar'}),
+            (bob, '1234', {}),
+        ], email=False)
+        assert [n.participant for n in inserted] == [alice.id, bob.id, bob.id]
+        assert alice.pending_notifs == 2
+        assert bob.pending_notifs == 2
+        assert bob.refetch().pending_notifs == 2
+        # Notifications identical to ones sent the same day are skipped
+        inserted = Participant.notify_many([(bob, '1234', {})], email=False)
+        assert inserted == []
+
     def test_remove_and_restore_notification(self):
         alice = self.make_participant('alice')
         bob = self.make_participant('bob')
@@ -1,3 +1,4 @@
+import re
 from unittest.mock import patch
 
 from pando import json
@@ -105,6 +106,25 @@ class TestPages(Harness):
         response = self.client.POST('/sign-out.html', auth_as=alice, json=True)
         assert response.code == 200
 
+    def test_explore_individuals_keyset_pagination(self):
+        for i in range(20):
+            self.make_participant('user%02i' % i, receiving=EUR(i % 4 + 1))
+        expected = [
+            'user%02i' % i
+            for i in sorted(range(20), key=lambda i: (i % 4, i), reverse=True)
+        ]
+        seen, url = [], '/explore/individuals'
+        while url:
+            r = self.client.GET(url)
+            seen.extend(re.findall(r'href="/(user\d\d)/"', r.text))
+            next_link = re.search(r'<li class="next"><a href="([^"]+)"', r.text)
+            url = next_link and '/explore/individuals' + next_link.group(1).replace('&amp;', '&')
+        assert list(dict.fromkeys(seen)) == expected
+        prev_link = re.search(r'<li class="previous"><a href="([^"]+)"', r.text)
+        assert prev_link
+        r = self.client.GET('/explore/individuals' + prev_link.group(1).replace('&amp;', '&'))
+        assert list(dict.fromkeys(re.findall(r'href="/(user\d\d)/"', r.text))) == expected[:18]
+
     def test_giving_page(self):
         alice = self.make_participant('alice')
         bob = self.make_participant('bob')
@@ -446,6 +446,30 @@ class Tests(Harness):
         assert carl.receiving == EUR('5.00')
         assert carl.npatrons == 2
 
+    def test_current_tips_are_maintained(self):
+        alice = self.make_participant('alice')
+        bob = self.make_participant('bob')
+        tip1 = alice.set_tip_to(bob, EUR('1.00'))
+        tip2 = alice.set_tip_to(bob, EUR('2.00'))
+        current_tips = self.db.all("SELECT id FROM current_tips")
+        assert current_tips == [tip2.id]
+        # A tip inserted with an older `mtime` doesn't become the current one
+        self.db.run("""
+            INSERT INTO tips
+                      ( ctime, mtime, tipper, tippee, amount, period, periodic_amount
+                      , visibility )
+                 SELECT ctime, mtime - interval '1 day', tipper, tippee, amount, period
+                      , periodic_amount, visibility
+                   FROM tips
+                  WHERE id = %s
+        """, (tip1.id,))
+        current_tips = self.db.all("SELECT id FROM current_tips")
+        assert current_tips == [tip2.id]
+        # Deleting the current tip makes the previous one current again
+        self.db.run("DELETE FROM tips WHERE id = %s", (tip2.id,))
+        current_tips = self.db.all("SELECT id FROM current_tips")
+        assert current_tips == [tip1.id]
+
     def test_receiving_includes_taking(self):
         alice = self.make_participant('alice')
         alice_card = self.upsert_route(alice, 'stripe-card')
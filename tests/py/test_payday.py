@@ -222,6 +222,67 @@ class TestPayday(EmailHarness):
             p.update_giving()
         check()
 
+    def test_update_cached_amounts_incrementally(self):
+        team = self.make_participant('team', kind='group')
+        alice = self.make_participant('alice')
+        alice_card = self.upsert_route(alice, 'stripe-card')
+        bob = self.make_participant('bob')
+        team.set_take_for(bob, EUR('1.00'), team)
+        alice.set_tip_to(team, EUR('2.00'))
+        self.make_payin_and_transfer(alice_card, team, EUR('20.00'))
+        carl = self.make_participant('carl')
+        carl_card = self.upsert_route(carl, 'stripe-card')
+        carl.set_tip_to(self.janet, EUR('1.00'))
+        self.make_payin_and_transfer(carl_card, self.janet, EUR('10.00'))
+        Payday.update_cached_amounts()
+        assert self.db.one("SELECT count(*) FROM dirty_participants") == 0
+
+        # Nothing to do
+        Payday.update_cached_amounts_incrementally()
+
+        # Change a tip, and corrupt the cached amounts of an unrelated participant
+        self.db.run("UPDATE participants SET giving = (9,'EUR') WHERE id = %s", (carl.id,))
+        alice.set_tip_to(team, EUR('3.00'))
+        dirty = set(self.db.all("SELECT participant FROM dirty_participants"))
+        assert dirty == {alice.id, team.id}
+        Payday.update_cached_amounts_incrementally()
+        assert self.db.one("SELECT count(*) FROM dirty_participants") == 0
+        alice = alice.refetch()
+        assert alice.giving == EUR('3.00')
+        team = team.refetch()
+        assert team.receiving == EUR('3.00')
+        assert team.leftover == EUR('2.00')
+        bob = bob.refetch()
+        assert bob.taking == EUR('1.00')
+        assert bob.nteampatrons == 1
+        # The unrelated participant hasn't been touched
+        assert carl.refetch().giving == EUR('9.00')
+        # A full update fixes everything
+        Payday.update_cached_amounts()
+        assert carl.refetch().giving == EUR('1.00')
+
+        # Suspending a tippee changes the giving amounts of its tippers
+        self.db.run("UPDATE participants SET is_suspended = true WHERE id = %s", (self.janet.id,))
+        Payday.update_cached_amounts_incrementally()
+        assert carl.refetch().giving == EUR('0.00')
+        self.db.run("UPDATE participants SET is_suspended = false WHERE id = %s", (self.janet.id,))
+        Payday.update_cached_amounts_incrementally()
+        assert carl.refetch().giving == EUR('1.00')
+
+        # Deleted tips are taken into account
+        self.db.run("DELETE FROM tips WHERE tipper = %s", (carl.id,))
+        dirty = set(self.db.all("SELECT participant FROM dirty_participants"))
+        assert dirty == {carl.id, self.janet.id}
+        # … but not while a payday is in progress
+        Payday.start()
+        Payday.update_cached_amounts_incrementally()
+        assert self.db.one("SELECT count(*) FROM dirty_participants") == 2
+        assert carl.refetch().giving == EUR('1.00')
+        self.db.run("UPDATE paydays SET stage = NULL")
+        Payday.update_cached_amounts_incrementally()
+        assert self.db.one("SELECT count(*) FROM dirty_participants") == 0
+        assert carl.refetch().giving == EUR('0.00')
+
     def test_prepare(self):
         self.clear_tables()
         self.make_participant('carl')
@@ -1440,3 +1501,103 @@ class TestPaydayForTeams(EmailHarness):
             'member_3': None,
             'donor': None,
         }
+
+    def test_settle_in_memory_matches_sql(self):
+        team = self.make_participant('team', kind='group', accepted_currencies=None)
+        alice = self.make_participant('alice', main_currency='EUR', accepted_currencies=None)
+        team.set_take_for(alice, EUR('1.00'), team)
+        bob = self.make_participant('bob', main_currency='USD', accepted_currencies=None)
+        team.set_take_for(bob, EUR(-1), team)
+        self.add_payment_account(alice, 'stripe')
+        self.add_payment_account(bob, 'stripe', country='US', default_currency='USD')
+        carl = self.make_participant('carl')
+        carl_card = self.upsert_route(carl, 'stripe-card')
+        carl.set_tip_to(team, EUR('2.50'))
+        self.make_payin_and_transfer(carl_card, team, EUR('5.00'))
+        carl.set_tip_to(alice, EUR('1.00'))
+        self.make_payin_and_transfer(carl_card, alice, EUR('0.40'))
+        dana = self.make_participant('dana')
+        dana_card = self.upsert_route(dana, 'stripe-card')
+        dana.set_tip_to(team, USD('0.75'))
+        self.make_payin_and_transfer(dana_card, team, USD('0.50'))
+        dana.set_tip_to(bob, USD('2.00'))
+        self.make_payin_and_transfer(dana_card, bob, USD('20.00'))
+        team2 = self.make_participant('team2', kind='group')
+        team2.add_member(alice)
+        dana.set_tip_to(team2, EUR('1.00'))
+
+        def settle():
+            payday = Payday.start()
+            with self.db.get_cursor() as cursor:
+                # Start each run from the same state, so that the cached sums
+                # are recomputed every time.
+                cursor.run("UPDATE tips SET past_transfers_sum = NULL")
+                payday.prepare(cursor, payday.ts_start)
+                payday.transfer_virtually(cursor, payday.ts_start, payday.id)
+                return (
+                    cursor.all("""
+                        SELECT tipper, tippee, amount, context, team
+                          FROM payday_transfers
+                      ORDER BY tipper, tippee, context, team
+                    """),
+                    cursor.all("SELECT id, is_funded FROM payday_tips ORDER BY id"),
+                    cursor.all("SELECT id, leftover FROM payday_participants ORDER BY id"),
+                    cursor.all("SELECT id, past_transfers_sum FROM tips ORDER BY id"),
+                )
+
+        expected = settle()
+        assert expected[0]  # sanity check
+        assert [s for tip_id, s in expected[3] if s is not None]  # sanity check
+        with mock.patch.object(website.env, 'payday_in_memory', True):
+            actual = settle()
+            assert actual == expected
+            with mock.patch.object(website.env, 'payday_processes', 2):
+                actual = settle()
+            assert actual == expected
+
+    def test_transfers_recorded_in_batches(self):
+        team = self.make_participant('team', kind='group')
+        alice = self.make_participant('alice')
+        self.add_payment_account(alice, 'stripe')
+        team.set_take_for(alice, EUR('1.00'), team)
+        bob = self.make_participant('bob')
+        self.add_payment_account(bob, 'stripe')
+        team.set_take_for(bob, EUR('0.50'), team)
+        charlie = self.make_participant('charlie')
+        charlie_card = self.upsert_route(charlie, 'stripe-card')
+        charlie.set_tip_to(team, EUR('1.00'))
+        self.make_payin_and_transfer(charlie_card, team, EUR('10.00'))
+        charlie.set_tip_to(alice, EUR('2.00'))
+        self.make_payin_and_transfer(charlie_card, alice, EUR('20.00'))
+        dana = self.make_participant('dana')
+        dana_card = self.upsert_route(dana, 'stripe-card')
+        dana.set_tip_to(team, EUR('0.50'))
+        self.make_payin_and_transfer(dana_card, team, EUR('5.00'))
+
+        payday = Payday.start()
+        record_transfers = Payday.record_transfers
+
+        def crash_after_first_batch(self, transfers):
+            if f.call_count > 1:
+                raise Foobar
+            record_transfers(self, transfers)
+
+        with mock.patch.object(website.env, 'payday_transfers_batch_size', 2):
+            with mock.patch.object(Payday, 'record_transfers', autospec=True) as f:
+                f.side_effect = crash_after_first_batch
+                with self.assertRaises(Foobar):
+                    payday.shuffle()
+            assert len(self.db.all("SELECT * FROM transfers")) == 2
+            payday.shuffle()
+
+        taken = self.get_taken_sums()
+        assert taken == {
+            alice.id: EUR('1.00'),
+            bob.id: EUR('0.50'),
+        }
+        tips = dict(self.db.all("""
+            SELECT tippee, paid_in_advance FROM current_tips WHERE tipper = %s
+        """, (charlie.id,)))
+        assert tips == {team.id: EUR('9.00'), alice.id: EUR('18.00')}
+        takes_advance = self.db.one("SELECT sum(paid_in_advance) FROM current_takes")
+        assert takes_advance == EUR('13.50')
@@ -0,0 +1,40 @@
+import random
+
+from liberapay.billing import benchmark
+from liberapay.testing import Harness
+
+
+class TestPaydayBenchmark(Harness):
+
+    def test_populate_graph_is_reproducible(self):
+        sizes = dict(participants=10, tips=20, teams=2, members=(2, 3))
+        counts = benchmark.populate_graph(self.db, random.Random(1), **sizes)
+        assert counts == dict(
+            participants=10, teams=2, takes=self.db.one("SELECT count(*) FROM takes"),
+            tips=20,
+        )
+        tips = self.db.all("SELECT tipper, tippee, amount, paid_in_advance FROM tips ORDER BY id")
+        benchmark.wipe_db(self.db)
+        benchmark.populate_graph(self.db, random.Random(1), **sizes)
+        assert self.db.all(
+            "SELECT tipper, tippee, amount, paid_in_advance FROM tips ORDER BY id"
+        ) == tips
+
+    def test_run_benchmark(self):
+        result = benchmark.run_benchmark(self.db, scale=0.01)
+        assert result['graph']['tips'] == 30
+        stages = result['payday_stages']
+        assert stages['transfer_virtually']['calls'] == 1
+        assert stages['transfer_virtually']['queries'] > 0
+        assert 'update_cached_amounts/prepare' in stages
+        assert 'update_cached_amounts/prepare' in result['update_cached_amounts_stages']
+        assert self.db.one("SELECT count(*) FROM paydays") == 1
+
+    def test_run_transfers_benchmark(self):
+        result = benchmark.run_transfers_benchmark(
+            self.client.website, scale=0.01, repeat=1, recipients=2,
+        )
+        assert result['transfers'] > 0
+        assert result['paydays'] == 20
+        assert result['update_stats_seconds'] > 0
+        assert result['charts_seconds'] > 0
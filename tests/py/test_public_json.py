@@ -1,4 +1,7 @@
 import json
+from unittest.mock import patch
+
+from pando import Response
 
 from liberapay.testing import EUR, Harness
 
@@ -70,3 +73,83 @@ class Tests(Harness):
         self.make_participant('alice')
         response = self.client.GET('/alice/public.json')
         assert response.headers[b'Access-Control-Allow-Origin'] == b'*'
+
+
+class TestResponseCache(Harness):
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch.object(self.website.response_cache, 'max_age', 600)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.website.response_cache.invalidate)
+
+    def test_public_json_is_cached_and_invalidated(self):
+        alice = self.make_participant('alice')
+        r = self.client.GET('/alice/public.json')
+        assert json.loads(r.text)['statements'] == []
+        etag = r.headers[b'ETag']
+        # Modify the data behind the cache's back, the response shouldn't change
+        self.db.run("UPDATE participants SET npatrons = 5 WHERE id = %s", (alice.id,))
+        r = self.client.GET('/alice/public.json')
+        assert json.loads(r.text)['npatrons'] == 0
+        assert r.headers[b'ETag'] == etag
+        assert r.headers[b'Access-Control-Allow-Origin'] == b'*'
+        r = self.client.GET('/alice/public.json', HTTP_IF_NONE_MATCH=etag, raise_immediately=False)
+        assert r.code == 304
+        # Now modify the data properly, the cache should be invalidated
+        alice.upsert_statement('en', "Hello!")
+        r = self.client.GET('/alice/public.json')
+        data = json.loads(r.text)
+        assert data['npatrons'] == 5
+        assert data['statements'] == [{'lang': 'en', 'content': "Hello!"}]
+        assert r.headers[b'ETag'] != etag
+
+    def test_widgets_are_cached_and_invalidated(self):
+        alice = self.make_participant('alice')
+        r = self.client.GET('/alice/widgets/receiving.js')
+        assert 'my goal is' not in r.text
+        alice.update_goal(EUR('100.00'))
+        r = self.client.GET('/alice/widgets/receiving.js')
+        assert 'my goal is' in r.text
+        r = self.client.GET('/alice/widgets/button.js')
+        assert '/alice/donate' in r.text
+        alice.change_username('alice2')
+        r = self.client.GET('/alice/widgets/button.js', raise_immediately=False)
+        assert r.code == 404
+
+    def test_private_amounts_are_not_served_from_the_cache(self):
+        alice = self.make_participant('alice')
+        self.client.GET('/alice/widgets/receiving.js')
+        r = self.client.PxST(
+            '/alice/edit/privacy',
+            {'privacy': 'hide_receiving', 'hide_receiving': 'on'},
+            auth_as=alice,
+        )
+        assert r.code == 302
+        r = self.client.GET('/alice/widgets/receiving.js', raise_immediately=False)
+        assert r.code == 403
+
+    def test_least_recently_used_entry_is_dropped(self):
+        cache = self.website.response_cache
+        alice = self.make_participant('alice')
+        bob = self.make_participant('bob')
+        carl = self.make_participant('carl')
+        with patch.object(cache, 'max_size', 2):
+            self.client.GET('/alice/public.json')
+            self.client.GET('/bob/public.json')
+            self.client.GET('/alice/public.json')
+            self.client.GET('/carl/public.json')
+        assert set(cache.keys_by_participant) == {alice.id, carl.id}
+        assert bob.id not in cache.keys_by_participant
+
+    def test_responses_rendered_before_an_invalidation_are_not_stored(self):
+        cache = self.website.response_cache
+        alice = self.make_participant('alice')
+        generation = cache.generation
+        cache.invalidate([alice.id])
+        response = Response(200, b'{}')
+        assert cache.store(('x', b'/alice/public.json', 'en'), alice.id, response, generation) is None
+        assert not cache.entries
+        assert cache.store(('x', b'/alice/public.json', 'en'), alice.id, response, cache.generation)
+        assert len(cache.entries) == 1
@@ -1,7 +1,9 @@
 from email.utils import parsedate
 from hashlib import blake2b
 from http.cookies import SimpleCookie
+from select import select
 from time import gmtime
+from unittest.mock import patch
 
 from babel.messages.catalog import Message
 
@@ -10,9 +12,11 @@ from liberapay.i18n.base import LOCALES
 from liberapay.i18n.currencies import Money
 from liberapay.models.participant import Participant
 from liberapay.security.csrf import CSRF_TOKEN
+from liberapay.security.session_cache import SessionCache
 from liberapay.testing import Harness, postgres_readonly
 from liberapay.testing.emails import EmailHarness
 from liberapay.utils import b64encode_s, find_files
+from liberapay.utils.listener import Listener
 
 
 password = 'password'
@@ -905,3 +909,80 @@ class TestSessions(Harness):
             raise_immediately=False,
         )
         assert r.code == 403, r.text
+
+
+class TestSessionCache(Harness):
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch.object(self.website.session_cache, 'max_age', 60)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.website.session_cache.invalidate)
+
+    def test_valid_sessions_are_cached(self):
+        alice = self.make_participant('alice')
+        session = alice.start_session(suffix='.pw')
+        args = (alice.id, session.id, session.secret)
+        p, state = Participant.authenticate_with_session(*args)
+        assert state == 'valid'
+        assert session.id in self.website.session_cache.entries[alice.id]
+        # Modify the data behind the cache's back, the result shouldn't change
+        self.db.run("UPDATE participants SET username = 'alice2' WHERE id = %s", (alice.id,))
+        p, state = Participant.authenticate_with_session(*args)
+        assert state == 'valid'
+        assert p.username == 'alice'
+        assert p.session.id == session.id
+        assert p.authenticated
+        # An incorrect secret shouldn't be accepted
+        incorrect_secret = str(ord(session.secret[0]) ^ 1) + session.secret[1:]
+        p, state = Participant.authenticate_with_session(alice.id, session.id, incorrect_secret)
+        assert state == 'invalid'
+
+    def test_cached_sessions_are_invalidated(self):
+        alice = self.make_participant('alice')
+        alice.authenticated = True
+        cookies = SimpleCookie()
+        alice.sign_in(cookies, suffix='.pw')
+        args = (alice.id, alice.session.id, alice.session.secret)
+        p, state = Participant.authenticate_with_session(*args)
+        assert state == 'valid'
+        alice.update_status('closed')
+        assert alice.id not in self.website.session_cache.entries
+        p, state = Participant.authenticate_with_session(*args)
+        assert p.status == 'closed'
+        alice.sign_out(cookies)
+        assert alice.id not in self.website.session_cache.entries
+        p, state = Participant.authenticate_with_session(*args)
+        assert state == 'invalid'
+
+    def test_cached_sessions_are_invalidated_by_the_database(self):
+        listener = Listener(self.website.env.database_url)
+        cache = SessionCache(listener, 60)
+        listener.subscribe(SessionCache.CHANNEL, cache.on_notification)
+        listener.poll()
+        self.addCleanup(listener.conn.close)
+
+        def receive_notifications():
+            select([listener.conn], [], [], 0.5)
+            listener.poll()
+
+        alice = self.make_participant('alice')
+        session = alice.start_session(suffix='.pw')
+        args = (alice.id, session.id, session.secret)
+        receive_notifications()
+        with patch.object(self.website, 'session_cache', cache):
+            p, state = Participant.authenticate_with_session(*args)
+            assert state == 'valid'
+            assert session.id in cache.entries[alice.id]
+            # An update which doesn't change anything is ignored
+            self.db.run("UPDATE participants SET username = username WHERE id = %s", (alice.id,))
+            receive_notifications()
+            assert session.id in cache.entries[alice.id]
+            # A real modification evicts the cached session
+            self.db.run("UPDATE participants SET username = 'alice2' WHERE id = %s", (alice.id,))
+            receive_notifications()
+            assert alice.id not in cache.entries
+            p, state = Participant.authenticate_with_session(*args)
+            assert state == 'valid'
+            assert p.username == 'alice2'
@@ -1,9 +1,14 @@
+import gzip
 import json
+from unittest.mock import patch
 
 from pando.http.request import Request
 from pando.http.response import Response
 
+from liberapay.constants import RATE_LIMITS
+from liberapay.exceptions import TooManyRequests
 from liberapay.security import csrf
+from liberapay.security.rate_limiting import LocalRateLimiter
 from liberapay.testing import Harness
 
 
@@ -151,9 +156,26 @@ class Tests2(Harness):
         assert url.startswith('http://localhost/assets/jquery.min.js?etag=')
         r = self.client.GET(url[len('http://localhost'):])
         assert r.headers[b'Cache-Control'] == b'public, max-age=31536000, immutable'
-        assert b'Vary' not in r.headers
+        assert r.headers[b'Vary'] == b'Accept-Encoding'
+        assert r.headers[b'Access-Control-Allow-Origin'] == b'*'
+        assert b'Content-Encoding' not in r.headers
         assert not r.headers.cookie
 
+    def test_precompressed_assets(self):
+        url = self.client.website.asset('base.css', domain=False)
+        with open(self.client.website.www_root + '/assets/base.css', 'rb') as f:
+            expected = f.read()
+        r = self.client.GET(url, HTTP_ACCEPT_ENCODING=b'gzip, deflate')
+        assert r.headers[b'Content-Encoding'] == b'gzip'
+        assert gzip.decompress(r.body) == expected
+        r = self.client.GET(url, HTTP_ACCEPT_ENCODING=b'gzip;q=0')
+        assert b'Content-Encoding' not in r.headers
+        assert r.body == expected
+        r = self.client.GET(url, HTTP_IF_NONE_MATCH=r.headers[b'Etag'], raise_immediately=False)
+        assert r.code == 304
+        r = self.client.GET(url + 'x', raise_immediately=False)
+        assert r.code == 410
+
     def test_caching_of_simplates(self):
         r = self.client.GET('/')
         assert r.headers[b'Cache-Control'] == b'no-cache'
@@ -284,3 +306,40 @@ class Tests2(Harness):
             assert r.headers[b'Cache-Control'] == b'no-cache'
         finally:
             self.website.state_chain.remove('_fail')
+
+    @patch.dict(RATE_LIMITS, {'http-unsafe.user': (3, 3600)})
+    def test_local_rate_limits(self):
+        key = 'http-unsafe.user:1'
+        for i in range(3):
+            assert self.db.hit_rate_limit('http-unsafe.user', 1, TooManyRequests) == 2 - i
+        with self.assertRaises(TooManyRequests):
+            self.db.hit_rate_limit('http-unsafe.user', 1, TooManyRequests)
+        # The hits shouldn't be recorded in the database until the next flush
+        assert self.db.all("SELECT key FROM rate_limiting") == []
+        self.website.rate_limiter.flush()
+        assert self.db.one("SELECT counter FROM rate_limiting WHERE key = %s", (key,)) == 3
+        # Another process should get the global counter during its first flush
+        other_limiter = LocalRateLimiter(self.db)
+        assert other_limiter.hit(key, 3, 3600) == 2
+        other_limiter.flush()
+        assert other_limiter.hit(key, 3, 3600) is None
+        assert self.db.one("SELECT counter FROM rate_limiting WHERE key = %s", (key,)) == 3
+
+    @patch.dict(RATE_LIMITS, {'http-unsafe.user': (3, 3600)})
+    def test_local_rate_limits_are_flushed_without_the_cron_job(self):
+        limiter = LocalRateLimiter(self.db, flush_interval=3600, max_size=1)
+        assert limiter.hit('http-unsafe.user:1', 3, 3600) == 2
+        assert self.db.all("SELECT key FROM rate_limiting") == []
+        # Too many buckets
+        limiter.last_flush -= 1
+        assert limiter.hit('http-unsafe.user:2', 3, 3600) == 2
+        assert self.db.all("SELECT key FROM rate_limiting ORDER BY key") == [
+            'http-unsafe.user:1', 'http-unsafe.user:2',
+        ]
+        # Last flush too old
+        limiter.max_size = 10
+        limiter.last_flush -= 3600
+        assert limiter.hit('http-unsafe.user:1', 3, 3600) == 1
+        assert self.db.one(
+            "SELECT counter FROM rate_limiting WHERE key = 'http-unsafe.user:1'"
+        ) == 2
@@ -1,15 +1,24 @@
 from datetime import date, datetime, timedelta, timezone
 from decimal import Decimal
+import os
+import stat
+from tempfile import TemporaryDirectory
 
+from aspen.http.request import Querystring
 from markupsafe import escape
 from pando.http.response import Response
 from pando.testing.client import DidntRaiseResponse
 
 from liberapay import utils
 from liberapay.i18n.currencies import Money, MoneyBasket
+from liberapay.models import DB
+from liberapay.renderers.scss import compile_scss
 from liberapay.security.csp import CSP
-from liberapay.testing import Harness
+from liberapay.testing import EUR, Harness
 from liberapay.utils import markdown, b64encode_s, b64decode_s, cbor
+from liberapay.utils.http_caching import AssetManifest
+from liberapay.utils.pagination import KeysetPager
+from liberapay.utils.query_cache import InsecureCacheDirectory, SharedQueryCache
 
 
 class Tests(Harness):
@@ -244,3 +253,111 @@ class Tests(Harness):
         csp2 = CSP(csp)
         assert csp == csp2
         assert csp2.directives[b'upgrade-insecure-requests'] == b''
+
+    # Keyset pagination
+    # =================
+
+    def test_keyset_pager_without_row_comparison(self):
+        ids = [
+            self.make_participant('user%i' % i, receiving=EUR(i % 2 + 1)).id
+            for i in range(4)
+        ]
+        sort_key = [("{p}.receiving", 'desc'), ("{p}.id", 'desc')]
+
+        def get_page(qs):
+            pager = KeysetPager(Querystring(qs), 2, sort_key, row_comparison=False)
+            rows = self.db.all("""
+                SELECT p.id
+                  FROM participants p
+                 WHERE {}
+              ORDER BY {}
+                 LIMIT %s
+            """.format(
+                pager.sql_filter("participants {p}", p='p'), pager.sql_order(p='p'),
+            ), (pager.limit,))
+            return pager.process(rows, get_id=lambda row: row)
+
+        assert get_page('') == [ids[3], ids[1]]
+        assert get_page('after=%i' % ids[1]) == [ids[2], ids[0]]
+        assert get_page('before=%i' % ids[2]) == [ids[3], ids[1]]
+
+    # Shared query cache
+    # ==================
+
+    def test_shared_query_cache(self):
+        with TemporaryDirectory() as tmpdir:
+            dbs = [
+                DB(self.website.env.database_url, cache=SharedQueryCache(tmpdir))
+                for i in range(2)
+            ]
+            try:
+                query = "SELECT count(*) FROM participants"
+                assert dbs[0].one(query, max_age=60) == 0
+                self.make_participant('alice')
+                # The second "process" should get the result cached by the first one
+                assert dbs[1].one(query, max_age=60) == 0
+                assert dbs[1].one(query) == 1
+                # Clearing the cache should drop the shared entries too
+                dbs[0].cache.clear()
+                assert os.listdir(tmpdir) == ['locks']
+                assert dbs[0].one(query, max_age=60) == 1
+            finally:
+                for db in dbs:
+                    db.pool.clear()
+
+    def test_shared_query_cache_refuses_unsafe_directories(self):
+        with TemporaryDirectory() as tmpdir:
+            os.chmod(tmpdir, 0o755)
+            with self.assertRaises(InsecureCacheDirectory):
+                SharedQueryCache(tmpdir)
+            os.chmod(tmpdir, 0o700)
+            link = tmpdir + '.link'
+            os.symlink(tmpdir, link)
+            try:
+                with self.assertRaises(InsecureCacheDirectory):
+                    SharedQueryCache(link)
+            finally:
+                os.unlink(link)
+            cache = SharedQueryCache(os.path.join(tmpdir, 'new'))
+            assert stat.S_IMODE(os.stat(cache.directory).st_mode) == 0o700
+
+    def test_compile_scss_cache(self):
+        with TemporaryDirectory() as tmpdir:
+            os.mkdir(tmpdir + '/style')
+            with open(tmpdir + '/style/_colors.scss', 'w') as f:
+                f.write('$fg: #000;\n')
+            src = '@import "style/colors";\nx { color: $fg; }\n'
+            cache_dir = tmpdir + '/cache'
+            css = compile_scss(src, cache_dir, include_paths=tmpdir)
+            assert '#000' in css
+            assert len(os.listdir(cache_dir)) == 1
+            assert compile_scss(src, cache_dir, include_paths=tmpdir) == css
+            # Modifying an imported file should result in a new cache entry
+            with open(tmpdir + '/style/_colors.scss', 'w') as f:
+                f.write('$fg: #fff;\n')
+            assert '#fff' in compile_scss(src, cache_dir, include_paths=tmpdir)
+            assert len(os.listdir(cache_dir)) == 2
+
+    def test_asset_manifest_stores_compressed_assets(self):
+        request_processor = self.client.website.request_processor
+        with TemporaryDirectory() as tmpdir:
+            assets_root = tmpdir + '/assets/'
+            os.mkdir(assets_root)
+            with open(assets_root + 'a.css', 'w') as f:
+                f.write('x { color: #000; }\n' * 50)
+            with open(assets_root + 'b.png', 'wb') as f:
+                f.write(b'\x89PNG' * 50)
+            cache_dir = tmpdir + '/cache'
+            manifest = AssetManifest(assets_root)
+            manifest.build(request_processor, cache_dir)
+            asset = manifest.assets['/assets/a.css']
+            assert set(asset.bodies) == {'identity', 'gzip'}
+            assert set(manifest.assets['/assets/b.png'].bodies) == {'identity'}
+            assert len(os.listdir(cache_dir)) == 1
+            # The next build should load the compressed file instead of recreating it
+            cache_path = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+            with open(cache_path, 'wb') as f:
+                f.write(b'cached')
+            manifest = AssetManifest(assets_root)
+            manifest.build(request_processor, cache_dir)
+            assert manifest.assets['/assets/a.css'].bodies['gzip'] == b'cached'